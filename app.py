@@ -1,13 +1,18 @@
 import time
 import os
+import threading
 import cv2
+from datetime import datetime, timedelta
 from functools import wraps
 from flask import Flask, Response, render_template_string, jsonify, request, send_file, session, redirect, url_for
 
 from config import system_settings, cameras_config, network_status, save_settings, save_cameras_config, WG_CONFIG_FILE
 from database import db
 from utils import get_hw_stats
-from camera import active_cameras, start_camera, stop_remove_camera, init_cameras
+from camera import active_cameras, start_camera, stop_remove_camera, init_cameras, model_status
+from streaming import streamer_for
+import metrics
+import profiler
 
 # ==========================================
 # 6. WEB SERVER
@@ -115,6 +120,7 @@ DASHBOARD_PAGE = """
                     <div class="feed-container">
                         <img src="{{ url_for('video_feed', cam_id=cam_id) }}" class="camera-feed" id="img-{{ cam_id }}">
                     </div>
+                    <div class="text-center mt-1"><a href="{{ url_for('api_snapshot_full', cam_id=cam_id) }}" target="_blank" class="small"><i class="bi bi-camera"></i> Full-res snapshot</a></div>
                     <div class="row g-2 mt-2 justify-content-center">
                         <div class="col-3 text-center border-bottom border-success border-3 py-2 bg-white rounded mx-1"><small>IN</small><h4 class="text-success m-0" id="in-{{ cam_id }}">0</h4></div>
                         <div class="col-3 text-center border-bottom border-warning border-3 py-2 bg-white rounded mx-1"><small>OUT</small><h4 class="text-dark m-0" id="out-{{ cam_id }}">0</h4></div>
@@ -161,7 +167,7 @@ DASHBOARD_PAGE = """
                         <div class="mb-2"><label>VPN Check IP</label><input type="text" class="form-control" name="vpn_server_ip" value="{{ settings.vpn_server_ip }}"></div>
                         <div class="row mb-2"><div class="col"><label>Open (Hr)</label><input type="number" class="form-control" name="open_hour" value="{{ settings.open_hour }}"></div><div class="col"><label>Close (Hr)</label><input type="number" class="form-control" name="close_hour" value="{{ settings.close_hour }}"></div></div>
                         <button type="button" onclick="saveSystem()" class="btn btn-success w-100 mt-2">Save & Restart</button>
-                    </form></div></div></div><div class="col-md-6 mb-3"><div class="card h-100"><div class="card-header bg-dark text-white">Cameras</div><div class="card-body p-0"><ul class="list-group list-group-flush">{% for cam_id, data in cameras_config.items() %}<li class="list-group-item d-flex justify-content-between align-items-center"><div><strong>{{ data.config.name }}</strong><br><small class="text-muted text-truncate d-inline-block" style="max-width: 200px;">{{ data.url }}</small></div><button class="btn btn-sm btn-danger" onclick="delCam('{{ cam_id }}')">Del</button></li>{% endfor %}</ul><div class="p-3 border-top"><input type="text" id="newCamName" class="form-control mb-2" placeholder="Name"><input type="text" id="newCamUrl" class="form-control mb-2" placeholder="RTSP URL"><button onclick="addCam()" class="btn btn-primary w-100">Add Camera</button></div></div></div></div></div></div>
+                    </form></div></div></div><div class="col-md-6 mb-3"><div class="card h-100"><div class="card-header bg-dark text-white">Cameras</div><div class="card-body p-0"><ul class="list-group list-group-flush">{% for cam_id, data in cameras_config.items() %}<li class="list-group-item d-flex justify-content-between align-items-center"><div><strong>{{ data.config.name }}</strong><br><small class="text-muted text-truncate d-inline-block" style="max-width: 200px;">{{ data.url }}</small></div><button class="btn btn-sm btn-danger" onclick="delCam('{{ cam_id }}')">Del</button></li>{% endfor %}</ul><div class="p-3 border-top"><input type="text" id="newCamName" class="form-control mb-2" placeholder="Name"><input type="text" id="newCamUrl" class="form-control mb-2" placeholder="RTSP URL"><input type="text" id="newCamSubUrl" class="form-control mb-2" placeholder="Sub-stream RTSP URL (optional, for AI)"><button onclick="addCam()" class="btn btn-primary w-100">Add Camera</button></div></div></div></div></div></div>
             <div class="tab-pane fade" id="network"><div class="card"><div class="card-header bg-warning text-dark">WireGuard Config (Local on Windows: copy to WG App)</div><div class="card-body"><textarea id="wgConfig" class="form-control mb-3" rows="8"></textarea><button onclick="saveWG()" class="btn btn-success w-100">Save Config</button></div></div></div>
         </div>
     </div>
@@ -246,7 +252,7 @@ DASHBOARD_PAGE = """
             if(key === 'cashier_mode') { document.getElementById('cashier-ctrl-'+id).style.display = val ? 'flex' : 'none'; document.getElementById('line-ctrl-'+id).style.display = val ? 'none' : 'flex'; }
         }
         function saveSystem() { const formData = new FormData(document.getElementById('sysForm')); const data = Object.fromEntries(formData.entries()); data.open_hour = parseInt(data.open_hour); data.close_hour = parseInt(data.close_hour); if(confirm("Confirm Restart?")) fetch('/api/settings', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify(data) }).then(() => { alert("Restarting..."); setTimeout(() => location.reload(), 5000); }); }
-        function addCam() { const name = document.getElementById('newCamName').value; const url = document.getElementById('newCamUrl').value; if(!name || !url) return alert("Required fields missing"); fetch('/api/camera/add', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({name, url}) }).then(() => location.reload()); }
+        function addCam() { const name = document.getElementById('newCamName').value; const url = document.getElementById('newCamUrl').value; const sub_url = document.getElementById('newCamSubUrl').value; if(!name || !url) return alert("Required fields missing"); fetch('/api/camera/add', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({name, url, sub_url}) }).then(() => location.reload()); }
         function delCam(id) { if(confirm("Delete?")) fetch('/api/camera/delete', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({id}) }).then(() => location.reload()); }
         function loadWG() { fetch('/api/network/wg-config').then(r => r.json()).then(d => document.getElementById('wgConfig').value = d.config); }
         function saveWG() { fetch('/api/network/wg-config', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({config: document.getElementById('wgConfig').value}) }).then(() => alert("Saved. Reboot required.")); }
@@ -322,36 +328,88 @@ def index():
 @login_required
 def video_feed(cam_id):
     if cam_id not in active_cameras: return "404", 404
-    def gen(cam):
-        while True:
-            frame = cam.get_frame()
-            if frame is not None:
-                (flag, enc) = cv2.imencode(".jpg", frame)
-                if flag: yield(b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + bytearray(enc) + b'\r\n')
-            else: time.sleep(0.1)
-    return Response(gen(active_cameras[cam_id]), mimetype='multipart/x-mixed-replace; boundary=frame')
+    # ?w=<กว้าง>&q=<คุณภาพ JPEG> : ทุกคนที่ขอค่าเดียวกันใช้ JPEG ชุดเดียวกัน
+    stream = streamer_for(active_cameras[cam_id]).mjpeg(request.args.get('w', type=int), request.args.get('q', type=int))
+    return Response(stream, mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/snapshot/<cam_id>')
+@login_required
+def snapshot(cam_id):
+    if cam_id not in active_cameras: return "404", 404
+    jpeg = streamer_for(active_cameras[cam_id]).snapshot(request.args.get('w', type=int), request.args.get('q', type=int))
+    if jpeg is None: return "Snapshot unavailable", 503
+    return Response(jpeg, mimetype='image/jpeg', headers={'Cache-Control': 'no-store'})
+
+@app.route('/api/snapshot/<cam_id>/full')
+@login_required
+def api_snapshot_full(cam_id):
+    if cam_id not in active_cameras: return "404", 404
+    frame = active_cameras[cam_id].get_snapshot()
+    if frame is None: return "Snapshot unavailable", 503
+    (flag, enc) = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not flag: return "Encode failed", 500
+    return Response(enc.tobytes(), mimetype='image/jpeg')
 
 @app.route('/api/stats')
 @login_required
 def api_stats():
     mode = request.args.get('mode', 'hourly')
     stats = {cid: cam.stats for cid, cam in active_cameras.items()}
+    gating = {cid: cam.motion_gate.stats for cid, cam in active_cameras.items()}
     
-    chart_data = {}
-    if mode == 'hourly': chart_data = db.get_hourly_stats()
-    elif mode == 'daily': chart_data = db.get_daily_stats()
-    elif mode == 'monthly': chart_data = db.get_monthly_stats()
+    # กราฟและจำนวน pending มาจาก StatsCache ในหน่วยความจำ (ไม่แตะ DB ไม่ว่าเปิด Dashboard กี่หน้า)
+    chart_data = db.cache.get(mode)
 
     return jsonify({
-        "network": network_status, "hw": get_hw_stats(), "pending": db.count_pending(), 
-        "cameras": stats, "chart_data": chart_data
+        "network": network_status, "hw": get_hw_stats(), "pending": db.cache.pending, 
+        "cameras": stats, "gating": gating, "model": model_status, "metrics": metrics.snapshot(), "chart_data": chart_data
     })
 
+@app.route('/metrics')
+def prometheus_metrics():
+    # Prometheus ล็อกอินไม่ได้: ใช้ ?token= หรือ Authorization: Bearer <metrics_token> (ถ้าไม่ได้ตั้ง token ต้องล็อกอินเหมือนหน้าอื่น)
+    token = system_settings.get('metrics_token')
+    supplied = request.args.get('token') or request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not session.get('logged_in') and not (token and supplied == token): return "Unauthorized", 401
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# Sampling Profiler: POST {"seconds": 30, "interval_ms": 10} แล้วดาวน์โหลดไฟล์ .folded ไปเปิดด้วย flamegraph/speedscope
+@app.route('/api/profile', methods=['GET', 'POST'])
+@login_required
+def api_profile():
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try: name = profiler.start(data.get('seconds', 30), data.get('interval_ms', 10))
+        except (TypeError, ValueError): return jsonify({"status": "error", "message": "invalid seconds/interval_ms"}), 400
+        if name is None: return jsonify({"status": "busy", "running": profiler.status()}), 409
+        return jsonify({"status": "started", "name": name})
+    return jsonify({"running": profiler.status(), "profiles": profiler.list_profiles()})
+
+@app.route('/api/profile/<name>')
+@login_required
+def api_profile_download(name):
+    path = profiler.profile_path(name)
+    if path is None: return "404", 404
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=name)
+
+def _parse_time(value, end=False):
+    """'YYYY-MM-DD' หรือ 'YYYY-MM-DDTHH:MM' (เวลาท้องถิ่น) / to แบบวันที่อย่างเดียวรวมทั้งวันนั้น"""
+    if not value: return None
+    t = datetime.fromisoformat(value)
+    return t + timedelta(days=1) if end and len(value) == 10 else t
+
+# ?from=&to=&cam_id=&include_staff=0&group=hourly|daily&gzip=1 : ส่งแบบ Stream ทีละช่วง (ไม่โหลดทั้งไฟล์เข้า RAM)
 @app.route('/api/export')
 @login_required
 def api_export():
-    csv_io = db.export_csv()
-    return send_file(csv_io, mimetype='text/csv', as_attachment=True, download_name=f'export_{int(time.time())}.csv')
+    group = request.args.get('group', 'raw')
+    if group not in db.EXPORTS: return jsonify({"status": "error", "message": "group must be raw, hourly or daily"}), 400
+    try: start, end = _parse_time(request.args.get('from')), _parse_time(request.args.get('to'), end=True)
+    except ValueError: return jsonify({"status": "error", "message": "from/to must be YYYY-MM-DD or YYYY-MM-DDTHH:MM"}), 400
+    compress = request.args.get('gzip') == '1'
+    stream = db.export_csv(start, end, request.args.get('cam_id') or None, request.args.get('include_staff', '1') != '0', group, compress)
+    name = f"export_{group}_{int(time.time())}.csv" + (".gz" if compress else "")
+    return Response(stream, mimetype='application/gzip' if compress else 'text/csv', headers={'Content-Disposition': f'attachment; filename={name}'})
 
 # API Configs (ป้องกันทั้งหมด)
 @app.route('/api/config/<cam_id>', methods=['POST'])
@@ -366,7 +424,7 @@ def api_save_settings():
     global system_settings
     system_settings.update(request.json)
     save_settings()
-    def restart(): time.sleep(1); os._exit(0)
+    def restart(): time.sleep(1); db.flush(); os._exit(0)
     threading.Thread(target=restart).start()
     return jsonify({"status": "restarting"})
 
@@ -376,6 +434,7 @@ def api_add_cam():
     data = request.json
     new_id = f"cam{int(time.time())}"
     new_config = {"url": data['url'], "config": {"name": data['name'], "line_ratio": 0.5, "line_pos_x": 0.5, "offset_ratio": 0.05, "line_angle": 0, "line_length": 1.0}}
+    if data.get('sub_url'): new_config['config']['sub_url'] = data['sub_url']
     cameras_config[new_id] = new_config
     save_cameras_config()
     start_camera(new_id, new_config['url'], new_config['config'])
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from functools import wraps
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse, RedirectResponse
+from starlette.routing import Route, Mount
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+from config import system_settings
+from app import app as flask_app
+from camera import active_cameras
+from streaming import streamer_for
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 6.2 ASGI SERVER (server_mode = "asgi")
+# ==========================================
+# ภาพสด (MJPEG/snapshot) เป็น Coroutine บน Event loop เดียว ไม่จอง Thread ต่อคนดู
+# Route อื่นทั้งหมดส่งต่อให้ Flask app เดิมผ่าน WSGI (ทำงานใน Thread pool)
+_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+
+
+def logged_in(request):
+    """อ่าน Session cookie ของ Flask (ลงลายเซ็นด้วย itsdangerous) แบบเดียวกับ login_required"""
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie or _serializer is None: return False
+    try:
+        max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        return bool(_serializer.loads(cookie, max_age=max_age).get('logged_in'))
+    except Exception:
+        return False
+
+
+def login_required(f):
+    @wraps(f)
+    async def decorated_function(request):
+        if not logged_in(request): return RedirectResponse('/login', status_code=302)
+        return await f(request)
+    return decorated_function
+
+
+def _int_arg(request, name):
+    try: return int(request.query_params[name])
+    except (KeyError, ValueError): return None
+
+
+async def mjpeg(streamer, width, quality):
+    """ส่ง JPEG ใหม่ทุกครั้งที่ Streamer encode เสร็จ (เช็คทุกครึ่งช่วงเฟรม ไม่ block event loop)"""
+    variant = streamer.subscribe(width, quality)
+    try:
+        last_id = 0
+        while streamer.cam.running:
+            current = variant.id
+            if current > last_id:
+                last_id, jpeg = current, variant.jpeg
+                yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+            await asyncio.sleep(0.5 / max(1, float(system_settings.get('stream_fps', 10))))
+    finally:
+        streamer.unsubscribe(variant)
+
+
+@login_required
+async def video_feed(request):
+    cam = active_cameras.get(request.path_params['cam_id'])
+    if cam is None: return Response("404", status_code=404)
+    stream = mjpeg(streamer_for(cam), _int_arg(request, 'w'), _int_arg(request, 'q'))
+    return StreamingResponse(stream, media_type='multipart/x-mixed-replace; boundary=frame')
+
+
+@login_required
+async def snapshot(request):
+    cam = active_cameras.get(request.path_params['cam_id'])
+    if cam is None: return Response("404", status_code=404)
+    jpeg = await asyncio.to_thread(streamer_for(cam).snapshot, _int_arg(request, 'w'), _int_arg(request, 'q'))
+    if jpeg is None: return Response("Snapshot unavailable", status_code=503)
+    return Response(jpeg, media_type='image/jpeg', headers={'Cache-Control': 'no-store'})
+
+
+asgi_app = Starlette(routes=[
+    Route('/video_feed/{cam_id}', video_feed),
+    Route('/snapshot/{cam_id}', snapshot),
+    Mount('/', app=WSGIMiddleware(flask_app)),
+])
+
+
+def run(host='0.0.0.0', port=5000):
+    import uvicorn
+    logger.info(f"Starting ASGI server on {host}:{port}")
+    uvicorn.run(asgi_app, host=host, port=port, log_level="warning", access_log=False)
@@ -1,55 +1,199 @@
 import cv2
 import time
 import threading
-import math
 import datetime
 import json
 import os
+import yaml
 import numpy as np
-from ultralytics import YOLO
+from collections import namedtuple
 
-from config import IS_WINDOWS, UNIFORM_COLORS, system_settings, cameras_config, save_cameras_config, network_status
+from config import IS_WINDOWS, MODEL_SELECTION_FILE, OV_CACHE_DIR, system_settings, cameras_config, save_cameras_config, network_status
 from database import db
-from mqtt import mqtt_client
+from mqtt import mqtt_client, event_topic
+from inference import InferenceScheduler
+from tracker import Tracker, xyxy_to_cxcywh
+from motion import MotionGate
+from uniform import UniformClassifier
+from counting import CountingEngine
+from metrics import STAGE_SECONDS, CAPTURE_DECODE_SECONDS, CAPTURE_FRAMES, CAMERA_FPS, INFER_QUEUE, MQTT_PUBLISH_SECONDS, MQTT_MESSAGES
+from ov_engine import OpenVINODetector
 
 # ==========================================
 # AI MODEL SETUP (OpenVINO Support)
 # ==========================================
+# โหลดโมเดลใน Thread เบื้องหลัง (start_model_warmup) ไม่ทำตอน import
+# ระหว่างรอ กล้องยังดึงภาพและแสดงผลได้ตามปกติ แค่ยังไม่รัน Detector
 MODEL_NAME = "yolov8n"
 OPENVINO_DIR = f"{MODEL_NAME}_openvino_model"
 
-print("⏳ Checking AI Model...")
+shared_model, ov_detector = None, None
+# IR แบบ static shape รับได้เฉพาะขนาด input ตอน Export (imgsz อื่นจะถูกบังคับเป็นค่านี้)
+fixed_imgsz = None
+# โมเดลรับหลายเฟรมใน predict เดียวได้หรือไม่ (ตัดสินตอนโหลดจาก metadata.yaml: batch > 1 หรือ dynamic)
+batch_supported = False
+model_status = {"state": "idle", "backend": None, "model_dir": None, "phases": {}, "error": None}
+_warmup_lock = threading.Lock()
+_warmup_thread = None
 
-# 1. ตรวจสอบว่ามีโฟลเดอร์ OpenVINO หรือยัง ถ้าไม่มีให้ทำการ Export
-if not os.path.exists(OPENVINO_DIR):
-    print(f"⚙️ OpenVINO model not found. Exporting {MODEL_NAME}.pt to OpenVINO format...")
+def _phase(name, t0):
+    elapsed = time.perf_counter() - t0
+    model_status['phases'][name] = round(elapsed, 3)
+    print(f"⏱️ Model {name}: {elapsed:.2f}s")
+
+def load_model():
+    """Export (ถ้าจำเป็น) -> เลือก Variant -> โหลด/คอมไพล์ คืนค่าฟังก์ชัน detect สำหรับ Scheduler"""
+    global shared_model, ov_detector, fixed_imgsz, batch_supported
+    from ultralytics import YOLO
+
+    print("⏳ Checking AI Model...")
+    # 1. ตรวจสอบว่ามีโฟลเดอร์ OpenVINO หรือยัง ถ้าไม่มีให้ทำการ Export
+    t0 = time.perf_counter()
+    if not os.path.exists(OPENVINO_DIR):
+        print(f"⚙️ OpenVINO model not found. Exporting {MODEL_NAME}.pt to OpenVINO format...")
+        try:
+            # โหลดโมเดล PyTorch ปกติมาเพื่อ Export
+            model = YOLO(f"{MODEL_NAME}.pt")
+            # Export เป็น OpenVINO แบบ FP32 (ค่าอ้างอิง) ส่วน FP16/INT8 ให้ model_prep.py วัดแล้วเลือกเอง (data/models/selected.json)
+            model.export(format="openvino", half=False)
+            print("✅ Export Success!")
+        except Exception as e:
+            print(f"❌ Export failed: {e}. Fallback to PyTorch model.")
+        _phase("export", t0)
+
+    # 2. เลือก IR ที่ model_prep.py benchmark แล้วเลือกไว้ (FP32/FP16/INT8) ถ้าไม่มีใช้ OPENVINO_DIR เดิม
+    model_dir = OPENVINO_DIR
+    if os.path.exists(MODEL_SELECTION_FILE):
+        try:
+            with open(MODEL_SELECTION_FILE, 'r', encoding='utf-8') as f: selection = json.load(f)
+            if os.path.exists(os.path.join(selection['path'], f"{MODEL_NAME}.xml")):
+                model_dir = selection['path']
+                print(f"📦 Using {selection['variant']} model variant: {model_dir}")
+        except Exception as e:
+            print(f"⚠️ Could not read model selection: {e}")
+    model_status['model_dir'] = model_dir
+
+    # 3. โหลดโมเดล
+    # inference_backend = "openvino" (ค่าเริ่มต้น): OpenVINO runtime โดยตรง (ov_engine) ใช้ CACHE_DIR ได้ ไม่ต้องคอมไพล์ IR ใหม่ทุกครั้งที่เปิด
+    # "ultralytics": ผ่าน YOLO wrapper (Fallback เมื่อโหลดไม่ได้) คอมไพล์ใหม่ทุกครั้งเพราะ ultralytics ไม่เปิดให้ตั้ง Cache
+    t0 = time.perf_counter()
+    if system_settings.get('inference_backend', 'openvino') == 'openvino' and os.path.exists(model_dir):
+        try:
+            print(f"🚀 Loading OpenVINO Runtime Detector: {model_dir}")
+            # CACHE_DIR: เก็บ Blob ที่คอมไพล์แล้ว รอบถัดไปโหลดจาก Cache ไม่ต้องคอมไพล์ใหม่
+            ov_detector = OpenVINODetector(os.path.join(model_dir, f"{MODEL_NAME}.xml"), cache_dir=OV_CACHE_DIR)
+            model_status['backend'] = "openvino"
+            _phase("load", t0)
+            return ov_detector.detect
+        except Exception as e:
+            print(f"❌ OpenVINO runtime load failed: {e}. Fallback to ultralytics.")
+
+    if os.path.exists(model_dir):
+        print(f"🚀 Loading OpenVINO Model: {model_dir}")
+        shared_model = YOLO(model_dir, task="detect")
+        try:
+            with open(os.path.join(model_dir, "metadata.yaml"), encoding='utf-8') as f: meta = yaml.safe_load(f)
+            dynamic = bool(meta.get('args', {}).get('dynamic', False))
+            if not dynamic: fixed_imgsz = meta['imgsz']
+            # IR แบบ static batch=1 (ค่าเริ่มต้นของ export) รับได้ทีละเฟรม
+            batch_supported = dynamic or int(meta.get('batch', 1)) > 1
+        except Exception as e:
+            print(f"⚠️ Could not read model metadata: {e}")
+        print(f"ℹ️ Batched inference: {'on' if batch_supported else 'off (static batch=1 IR, frames run one by one)'}")
+    else:
+        print(f"⚠️ Loading Standard PyTorch Model: {MODEL_NAME}.pt")
+        shared_model = YOLO(f"{MODEL_NAME}.pt")
+        batch_supported = True
+        try:
+            shared_model.fuse()
+        except: pass
+    model_status['backend'] = "ultralytics"
+    _phase("load", t0)
+    return detect_batch
+
+def _warn_static_roi():
+    """roi_inference ลดขนาด input ได้เฉพาะโมเดล dynamic shape: IR แบบ static จะถูกบังคับกลับเป็นขนาดตอน Export (ไม่เร็วขึ้น)"""
+    static = ov_detector.imgsz if ov_detector else fixed_imgsz
+    if not static: return
+    size = static if isinstance(static, int) else max(static)
+    for cam_id, data in cameras_config.items():
+        cfg = data.get('config') or {}
+        if cfg.get('roi_inference', False) and int(cfg.get('roi_imgsz', 320)) != size:
+            print(f"⚠️ [{cam_id}] roi_inference asks for imgsz {cfg.get('roi_imgsz', 320)} but {model_status['model_dir']} is a static {size}x{size} model. "
+                  f"ROI crops run at {size} (no speedup). Build a dynamic-shape model with 'python model_prep.py build'.")
+
+def _warmup():
+    t_start = time.perf_counter()
+    model_status['state'] = "loading"
     try:
-        # โหลดโมเดล PyTorch ปกติมาเพื่อ Export
-        model = YOLO(f"{MODEL_NAME}.pt")
-        # สั่ง Export เป็น OpenVINO (half=True เพื่อความเร็วและประหยัดแรม)
-        model.export(format="openvino", half=True)
-        print("✅ Export Success!")
+        detect_fn = load_model()
+        # รันเฟรมเปล่าหนึ่งครั้งให้ Backend คอมไพล์/จองหน่วยความจำให้เสร็จก่อนรับงานจริง
+        t0 = time.perf_counter()
+        detect_fn([np.zeros((480, 640, 3), dtype=np.uint8)], 0.5)
+        _phase("warmup", t0)
+        _warn_static_roi()
+        scheduler.set_detector(detect_fn)
+        model_status['state'] = "ready"
+        _phase("total", t_start)
+        print("✅ Model Ready!")
     except Exception as e:
-        print(f"❌ Export failed: {e}. Fallback to PyTorch model.")
-
-# 2. โหลดโมเดล (เลือก OpenVINO ถ้ามี ถ้าไม่มีใช้ .pt เหมือนเดิม)
-if os.path.exists(OPENVINO_DIR):
-    print(f"🚀 Loading OpenVINO Model: {OPENVINO_DIR}")
-    shared_model = YOLO(OPENVINO_DIR, task="detect")
-else:
-    print(f"⚠️ Loading Standard PyTorch Model: {MODEL_NAME}.pt")
-    shared_model = YOLO(f"{MODEL_NAME}.pt")
-    try:
-        shared_model.fuse()
-    except: pass
+        model_status['state'], model_status['error'] = "error", str(e)
+        print(f"❌ Model load failed: {e}")
 
-print("✅ Model Ready!")
+def start_model_warmup():
+    """เริ่มโหลดโมเดลใน Thread เบื้องหลัง (เรียกซ้ำได้ จะเริ่มแค่ครั้งเดียว)"""
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_warmup, name="model-warmup", daemon=True)
+            _warmup_thread.start()
 
-model_lock = threading.Lock()
+def detect_batch(frames, conf, imgsz=640):
+    """รัน YOLO กับหลายเฟรมพร้อมกัน คืนค่า array [x1, y1, x2, y2, conf, cls] ของแต่ละเฟรม"""
+    global batch_supported
+    imgsz = fixed_imgsz or imgsz
+    if batch_supported and len(frames) > 1:
+        try:
+            results = shared_model.predict(frames, imgsz=imgsz, classes=[0], conf=conf, verbose=False)
+            return [r.boxes.data.cpu().numpy() for r in results]
+        except (RuntimeError, ValueError) as e:
+            # metadata บอกว่ารับ batch ได้แต่โมเดลปฏิเสธขนาด input -> รันทีละเฟรมแทน / Error อื่น (OOM, Driver) ส่งต่อให้ Scheduler รายงาน
+            if not any(k in str(e).lower() for k in ("shape", "batch", "dimension")): raise
+            batch_supported = False
+            print(f"⚠️ Model does not accept batched input ({e}). Using sequential inference.")
+    return [shared_model.predict(f, imgsz=imgsz, classes=[0], conf=conf, verbose=False)[0].boxes.data.cpu().numpy() for f in frames]
+
+scheduler = InferenceScheduler(
+    max_batch=system_settings.get('infer_max_batch', 4),
+    max_wait=system_settings.get('infer_max_wait_ms', 15) / 1000.0
+)
+INFER_QUEUE.callback = lambda: [({}, len(scheduler.pending))]
+
+# เฟรมจาก Ring Buffer: image เป็น view แบบอ่านอย่างเดียว (ไม่ copy)
+# ข้อมูลใน slot จะถูกเขียนทับหลังจากมีเฟรมใหม่เข้ามาอีก ring_size เฟรม ผู้ใช้ต้องประมวลผลให้เสร็จก่อนนั้น
+Frame = namedtuple("Frame", ["seq", "ts", "image"])
+# สิ่งที่ต้องวาดบนเฟรม seq (พิกัดเต็มเฟรม) เก็บไว้วาดจริงเมื่อมีคนดูภาพเท่านั้น
+# boxes = [x1, y1, x2, y2], staff = mask พนักงาน, hits = จุดที่นับผ่านเส้น, filled = id โซนที่เพิ่ง checkout
+Scene = namedtuple("Scene", ["seq", "lines", "zones", "boxes", "staff", "hits", "filled", "loading"])
+
+def record_event(payload):
+    """ส่ง Event นับคนขึ้น MQTT (ถ้าเชื่อมต่ออยู่) และบันทึกลง DB / พนักงานเก็บเฉพาะ history"""
+    if payload.get('is_staff', 0) == 1:
+        db.save_history_only(payload)
+    elif network_status['mqtt']:
+        with MQTT_PUBLISH_SECONDS.time(): mqtt_client.publish(event_topic(payload), json.dumps(payload))
+        MQTT_MESSAGES.inc(source="live", result="sent")
+        db.save_history_only(payload)
+    else: db.save(payload)
 
 class VideoCaptureThread:
-    def __init__(self, src):
+    def __init__(self, src, ring_size=None, target_fps=0, replay=None, name=None):
         self.src = src
+        # name (cam_id): label ของ metric / None = ไม่บันทึก (เช่นเปิด Main stream ชั่วคราว)
+        self.name = name
+        # replay (ไฟล์วิดีโอ): "fast" = เร็วที่สุดโดยรอให้ประมวลผลครบทุกเฟรม, "realtime" = ตามเวลาของคลิป
+        # ทั้งสองแบบใช้เวลาในคลิปเป็น timestamp ของเฟรม และหยุดเมื่อจบไฟล์
+        self.replay = replay
         # เลือก Driver ให้เหมาะสม
         if str(src).isdigit():
             self.src = int(src)
@@ -61,233 +205,432 @@ class VideoCaptureThread:
             # ใช้ FFMPEG สำหรับ RTSP
             self.stream = cv2.VideoCapture(self.src, cv2.CAP_FFMPEG)
             
-        self.grabbed, self.frame = self.stream.read()
+        self.ring_size = max(2, int(ring_size or system_settings.get('capture_ring_size', 8)))
+        self.ring = None
+        self.ring_ts = [0.0] * self.ring_size
+        # target_fps > 0: grab() ทุกเฟรมเพื่อไม่ให้ Buffer ค้าง แต่ retrieve() (แปลงสี + คัดลอก) เฉพาะตามอัตราที่ต้องใช้
+        self.min_interval = 1.0 / target_fps if target_fps and target_fps > 0 else 0
+        self.last_decode = float('-inf')
+        self.seq = 0
+        self.consumed = 0
         self.stopped = False
-        self.lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.grabbed = False
+        self.started = time.monotonic()
+        grabbed, frame = self.stream.read()
+        if grabbed: self.publish(frame, self.clock() if replay else None)
     
     def start(self):
-        threading.Thread(target=self.update, args=(), daemon=True).start()
+        threading.Thread(target=self.update, args=(), name=f"capture-{self.name or 'main'}", daemon=True).start()
         return self
+
+    def clock(self):
+        return self.stream.get(cv2.CAP_PROP_POS_MSEC) / 1000.0 if self.replay else time.monotonic()
+
+    def publish(self, frame, ts=None):
+        """คัดลอกเฟรมลง slot ถัดไปของ Ring Buffer (จองหน่วยความจำครั้งเดียว)"""
+        if self.ring is None or self.ring.shape[1:] != frame.shape:
+            self.ring = np.empty((self.ring_size,) + frame.shape, dtype=frame.dtype)
+        slot = (self.seq + 1) % self.ring_size
+        target = self.ring[slot]
+        if not np.may_share_memory(frame, target): np.copyto(target, frame)
+        with self.cond:
+            self.ring_ts[slot] = time.time() if ts is None else ts
+            self.seq += 1
+            self.grabbed = True
+            self.cond.notify_all()
     
     def update(self):
         while not self.stopped:
             try:
-                grabbed, frame = self.stream.read()
-                with self.lock:
-                    self.grabbed = grabbed
-                    if grabbed: self.frame = frame
-                
-                if not grabbed: 
+                if not self.stream.grab():
+                    if self.replay:
+                        # จบไฟล์: รอให้เฟรมสุดท้ายถูกประมวลผลก่อน (โหมด fast) แล้วหยุด
+                        with self.cond:
+                            if self.replay == "fast": self.cond.wait_for(lambda: self.stopped or self.consumed >= self.seq)
+                            self.stopped = True
+                            self.cond.notify_all()
+                        break
+                    with self.cond: self.grabbed = False
                     time.sleep(0.2)
+                    continue
+                now = self.clock()
+                # เผื่อ 1ms: timestamp ของไฟล์วิดีโอเป็นจำนวนเต็ม ms ปัดเศษแล้วอาจขาดไปเล็กน้อย
+                if now - self.last_decode < self.min_interval - 0.001:
+                    if self.name: CAPTURE_FRAMES.inc(cam=self.name, result="skipped")
+                    continue
+                self.last_decode = now
+                if self.replay == "realtime":
+                    time.sleep(max(0.0, self.started + now - time.monotonic()))
+                elif self.replay == "fast":
+                    with self.cond: self.cond.wait_for(lambda: self.stopped or self.consumed >= self.seq)
+                # ถอดรหัสลง slot ถัดไปโดยตรง (ถ้าขนาดตรงกัน OpenCV จะเขียนทับ array เดิม)
+                dst = self.ring[(self.seq + 1) % self.ring_size] if self.ring is not None else None
+                t0 = time.perf_counter()
+                grabbed, frame = self.stream.retrieve(dst) if dst is not None else self.stream.retrieve()
+                if grabbed:
+                    if self.name:
+                        CAPTURE_DECODE_SECONDS.observe(time.perf_counter() - t0, cam=self.name)
+                        CAPTURE_FRAMES.inc(cam=self.name, result="decoded")
+                    self.publish(frame, now if self.replay else None)
             except Exception:
                 time.sleep(1)
 
+    def _frame(self, seq):
+        slot = seq % self.ring_size
+        image = self.ring[slot].view()
+        image.flags.writeable = False
+        return Frame(seq, self.ring_ts[slot], image)
+
+    def get(self, seq):
+        """เฟรมหมายเลข seq ถ้ายังไม่ถูกเขียนทับ (slot ถัดจากเฟรมล่าสุดอาจกำลังถูกเขียนอยู่) ไม่งั้นคืนค่า None"""
+        with self.cond:
+            if not self.grabbed or not 0 <= self.seq - seq <= self.ring_size - 2: return None
+            return self._frame(seq)
+
+    def hold(self, item):
+        """ใช้หลังงานที่อาจนาน (เช่นรอ Inference): ภาพของ item ที่ยังใช้ต่อได้ หรือ None ถ้า slot ถูกเขียนทับไปแล้ว
+        ถ้าผู้ใช้ตามหลังจนใกล้ถูกเขียนทับ (เกินครึ่ง Ring) จะ copy ออกมาก่อน"""
+        with self.cond:
+            lag = self.seq - item.seq
+            if not self.grabbed or not 0 <= lag <= self.ring_size - 2: return None
+        if lag < self.ring_size // 2: return item.image
+        image = item.image.copy()
+        # เช็คซ้ำหลัง copy: slot อาจถูกเขียนทับระหว่าง copy
+        return image if self.get(item.seq) is not None else None
+
     def read(self):
-        with self.lock: return self.frame.copy() if self.grabbed else None
+        """คืนค่าเฟรมล่าสุด (ไม่ copy) หรือ None ถ้ายังไม่มีภาพ"""
+        with self.cond: return self._frame(self.seq) if self.grabbed else None
+
+    def wait_next(self, last_seq, timeout=1.0):
+        """รอจนกว่าจะมีเฟรมที่ใหม่กว่า last_seq คืนค่า None ถ้าหมดเวลา"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.stopped or (self.grabbed and self.seq > last_seq), timeout): return None
+            if not self.grabbed or self.stopped: return None
+            # เฟรมที่ถอดรหัสแล้วแต่ถูกข้ามเพราะประมวลผลไม่ทัน
+            if self.name and last_seq and self.seq - last_seq > 1: CAPTURE_FRAMES.inc(self.seq - last_seq - 1, cam=self.name, result="dropped")
+            self.consumed = self.seq
+            self.cond.notify_all()
+            return self._frame(self.seq)
     def isOpened(self): return self.stream.isOpened()
     def release(self):
-        self.stopped = True
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
         try: self.stream.release()
         except: pass
 
 class SmartCamera(threading.Thread):
     def __init__(self, cam_id, rtsp_url, config=None):
-        super().__init__()
+        super().__init__(name=f"cam-{cam_id}")
         self.cam_id = cam_id
         self.rtsp_url = rtsp_url
         self.running = True
         self.output_frame = None
         self.lock = threading.Lock()
-        self.stats = {"in": 0, "out": 0, "staff_in": 0, "staff_out": 0, "checkout": 0}
+        # จำนวนคนที่เปิดดู /video_feed อยู่ ถ้าไม่มีจะไม่ย่อภาพ/วาด Overlay เลย
+        self.viewers = 0
+        self.scene, self.rendered_seq = None, None
+        # zones: ยอดแยกตามเส้น/โซนที่มี id (config['lines'] / config['zones']) ยอดด้านนอกเป็นผลรวมทุกเส้น/โซน
+        self.stats = {"in": 0, "out": 0, "staff_in": 0, "staff_out": 0, "checkout": 0, "zones": {}}
         self.config = config if config else {
             "name": f"Camera {cam_id}",
             "line_ratio": 0.5, "line_pos_x": 0.5, "offset_ratio": 0.05,
             "line_angle": 0, "line_length": 1.0, "uniform_color": "None",
             "conf_threshold": 0.3, "invert_dir": False,
             "cashier_mode": False, 
-            "cashier_x": 0.3, "cashier_y": 0.3, "cashier_w": 0.4, "cashier_h": 0.4, "cashier_time": 5.0
+            "cashier_x": 0.3, "cashier_y": 0.3, "cashier_w": 0.4, "cashier_h": 0.4, "cashier_time": 5.0,
+            "detect_interval": 1
         }
-        self.dwell_times = {}
-        self.checked_out_ids = set()
+        # เส้นนับ/กรอบแคชเชียร์: คำนวณ geometry ใหม่เฉพาะตอน config เปลี่ยน
+        self.counting = CountingEngine(self.config)
+        self.cap = None
+        self.motion_gate = MotionGate()
+        # staff/customer ของแต่ละ Track (โหวตจากหลายเฟรมแรก) ดู confidence ได้ที่ self.uniform.info
+        self.uniform = UniformClassifier(votes=self.config.get('uniform_votes', 5))
+        # Hook สำหรับโหมด Worker Process: ส่ง Event/ภาพกลับ Process หลักแทนการเขียน DB/MQTT เอง
+        self.event_sink = None
+        self.frame_sink = None
+        self.sink_ts = 0.0  # เวลาที่ส่งภาพให้ frame_sink ล่าสุด (ส่งไม่เกิน stream_fps)
+        # replay.py: เล่นไฟล์วิดีโอ ("fast"/"realtime") แล้วจบ Thread เมื่อจบไฟล์ / stage_sink(name, seconds) รับเวลาของแต่ละขั้นตอน
+        self.replay = None
+        self.stage_sink = lambda name, dt: STAGE_SECONDS.observe(dt, cam=cam_id, stage=name)
 
     def stop(self): self.running = False
-    def update_config(self, new_config):
+    def apply_config(self, new_config):
         self.config.update(new_config)
+        self.counting.configure(self.config)
+    def update_config(self, new_config):
+        self.apply_config(new_config)
         cameras_config[self.cam_id]['config'] = self.config
         save_cameras_config()
+    def emit(self, payload):
+        if self.event_sink: self.event_sink(payload)
+        else: record_event(payload)
+    def add_viewer(self):
+        with self.lock: self.viewers += 1
+    def remove_viewer(self):
+        with self.lock: self.viewers = max(0, self.viewers - 1)
+
+    def render(self, image, scene):
+        """ย่อภาพเป็นกว้าง 640 แล้ววาดเส้น/โซน/กรอบคนตาม scene"""
+        h, w = image.shape[:2]
+        out = cv2.resize(image, (640, int(640 * h / w)))
+        scale = 640 / w
+        def sp(px, py): return (int(px * scale), int(py * scale))
+
+        for line in scene.lines:
+            cv2.line(out, sp(*line.p1), sp(*line.p2), (0, 255, 0), 2)
+            (nx, ny), off = line.normal, line.offset
+            for d in [-1, 1]:
+                cv2.line(out, sp(line.p1[0] + d * off * nx, line.p1[1] + d * off * ny), sp(line.p2[0] + d * off * nx, line.p2[1] + d * off * ny), (0, 255, 255), 1)
+            if line.id: cv2.putText(out, line.id, sp(*line.p1), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+        for zone in scene.zones:
+            pts = (zone.points * scale).astype(np.int32)
+            cv2.polylines(out, [pts], True, (0, 255, 255), 2)
+            cv2.putText(out, f"{zone.id or 'CASHIER'} ({zone.dwell:g}s)", (int(pts[:, 0].min()), int(pts[:, 1].min()) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+            if zone.id in scene.filled: cv2.fillPoly(out, [pts], (0, 255, 0))
+        for (x1, y1, x2, y2), staff in zip(scene.boxes, scene.staff):
+            cv2.rectangle(out, sp(x1, y1), sp(x2, y2), (0, 0, 255) if staff else (0, 165, 255), 2)
+        for cx, cy in scene.hits: cv2.circle(out, sp(cx, cy), 8, (0, 255, 0), -1)
+        if scene.loading: cv2.putText(out, "Loading AI model...", (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+        return out
+
+    def frame_version(self):
+        """หมายเลขเฟรมของภาพแสดงผลล่าสุด (ใช้เช็คว่ามีภาพใหม่โดยไม่ต้องวาด) / None ถ้ายังไม่มี"""
+        scene = self.scene
+        return scene.seq if scene is not None else None
+
     def get_frame(self):
-        with self.lock: return self.output_frame.copy() if self.output_frame is not None else None
-
-    def check_uniform(self, frame, x, y, w, h, color_name):
-        if color_name == "None" or color_name not in UNIFORM_COLORS: return False
-        def get_color_ratio(roi, color_key):
-            if roi.size == 0: return 0
-            hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-            mask_final = np.zeros(hsv.shape[:2], dtype="uint8")
-            for (lower, upper) in UNIFORM_COLORS[color_key]:
-                mask_final = cv2.bitwise_or(mask_final, cv2.inRange(hsv, np.array(lower, dtype="uint8"), np.array(upper, dtype="uint8")))
-            return cv2.countNonZero(mask_final) / (roi.shape[0] * roi.shape[1])
-
-        t_y1, t_y2 = int(max(0, y - h * 0.4)), int(min(frame.shape[0], y + h * 0.1))
-        t_x1, t_x2 = int(max(0, x - w * 0.25)), int(min(frame.shape[1], x + w * 0.25))
-        l_y1, l_y2 = int(max(0, y + h * 0.1)), int(min(frame.shape[0], y + h * 0.45))
-        l_x1, l_x2 = int(max(0, x - w * 0.25)), int(min(frame.shape[1], x + w * 0.25))
-
-        if color_name == "Black": 
-            shirt_black = get_color_ratio(frame[t_y1:t_y2, t_x1:t_x2], "Black")
-            pants_black = get_color_ratio(frame[l_y1:l_y2, l_x1:l_x2], "Black")
-            return shirt_black > 0.4 and pants_black > 0.4
-        else:
-            return get_color_ratio(frame[t_y1:t_y2, t_x1:t_x2], color_name) > 0.3
+        """ภาพแสดงผลล่าสุด: วาดตอนถูกขอ (อัตราเท่าที่คนดูดึงภาพ) และวาดซ้ำเฉพาะเมื่อมี scene ใหม่"""
+        with self.lock:
+            scene, cached, cap = self.scene, self.output_frame, self.cap
+            if scene is None or self.rendered_seq == scene.seq or cap is None:
+                return cached.copy() if cached is not None else None
+        item = cap.get(scene.seq)
+        if item is None: return cached.copy() if cached is not None else None
+        out = self.render(item.image, scene)
+        # slot ถูกเขียนทับระหว่างวาด -> ใช้ภาพเดิมไปก่อน
+        if cap.get(scene.seq) is None: return cached.copy() if cached is not None else None
+        with self.lock: self.output_frame, self.rendered_seq = out, scene.seq
+        return out.copy()
+
+    def get_snapshot(self):
+        """ภาพความละเอียดเต็ม: ถ้าใช้ Sub-stream อยู่จะเปิด Main stream ชั่วคราวเฉพาะตอนที่ต้องการ"""
+        if not self.config.get('sub_url'):
+            item = self.cap.read() if self.cap else None
+            return item.image.copy() if item else None
+        main = VideoCaptureThread(self.rtsp_url, ring_size=2)
+        try:
+            item = main.read()
+            return item.image.copy() if item else None
+        finally:
+            main.release()
+
+    def zone_rect(self, w, h, pad_ratio=0.15):
+        """กรอบ (x1, y1, x2, y2) ที่ครอบทุกเส้นนับ (รวมแถบ offset) และทุกโซน พร้อมขอบเพิ่มตามความสูงภาพ"""
+        bounds = self.counting.geometry(w, h).bounds()
+        if bounds is None: return (0, 0, w, h)
+        x1, y1, x2, y2 = bounds
+        pad = pad_ratio * h
+        return (int(max(0, x1 - pad)), int(max(0, y1 - pad)), int(min(w, x2 + pad)), int(min(h, y2 + pad)))
+
+    def count(self, kind, zone, is_staff):
+        """เพิ่มยอดรวมและยอดของเส้น/โซน แล้วส่ง Event (มี zone_id เฉพาะเส้น/โซนที่ตั้งชื่อไว้)"""
+        key = f"staff_{kind}" if is_staff else kind
+        self.stats[key] += 1
+        payload = {"branch": system_settings['branch_name'], "cam_id": self.cam_id, "ts": time.time(), "is_staff": int(is_staff)}
+        if kind == "checkout": payload["checkout"] = 1
+        else: payload.update({"in": int(kind == "in"), "out": int(kind == "out")})
+        if zone:
+            zs = self.stats["zones"].setdefault(zone, {"in": 0, "out": 0, "staff_in": 0, "staff_out": 0, "checkout": 0})
+            zs[key] += 1
+            payload["zone_id"] = zone
+        self.emit(payload)
 
     def run(self):
         print(f"🚀 [{self.cam_id}] AI Engine Started ({self.rtsp_url})")
+        start_model_warmup()
         
         while self.running:
             cap = None
             try:
-                cap = VideoCaptureThread(self.rtsp_url).start()
-                time.sleep(2) 
+                # ใช้ Sub-stream (ความละเอียดต่ำ) สำหรับ AI ถ้ามีการตั้งค่าไว้
+                src = self.config.get('sub_url') or self.rtsp_url
+                fps = self.config.get('capture_fps', system_settings.get('capture_fps', 15))
+                cap = VideoCaptureThread(src, target_fps=fps, replay=self.replay, name=self.cam_id).start()
+                if not self.replay: time.sleep(2) 
                 
                 if not cap.isOpened() or not cap.grabbed:
+                    if self.replay:
+                        print(f"❌ [{self.cam_id}] Cannot open {src}")
+                        break
                     print(f"⚠️ [{self.cam_id}] Connection failed. Retrying in 10s...")
                     cap.release()
                     time.sleep(10)
                     continue
                 
                 print(f"✅ [{self.cam_id}] Stream Connected!")
-                object_states, object_types = {}, {}
+                self.cap = cap
+                self.counting.reset()
+                self.uniform.reset()
+                # Tracker ของกล้องนี้เอง (Track ID ไม่ปนกับกล้องอื่น)
+                tracker = Tracker(detect_interval=self.config.get('detect_interval', 1))
+                frame_idx = 0
+                self.motion_gate.reset()
+                last_seq, last_frame_time = 0, time.time()
+                scheduler.register(self.cam_id)
+                stage = self.stage_sink
+                t_wait = time.perf_counter()
+                fps_frames, fps_t0 = 0, t_wait
                 
                 while self.running:
-                    frame = cap.read()
-                    if frame is None: 
-                        time.sleep(0.1)
+                    # รอเฟรมใหม่จริง ๆ (ไม่ประมวลผลเฟรมซ้ำเมื่อกล้องช้ากว่า Detector)
+                    item = cap.wait_next(last_seq, timeout=1.0)
+                    if item is None: 
                         if cap.stopped: break 
+                        if time.time() - last_frame_time > 10:
+                            print(f"⚠️ [{self.cam_id}] No new frames for 10s. Reconnecting...")
+                            break
                         continue
+                    last_seq, last_frame_time = item.seq, time.time()
+                    frame, frame_ts = item.image, item.ts
+                    t_start = time.perf_counter()
+                    if stage: stage("capture", t_start - t_wait)
                         
                     h, w, _ = frame.shape
+                    # ไม่มีใครดูภาพ -> ไม่ต้องเก็บ Overlay (ไม่ย่อภาพ ไม่วาด)
+                    viewing = self.viewers > 0
+                    hits, filled = [], set()
                     
-                    cy = int(h * self.config.get('line_ratio', 0.5))
-                    cx = int(w * self.config.get('line_pos_x', 0.5))
-                    offset_dist = int(h * self.config.get('offset_ratio', 0.05))
-                    angle_deg = self.config.get('line_angle', 0)
-                    length_ratio = self.config.get('line_length', 1.0)
                     uniform_color = self.config.get('uniform_color', 'None')
                     conf_thresh = self.config.get('conf_threshold', 0.3)
-                    invert = self.config.get('invert_dir', False)
-                    
-                    cashier_mode = self.config.get('cashier_mode', False)
-                    c_x = int(w * self.config.get('cashier_x', 0.3))
-                    c_y = int(h * self.config.get('cashier_y', 0.3))
-                    c_w = int(w * self.config.get('cashier_w', 0.4))
-                    c_h = int(h * self.config.get('cashier_h', 0.4))
-                    c_time = self.config.get('cashier_time', 5.0)
-
-                    angle_rad = math.radians(angle_deg)
-                    cos_a, sin_a = math.cos(angle_rad), math.sin(angle_rad)
-                    nx, ny = -sin_a, cos_a 
-                    half_len = int((w * length_ratio) / 2)
-                    p1_x, p1_y = int(cx - half_len * cos_a), int(cy - half_len * sin_a)
-                    p2_x, p2_y = int(cx + half_len * cos_a), int(cy + half_len * sin_a)
-
-                    if not cashier_mode:
-                        cv2.line(frame, (p1_x, p1_y), (p2_x, p2_y), (0, 255, 0), 2)
-                        for d in [-1, 1]:
-                            bx1, by1 = int(p1_x + d * offset_dist * nx), int(p1_y + d * offset_dist * ny)
-                            bx2, by2 = int(p2_x + d * offset_dist * nx), int(p2_y + d * offset_dist * ny)
-                            cv2.line(frame, (bx1, by1), (bx2, by2), (0, 255, 255), 1)
-                    
-                    if cashier_mode:
-                        cv2.rectangle(frame, (c_x, c_y), (c_x + c_w, c_y + c_h), (0, 255, 255), 2)
-                        cv2.putText(frame, f"CASHIER ({c_time}s)", (c_x, c_y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+                    geo = self.counting.geometry(w, h)
 
                     is_open = system_settings['open_hour'] <= datetime.datetime.now().hour < system_settings['close_hour']
 
-                    # ใช้ Shared Model (OpenVINO)
-                    with model_lock:
-                        results = shared_model.track(frame, persist=True, classes=[0], conf=conf_thresh, verbose=False, tracker="bytetrack.yaml")
+                    # รัน Detector ทุก N เฟรม (detect_interval) เฟรมที่เหลือให้ Tracker ทำนายตำแหน่งแทน
+                    tracker.detect_interval = max(1, int(self.config.get('detect_interval', 1)))
+                    run_detector = frame_idx % tracker.detect_interval == 0
+                    if not scheduler.ready.is_set():
+                        # โมเดลยังโหลดไม่เสร็จ: แสดงภาพไปก่อน ยังไม่นับ
+                        run_detector = False
+                    elif run_detector and self.config.get('motion_gate', system_settings.get('motion_gate', True)):
+                        # ไม่มีการเคลื่อนไหวรอบเส้น/กรอบ และไม่มีคนค้างอยู่ใน Tracker -> ข้าม YOLO
+                        moving = self.motion_gate.check(frame, self.zone_rect(w, h), frame_ts, self.config.get('motion_hold_off', 2.0))
+                        if not moving and not len(tracker.ids):
+                            self.motion_gate.stats['gated'] += 1
+                            run_detector = False
+                    # กล้องอื่นที่รอ Batch อยู่ไม่ต้องรอเฟรมนี้
+                    if not run_detector: scheduler.skip(self.cam_id)
+                    t0 = time.perf_counter()
+                    if run_detector:
+                        # ส่งเฟรมเข้า Scheduler (Batch ร่วมกับกล้องอื่น) แล้วรอผล
+                        try:
+                            if self.config.get('roi_inference', False):
+                                # ROI mode: ตัดเฉพาะบริเวณเส้น/กรอบแคชเชียร์ แล้วรันที่ input เล็กลง
+                                rx1, ry1, rx2, ry2 = self.zone_rect(w, h, self.config.get('roi_pad', 0.15))
+                                detections = scheduler.submit(self.cam_id, frame[ry1:ry2, rx1:rx2], conf_thresh, imgsz=self.config.get('roi_imgsz', 320)).result()
+                                detections[:, [0, 2]] += rx1
+                                detections[:, [1, 3]] += ry1
+                            else:
+                                detections = scheduler.submit(self.cam_id, frame, conf_thresh).result()
+                        except Exception as e:
+                            # Inference พลาดครั้งเดียวไม่ต้องตัดการเชื่อมต่อกล้อง: เฟรมนี้ใช้ตำแหน่งที่ Tracker ทำนายแทน
+                            print(f"⚠️ [{self.cam_id}] Inference failed: {e}. Using tracker prediction for this frame.")
+                            run_detector = False
+                    if run_detector:
+                        t1 = time.perf_counter()
+                        if stage: stage("inference", t1 - t0)
+                        # ระหว่างรอ Scheduler กล้องอาจเขียนทับ slot ของเฟรมนี้ไปแล้ว (ผลตรวจจับอาจมาจากภาพที่ถูกเขียนทับครึ่ง ๆ)
+                        frame = cap.hold(item)
+                        if frame is None:
+                            CAPTURE_FRAMES.inc(cam=self.cam_id, result="stale")
+                            t_wait = time.perf_counter()
+                            continue
+                        tracks = tracker.update(detections)
+                    else:
+                        t1 = time.perf_counter()
+                        tracks = tracker.predict()
+                    frame_idx += 1
+                    t2 = time.perf_counter()
+                    if stage: stage("tracking", t2 - t1)
                     
-                    if results[0].boxes.id is not None:
-                        boxes = results[0].boxes.xywh.cpu()
-                        ids = results[0].boxes.id.int().cpu().tolist()
-                        
-                        current_ids = set(ids)
-                        for tid in list(self.dwell_times.keys()):
-                            if tid not in current_ids: del self.dwell_times[tid]
-
-                        for box, track_id in zip(boxes, ids):
-                            x, y, bw, bh = box
-                            center_x, center_y = int(x), int(y)
-                            
-                            if track_id not in object_types: object_types[track_id] = 'staff' if self.check_uniform(frame, x, y, bw, bh, uniform_color) else 'customer'
-                            role = object_types[track_id]
-                            color = (0, 0, 255) if role == 'staff' else (0, 165, 255)
-                            cv2.rectangle(frame, (int(x-bw/2), int(y-bh/2)), (int(x+bw/2), int(y+bh/2)), color, 2)
-
-                            if cashier_mode and role == 'customer' and is_open:
-                                if c_x < center_x < c_x + c_w and c_y < center_y < c_y + c_h:
-                                    if track_id not in self.dwell_times: self.dwell_times[track_id] = time.time()
-                                    else:
-                                        elapsed = time.time() - self.dwell_times[track_id]
-                                        if elapsed >= c_time and track_id not in self.checked_out_ids:
-                                            self.stats['checkout'] += 1
-                                            self.checked_out_ids.add(track_id)
-                                            payload = {"branch": system_settings['branch_name'], "cam_id": self.cam_id, "ts": time.time(), "checkout": 1, "is_staff": 0}
-                                            if network_status['mqtt']:
-                                                mqtt_client.publish(f"shop/{system_settings['branch_name']}/{self.cam_id}/people_count", json.dumps(payload))
-                                                db.save_history_only(payload)
-                                            else: db.save(payload)
-                                            cv2.rectangle(frame, (c_x, c_y), (c_x + c_w, c_y + c_h), (0, 255, 0), -1) 
-                                else:
-                                    if track_id in self.dwell_times: del self.dwell_times[track_id]
-
-                            if not cashier_mode:
-                                dx, dy = center_x - cx, center_y - cy
-                                if abs(dx * cos_a + dy * sin_a) > half_len: continue
-                                dist_from_line = dx * nx + dy * ny
-                                current_state = "UP" if dist_from_line < -offset_dist else ("DOWN" if dist_from_line > offset_dist else "ZONE")
-
-                                if current_state != "ZONE" and track_id in object_states:
-                                    last_state = object_states[track_id]
-                                    if current_state != last_state:
-                                        raw_dir = None
-                                        if last_state == "UP" and current_state == "DOWN": raw_dir = "in"
-                                        elif last_state == "DOWN" and current_state == "UP": raw_dir = "out"
-                                        if raw_dir:
-                                            final_dir = "out" if (raw_dir == "in" and invert) or (raw_dir == "out" and not invert) else "in"
-                                            if invert and raw_dir == "out": final_dir = "in" 
-                                            if invert and raw_dir == "in": final_dir = "out"
-                                            
-                                            if role == 'staff':
-                                                self.stats[f'staff_{final_dir}'] += 1
-                                                payload = {"branch": system_settings['branch_name'], "cam_id": self.cam_id, "ts": time.time(), "in": 1 if final_dir=="in" else 0, "out": 1 if final_dir=="out" else 0, "is_staff": 1}
-                                                db.save_history_only(payload)
-                                            elif is_open:
-                                                self.stats[final_dir] += 1
-                                                payload = {"branch": system_settings['branch_name'], "cam_id": self.cam_id, "ts": time.time(), "in": 1 if final_dir=="in" else 0, "out": 1 if final_dir=="out" else 0, "is_staff": 0}
-                                                if network_status['mqtt']:
-                                                    mqtt_client.publish(f"shop/{system_settings['branch_name']}/{self.cam_id}/people_count", json.dumps(payload))
-                                                    db.save_history_only(payload)
-                                                else: db.save(payload)
-                                                cv2.circle(frame, (center_x, center_y), 15, (0, 255, 0), -1)
-                                        object_states[track_id] = current_state
-                                elif current_state != "ZONE":
-                                    object_states[track_id] = current_state
+                    # ลืมสถานะเฉพาะ Track ที่ Tracker ทิ้งไปแล้ว (Track ที่พลาดการตรวจจับชั่วคราวยังเก็บผลโหวตไว้)
+                    self.counting.forget(tracker.ids)
+                    self.uniform.forget(set(tracker.ids.tolist()))
+                    if len(tracks):
+                        boxes = xyxy_to_cxcywh(tracks[:, :4])
+                        ids = tracks[:, 4].astype(int).tolist()
+                        # จัดกลุ่มทุก Track ในเฟรมพร้อมกัน (โหวตเฉพาะเฟรมที่ Detector รันจริง)
+                        self.uniform.votes = max(1, int(self.config.get('uniform_votes', 5)))
+                        roles = self.uniform.classify(frame, boxes, ids, uniform_color, vote=run_detector)
+                        is_staff = np.array([roles[tid] == 'staff' for tid in ids])
+
+                        # นับทุก Track กับทุกเส้น/โซนพร้อมกัน แล้วบันทึก Event ทีละรายการ
+                        for ev in self.counting.update(ids, boxes[:, :2], frame_ts, dwell_mask=~is_staff & is_open):
+                            if ev.kind == "checkout":
+                                self.count("checkout", ev.zone, False)
+                                filled.add(ev.zone)
+                            elif is_staff[ev.index]:
+                                self.count(ev.kind, ev.zone, True)
+                            elif is_open:
+                                self.count(ev.kind, ev.zone, False)
+                                hits.append(boxes[ev.index, :2])
+                    else:
+                        self.counting.update([], [], frame_ts)
+                    t_wait = time.perf_counter()
+                    if stage:
+                        stage("counting", t_wait - t2)
+                        stage("frame", t_wait - t_start)
+                    # FPS ที่ประมวลผลได้จริง อัปเดตทุก 1 วินาที
+                    fps_frames += 1
+                    if t_wait - fps_t0 >= 1.0:
+                        CAMERA_FPS.set(round(fps_frames / (t_wait - fps_t0), 2), cam=self.cam_id)
+                        CAPTURE_FRAMES.inc(fps_frames, cam=self.cam_id, result="processed")
+                        fps_frames, fps_t0 = 0, t_wait
                     
-                    display_frame = cv2.resize(frame, (640, int(640 * h / w)))
-                    with self.lock: self.output_frame = display_frame
+                    if viewing:
+                        empty = not len(tracks)
+                        scene = Scene(item.seq, geo.lines, geo.zones, np.empty((0, 4)) if empty else tracks[:, :4], np.empty(0, bool) if empty else is_staff,
+                                      hits, filled, not scheduler.ready.is_set())
+                        with self.lock: self.scene = scene
+                        # โหมด Worker Process: ส่งภาพที่วาดแล้วผ่าน shared memory ตามอัตรา stream_fps เหมือน CameraStreamer ในโหมด Thread
+                        # frame ที่ copy ออกมาแล้ว (writeable) ใช้ได้เสมอ ส่วน view ของ Ring ต้องยังไม่ถูกเขียนทับ
+                        now = time.monotonic()
+                        due = now - self.sink_ts >= 1.0 / max(1, float(system_settings.get('stream_fps', 10)))
+                        if self.frame_sink and due and (frame.flags.writeable or cap.get(item.seq) is not None):
+                            self.sink_ts = now
+                            self.frame_sink(self.render(frame, scene))
             
             except Exception as e:
                 print(f"❌ [{self.cam_id}] System Error: {e}")
                 time.sleep(5)
             finally:
+                self.cap = None
+                scheduler.unregister(self.cam_id)
                 if cap: cap.release()
+            # replay: เล่นครั้งเดียวแล้วจบ ไม่ต่อใหม่
+            if self.replay: break
 
 active_cameras = {}
 def init_cameras():
+    if system_settings.get('camera_process_mode', 'thread') == 'process':
+        from workers import start_worker
+        cams = [(cam_id, data['url'], data.get('config')) for cam_id, data in cameras_config.items()]
+        size = max(1, int(system_settings.get('cameras_per_process', 1)))
+        for i in range(0, len(cams), size):
+            for proxy in start_worker(cams[i:i + size]): active_cameras[proxy.cam_id] = proxy
+        return
     for cam_id, data in cameras_config.items(): start_camera(cam_id, data['url'], data.get('config'))
 def start_camera(cam_id, url, config=None):
     if cam_id in active_cameras: active_cameras[cam_id].stop(); active_cameras[cam_id].join()
+    if system_settings.get('camera_process_mode', 'thread') == 'process':
+        # แยกกล้องไปรันใน Process ของตัวเอง (import ตอนใช้งานเพราะ workers import camera)
+        from workers import start_worker
+        active_cameras[cam_id] = start_worker([(cam_id, url, config)])[0]
+        return
     cam = SmartCamera(cam_id, url, config)
     active_cameras[cam_id] = cam
     cam.start()
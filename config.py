@@ -15,8 +15,13 @@ DB_FILE = f"{DATA_DIR}/offline_data.db"
 SETTINGS_FILE = f"{DATA_DIR}/settings.json"
 CAMERAS_FILE = f"{DATA_DIR}/cameras.json"
 WG_CONFIG_FILE = f"{DATA_DIR}/wg_client.conf"
+MODELS_DIR = f"{DATA_DIR}/models"
+MODEL_SELECTION_FILE = f"{MODELS_DIR}/selected.json"
+OV_CACHE_DIR = f"{DATA_DIR}/ov_cache"
 
 os.makedirs(DATA_DIR, exist_ok=True)
+os.makedirs(MODELS_DIR, exist_ok=True)
+os.makedirs(OV_CACHE_DIR, exist_ok=True)
 
 UNIFORM_COLORS = {
     "None": None,
@@ -35,7 +40,19 @@ DEFAULT_SETTINGS = {
     "mqtt_port": 1883,
     "vpn_server_ip": "10.200.0.1",
     "open_hour": 0, "close_hour": 24, "keep_days": 365,
-    "admin_password": "admin"
+    "admin_password": "admin",
+    "infer_max_batch": 4, "infer_max_wait_ms": 15,
+    "capture_ring_size": 8, "capture_fps": 15,
+    "motion_gate": True,
+    "inference_backend": "openvino",
+    "camera_process_mode": "thread", "cameras_per_process": 1,
+    "model_max_recall_drop": 0.02,
+    "stream_fps": 10, "stream_quality": 70,
+    "server_mode": "flask",
+    "metrics_token": "",
+    "db_flush_interval": 0.5, "db_batch_max": 500,
+    "retention_batch": 5000, "retention_pause": 0.05,
+    "db_read_pool": 3, "db_read_timeout": 2.0
 }
 
 system_settings = DEFAULT_SETTINGS.copy()
@@ -1,40 +1,208 @@
 import sqlite3
 import threading
+import queue
 import json
+import zlib
+import atexit
 import io
 import csv
 import time
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from contextlib import contextmanager
 from config import DB_FILE, system_settings
+from metrics import TimedLock, LOCK_WAIT, DB_SECONDS, DB_PENDING, DB_WRITE_QUEUE, DB_WRITE_BATCH, DB_WRITE_ERRORS, DB_READ_POOL, timed
 
 logger = logging.getLogger(__name__)
 
-class LocalBuffer:
+class StatsCache:
+    """ยอดกราฟ (ชั่วโมงของวันนี้ / วันของเดือนนี้ / เดือนของปีนี้) และจำนวน pending ในหน่วยความจำ
+
+    seed() จาก SQLite ครั้งเดียวตอนเริ่ม แล้ว add() ทุก Event ที่เข้าคิวเขียน (เฉพาะลูกค้า เหมือน daily_stats)
+    Event ที่ writer เขียนไม่สำเร็จต้อง discard() ออก ไม่งั้นกราฟจะมียอดที่ไม่มีใน DB
+    ข้ามวัน/เดือน/ปีตามเวลาท้องถิ่นจะเริ่มช่องใหม่ที่ว่างเอง /api/stats จึงอ่านได้โดยไม่แตะ DB
+    """
     def __init__(self):
         self.lock = threading.Lock()
+        self.period = None  # (วันที่, เดือน, ปี) ท้องถิ่นของข้อมูลในแต่ละระดับ
+        self.hourly, self.daily, self.monthly = {}, {}, {}
+        self.pending = 0
+
+    @staticmethod
+    def _periods(ts=None):
+        t = time.localtime(ts)
+        return (time.strftime('%Y-%m-%d', t), time.strftime('%Y-%m', t), str(t.tm_year)), (t.tm_hour, t.tm_mday, t.tm_mon)
+
+    @staticmethod
+    def _empty(keys):
+        return {k: {'in': 0, 'out': 0, 'checkout': 0} for k in keys}
+
+    def _rollover(self):
+        """เรียกภายใต้ self.lock: ล้างระดับที่ช่วงเวลาเปลี่ยนไปแล้ว"""
+        current, _ = self._periods()
+        old = self.period or (None, None, None)
+        if current[0] != old[0]: self.hourly = self._empty(range(24))
+        if current[1] != old[1]: self.daily = self._empty(range(1, 32))
+        if current[2] != old[2]: self.monthly = self._empty(range(1, 13))
+        self.period = current
+
+    def seed(self, db):
+        hourly, daily, monthly, pending = db.get_hourly_stats(), db.get_daily_stats(), db.get_monthly_stats(), db.count_pending()
+        with self.lock:
+            self.period = None
+            self._rollover()
+            for table, rows in ((self.hourly, hourly), (self.daily, daily), (self.monthly, monthly)):
+                for k, v in rows.items(): table[k] = {key: v[key] or 0 for key in ('in', 'out', 'checkout')}
+            self.pending = pending
+
+    def add(self, payload, pending): self._apply(payload, pending, 1)
+    def discard(self, payload, pending): self._apply(payload, pending, -1)
+
+    def _apply(self, payload, pending, sign):
+        with self.lock:
+            if pending: self.pending = max(0, self.pending + sign)
+            if payload.get('is_staff', 0) == 1: return
+            self._rollover()
+            periods, keys = self._periods(payload.get('ts'))
+            # Event ที่มาช้าข้ามช่วงเวลา (เช่นของเมื่อวานหลังเที่ยงคืน) นับเฉพาะระดับที่ยังอยู่ในช่วงเดียวกัน
+            # (discard หลังข้ามช่วงไปแล้วก็ไม่มีผล เพราะช่องนั้นถูกล้างไปแล้ว)
+            for table, period, current, key in zip((self.hourly, self.daily, self.monthly), periods, self.period, keys):
+                if period != current: continue
+                for k in ('in', 'out', 'checkout'): table[key][k] += sign * payload.get(k, 0)
+
+    def sent(self, n=1):
+        with self.lock: self.pending = max(0, self.pending - n)
+
+    def get(self, mode):
+        """สำเนาของ 'hourly' / 'daily' / 'monthly' (รูปแบบเดียวกับ get_*_stats)"""
+        with self.lock:
+            self._rollover()
+            table = {'hourly': self.hourly, 'daily': self.daily, 'monthly': self.monthly}.get(mode)
+            return {k: dict(v) for k, v in table.items()} if table is not None else {}
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """ไม่มี Connection อ่านว่างภายในเวลาที่กำหนด (จับได้ด้วย except sqlite3.Error เหมือน Error อื่นของ DB)"""
+
+
+class ReadPool:
+    """Connection แบบอ่านอย่างเดียวสำหรับ Query (WAL: อ่านพร้อมกับ writer ได้โดยไม่รอกัน)
+
+    สร้างเพิ่มตามต้องการไม่เกิน size ถ้ายืมครบแล้วต้องรอคืนไม่เกิน timeout วินาที (เวลารอบันทึกใน lock_wait_seconds{lock="db_read_pool"})
+    ใช้กับ Query สั้น ๆ เท่านั้น งานที่อ่านนาน (export) ให้เปิด connect() ของตัวเอง
+    """
+    def __init__(self, path, size=3, timeout=2.0):
+        self.uri = Path(path).resolve().as_uri() + "?mode=ro"
+        self.size = max(1, int(size))
+        self.timeout = float(timeout)
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def acquire(self):
+        try: return self.idle.get_nowait()
+        except queue.Empty: pass
+        with self.lock:
+            grow = self.created < self.size
+            if grow: self.created += 1
+        if grow:
+            try: return self.connect()
+            except sqlite3.Error:
+                with self.lock: self.created -= 1
+                raise
+        t0 = time.perf_counter()
+        try: conn = self.idle.get(timeout=self.timeout)
+        except queue.Empty: conn = None
+        LOCK_WAIT.observe(time.perf_counter() - t0, lock="db_read_pool")
+        if conn is None: raise PoolTimeout(f"No read connection free after {self.timeout:.1f}s (db_read_pool={self.size})")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try: yield conn
+        finally: self.idle.put(conn)
+
+    def in_use(self):
+        return self.created - self.idle.qsize()
+
+    def close(self):
+        """ปิด Connection ที่ว่างอยู่ทั้งหมด"""
+        while True:
+            try: self.idle.get_nowait().close()
+            except queue.Empty: return
+            with self.lock: self.created -= 1
+
+
+class LocalBuffer:
+    def __init__(self, path=DB_FILE, connect=True):
+        self.lock = TimedLock("db")
+        # Event นับคนเข้าคิวแล้วให้ Thread writer รวมเป็น Transaction เดียว (กล้องไม่ต้องรอ fsync)
+        self.queue = queue.Queue()
+        self.writer = None
+        self.writer_lock = threading.Lock()
+        self.cache = StatsCache()
+        self.path = path
+        # self.conn ใช้เขียนเท่านั้น (ภายใต้ self.lock) / Query ทั้งหมดยืม Connection จาก self.pool
+        self.pool = ReadPool(path, system_settings.get('db_read_pool', 3), system_settings.get('db_read_timeout', 2.0))
+        self.conn = None
+        self.open_lock = threading.RLock()
+        if connect: self.open()
+
+    def open(self):
+        """เปิด DB (สร้างตาราง / Migration / seed StatsCache) ครั้งเดียว"""
+        if self.conn is not None: return
+        with self.open_lock:
+            if self.conn is None: self._open()
+
+    def _open(self):
         try:
-            self.conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-            self.cursor = self.conn.cursor()
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL: อ่านได้ระหว่างเขียน / synchronous=NORMAL: fsync เฉพาะตอน checkpoint (ไฟดับเสียได้แค่ Transaction ล่าสุด ไม่ทำให้ไฟล์เสีย)
+            # DB ใหม่: คืนพื้นที่ไฟล์ทีละส่วนได้ด้วย incremental_vacuum (DB เก่าแปลงใน enable_incremental_vacuum)
+            self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA busy_timeout=5000")
             
             # ตารางเก็บข้อมูลดิบ (เหมือนเดิม)
-            self.cursor.execute('''CREATE TABLE IF NOT EXISTS pending_data (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-            self.cursor.execute('''CREATE TABLE IF NOT EXISTS history_log (id INTEGER PRIMARY KEY AUTOINCREMENT, cam_id TEXT, in_count INTEGER, out_count INTEGER, checkout_count INTEGER DEFAULT 0, is_staff INTEGER DEFAULT 0, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS pending_data (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS history_log (id INTEGER PRIMARY KEY AUTOINCREMENT, cam_id TEXT, in_count INTEGER, out_count INTEGER, checkout_count INTEGER DEFAULT 0, is_staff INTEGER DEFAULT 0, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, zone_id TEXT DEFAULT '')''')
             
             # --- [ใหม่] ตารางเก็บสถิติรายวัน ---
-            # ใช้เก็บยอดรวมของแต่ละวันแยกตามกล้อง ทำให้ดึงรายงานรายวัน/เดือนได้เร็วมาก
-            self.cursor.execute('''CREATE TABLE IF NOT EXISTS daily_stats (
+            # ใช้เก็บยอดรวมของแต่ละวันแยกตามกล้อง/โซน ทำให้ดึงรายงานรายวัน/เดือนได้เร็วมาก
+            # zone_id = '' คือยอดของเส้น/กรอบแบบเดิม (ไม่ได้ตั้งชื่อโซน)
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS daily_stats (
                                     date TEXT, 
                                     cam_id TEXT, 
                                     in_count INTEGER DEFAULT 0, 
                                     out_count INTEGER DEFAULT 0, 
                                     checkout_count INTEGER DEFAULT 0, 
-                                    PRIMARY KEY (date, cam_id))''')
+                                    zone_id TEXT DEFAULT '',
+                                    PRIMARY KEY (date, cam_id, zone_id))''')
             
+            # ยอดรายชั่วโมง (hour = 'YYYY-MM-DD HH' เวลาท้องถิ่น) สำหรับกราฟวันนี้ ไม่ต้องสแกน history_log
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS hourly_stats (hour TEXT, cam_id TEXT, zone_id TEXT DEFAULT '',
+                                    in_count INTEGER DEFAULT 0, out_count INTEGER DEFAULT 0, checkout_count INTEGER DEFAULT 0,
+                                    PRIMARY KEY (hour, cam_id, zone_id))''')
+            
+            self.conn.commit()
+            self.migrate_zone_columns()
+            # Index ของ history_log (สร้างหลัง migrate_zone_columns เผื่อ DB เก่า) ใช้กับ Query แบบช่วงเวลา
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history_log (timestamp)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_history_cam_timestamp ON history_log (cam_id, timestamp)")
             self.conn.commit()
             
             # ตรวจสอบและดึงข้อมูลเก่ามาใส่ตารางใหม่ (Migration) ถ้าตารางยังว่าง
             self.migrate_old_data()
+            self.migrate_hourly_stats()
+            self.cache.seed(self)
             
         except Exception as e:
             logger.exception(f"DB Init Error: {e}")
@@ -44,7 +212,7 @@ class LocalBuffer:
         with self.lock:
             try:
                 # เช็คว่ามีข้อมูลใน daily_stats หรือยัง
-                count = self.cursor.execute("SELECT COUNT(*) FROM daily_stats").fetchone()[0]
+                count = self.conn.execute("SELECT COUNT(*) FROM daily_stats").fetchone()[0]
                 if count == 0:
                     logger.info("Migrating old history_log to daily_stats...")
                     # Query รวมข้อมูลเก่ารายวัน (เฉพาะลูกค้า ไม่รวมพนักงาน)
@@ -56,168 +224,386 @@ class LocalBuffer:
                         WHERE is_staff = 0
                         GROUP BY d, cam_id
                     """
-                    self.cursor.execute(query)
+                    self.conn.execute(query)
                     self.conn.commit()
                     logger.info("Migration completed.")
             except Exception as e:
                 logger.error(f"Migration failed: {e}")
 
-    def update_daily_stats(self, cam_id, payload):
-        """อัปเดตยอดรายวันทันทีที่มีข้อมูลใหม่"""
-        # เฉพาะข้อมูลลูกค้าเท่านั้น (is_staff = 0)
-        if payload.get('is_staff', 0) == 1:
-            return
-
-        try:
-            today_str = datetime.now().strftime('%Y-%m-%d')
-            inc = payload.get('in', 0)
-            outc = payload.get('out', 0)
-            chk = payload.get('checkout', 0)
-            
-            # ใช้ UPSERT: ถ้ามีแถวของวันนี้แล้วให้อัปเดตบวกเพิ่ม ถ้ายังไม่มีให้สร้างใหม่
-            query = """
-                INSERT INTO daily_stats (date, cam_id, in_count, out_count, checkout_count) 
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(date, cam_id) DO UPDATE SET
-                in_count = in_count + excluded.in_count,
-                out_count = out_count + excluded.out_count,
-                checkout_count = checkout_count + excluded.checkout_count
-            """
-            self.cursor.execute(query, (today_str, cam_id, inc, outc, chk))
-        except Exception as e:
-            logger.error(f"Failed to update daily stats: {e}")
+    def migrate_hourly_stats(self):
+        """Backfill hourly_stats จาก history_log ที่มีอยู่ (ครั้งแรกที่สร้างตาราง)"""
+        with self.lock:
+            try:
+                if self.conn.execute("SELECT COUNT(*) FROM hourly_stats").fetchone()[0] == 0:
+                    t0 = time.perf_counter()
+                    n = self.conn.execute("""
+                        INSERT INTO hourly_stats (hour, cam_id, zone_id, in_count, out_count, checkout_count)
+                        SELECT strftime('%Y-%m-%d %H', timestamp, 'localtime') as h, cam_id, COALESCE(zone_id, ''),
+                               SUM(in_count), SUM(out_count), SUM(checkout_count)
+                        FROM history_log
+                        WHERE is_staff = 0
+                        GROUP BY h, cam_id, COALESCE(zone_id, '')
+                    """).rowcount
+                    if n: logger.info(f"Backfilled {n} hourly_stats rows in {time.perf_counter() - t0:.1f}s")
+                    self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                logger.error(f"Hourly backfill failed: {e}")
 
-    def save(self, payload):
+    def migrate_zone_columns(self):
+        """DB เก่าที่ยังไม่มี zone_id: เพิ่มคอลัมน์ใน history_log และสร้าง daily_stats ใหม่ให้ Primary Key รวม zone_id"""
         with self.lock:
             try:
-                data = json.dumps(payload)
-                # บันทึกข้อมูลส่ง MQTT
-                if payload.get('is_staff', 0) == 0: 
-                    self.cursor.execute('INSERT INTO pending_data (payload) VALUES (?)', (data,))
-                
-                # บันทึก Log ละเอียด
-                self.cursor.execute('INSERT INTO history_log (cam_id, in_count, out_count, checkout_count, is_staff) VALUES (?, ?, ?, ?, ?)', 
-                                    (payload.get('cam_id'), payload.get('in',0), payload.get('out',0), payload.get('checkout',0), payload.get('is_staff', 0)))
-                
-                # [ใหม่] อัปเดตตารางสถิติ
-                self.update_daily_stats(payload.get('cam_id'), payload)
-                
+                cols = [r[1] for r in self.conn.execute("PRAGMA table_info(history_log)")]
+                if 'zone_id' not in cols:
+                    self.conn.execute("ALTER TABLE history_log ADD COLUMN zone_id TEXT DEFAULT ''")
+                cols = [r[1] for r in self.conn.execute("PRAGMA table_info(daily_stats)")]
+                if 'zone_id' not in cols:
+                    logger.info("Migrating daily_stats to per-zone rows...")
+                    self.conn.execute("ALTER TABLE daily_stats RENAME TO daily_stats_old")
+                    self.conn.execute('''CREATE TABLE daily_stats (date TEXT, cam_id TEXT, in_count INTEGER DEFAULT 0, out_count INTEGER DEFAULT 0,
+                                            checkout_count INTEGER DEFAULT 0, zone_id TEXT DEFAULT '', PRIMARY KEY (date, cam_id, zone_id))''')
+                    self.conn.execute("INSERT INTO daily_stats (date, cam_id, in_count, out_count, checkout_count) SELECT date, cam_id, in_count, out_count, checkout_count FROM daily_stats_old")
+                    self.conn.execute("DROP TABLE daily_stats_old")
                 self.conn.commit()
-            except: pass
+            except Exception as e:
+                self.conn.rollback()
+                logger.error(f"Zone migration failed: {e}")
+
+    def reader(self):
+        """with db.reader() as conn: ... ยืม Connection อ่านอย่างเดียวจาก pool (ไม่ถือ self.lock ของ writer)"""
+        self.open()
+        return self.pool.connection()
+
+    # --- Writer (Group commit) ---
+    def save(self, payload):
+        """บันทึก Event ที่ยังไม่ได้ส่ง MQTT (pending_data + history_log + daily_stats) แบบไม่รอ Disk"""
+        self.enqueue(payload, pending=payload.get('is_staff', 0) == 0)
 
     def save_history_only(self, payload):
-        with self.lock:
+        """บันทึก Event ที่ส่ง MQTT แล้ว หรือของพนักงาน (history_log + daily_stats) แบบไม่รอ Disk"""
+        self.enqueue(payload, pending=False)
+
+    def enqueue(self, payload, pending):
+        self.open()
+        if self.writer is None:
+            with self.writer_lock:
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self.writer_loop, name="db-writer", daemon=True)
+                    self.writer.start()
+        self.cache.add(payload, pending)
+        self.queue.put((payload, pending))
+
+    def flush(self, timeout=5.0):
+        """รอจนทุก Event ที่เข้าคิวก่อนหน้านี้ถูก commit แล้ว (เช่นก่อนปิดโปรแกรม) คืนค่า False ถ้าหมดเวลา"""
+        if self.writer is None: return True
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def writer_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            # รวม Event ที่ตามมาภายใน db_flush_interval (แต่ไม่เกิน db_batch_max) เป็น Transaction เดียว
+            deadline = time.monotonic() + float(system_settings.get('db_flush_interval', 0.5))
+            limit = int(system_settings.get('db_batch_max', 500))
+            while len(batch) < limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                try: batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty: break
+                if isinstance(batch[-1], threading.Event): break  # flush(): เขียนทันทีไม่ต้องรอครบช่วง
+            events = [item for item in batch if not isinstance(item, threading.Event)]
             try:
-                self.cursor.execute('INSERT INTO history_log (cam_id, in_count, out_count, checkout_count, is_staff) VALUES (?, ?, ?, ?, ?)', 
-                                    (payload.get('cam_id'), payload.get('in',0), payload.get('out',0), payload.get('checkout',0), payload.get('is_staff', 0)))
-                
-                # [ใหม่] อัปเดตตารางสถิติ
-                self.update_daily_stats(payload.get('cam_id'), payload)
-                
-                self.conn.commit()
-            except: pass
+                if events: self.write_batch(events)
+            except Exception as e:
+                # บาง Event เสีย (เช่น payload แปลงเป็น JSON ไม่ได้): เขียนใหม่ทีละ Event ทิ้งเฉพาะตัวที่เสีย
+                # writer ต้องอยู่ต่อเสมอ ไม่งั้นคิวโตไม่สิ้นสุดและ flush() ค้าง
+                logger.warning(f"Write of {len(events)} events failed ({e}). Retrying one by one.")
+                self.write_each(events)
+            finally:
+                for item in batch:
+                    if isinstance(item, threading.Event): item.set()
 
+    def write_each(self, events):
+        """Fallback ของ write_batch: Transaction ละ Event คืนค่าจำนวน Event ที่ถูกทิ้ง"""
+        dropped = 0
+        for payload, to_pending in events:
+            try:
+                self.write_batch([(payload, to_pending)])
+            except Exception as e:
+                DB_WRITE_ERRORS.inc()
+                logger.error(f"Dropped event {payload!r}: {e}")
+                self.cache.discard(payload, to_pending)
+                dropped += 1
+        return dropped
+
+    @timed(DB_SECONDS, op="write_batch")
+    def write_batch(self, events, retries=3):
+        """เขียน Event ทั้งชุดใน Transaction เดียว: history_log/pending_data รายแถว + daily_stats รวมยอดก่อนเป็นแถวละ (วัน, กล้อง, โซน)"""
+        pending, history, daily, hourly = [], [], {}, {}
+        for payload, to_pending in events:
+            ts = payload.get('ts') or time.time()
+            cam_id, zone_id, is_staff = payload.get('cam_id'), payload.get('zone_id', ''), payload.get('is_staff', 0)
+            counts = (payload.get('in', 0), payload.get('out', 0), payload.get('checkout', 0))
+            if to_pending: pending.append((json.dumps(payload),))
+            # เวลาที่เกิด Event จริง (UTC แบบเดียวกับ CURRENT_TIMESTAMP) ไม่ใช่เวลาที่ writer เขียน
+            history.append((cam_id, *counts, is_staff, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts)), zone_id))
+            # daily_stats/hourly_stats เฉพาะลูกค้า (is_staff = 0) ตามวัน/ชั่วโมงท้องถิ่นของ Event
+            if is_staff == 0:
+                hour = time.strftime('%Y-%m-%d %H', time.localtime(ts))
+                for table, key in ((daily, (hour[:10], cam_id, zone_id)), (hourly, (hour, cam_id, zone_id))):
+                    table[key] = [a + b for a, b in zip(table.get(key, (0, 0, 0)), counts)]
+        for attempt in range(1, retries + 1):
+            with self.lock:
+                try:
+                    self.conn.executemany('INSERT INTO pending_data (payload) VALUES (?)', pending)
+                    self.conn.executemany('INSERT INTO history_log (cam_id, in_count, out_count, checkout_count, is_staff, timestamp, zone_id) VALUES (?, ?, ?, ?, ?, ?, ?)', history)
+                    # UPSERT: ถ้ามีแถวของวันนั้นแล้วให้บวกเพิ่ม ถ้ายังไม่มีให้สร้างใหม่
+                    self.conn.executemany("""
+                        INSERT INTO daily_stats (date, cam_id, zone_id, in_count, out_count, checkout_count)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(date, cam_id, zone_id) DO UPDATE SET
+                        in_count = in_count + excluded.in_count,
+                        out_count = out_count + excluded.out_count,
+                        checkout_count = checkout_count + excluded.checkout_count
+                    """, [(*key, *v) for key, v in daily.items()])
+                    self.conn.executemany("""
+                        INSERT INTO hourly_stats (hour, cam_id, zone_id, in_count, out_count, checkout_count)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(hour, cam_id, zone_id) DO UPDATE SET
+                        in_count = in_count + excluded.in_count,
+                        out_count = out_count + excluded.out_count,
+                        checkout_count = checkout_count + excluded.checkout_count
+                    """, [(*key, *v) for key, v in hourly.items()])
+                    self.conn.commit()
+                    DB_WRITE_BATCH.observe(len(events))
+                    return True
+                except sqlite3.Error as e:
+                    self.conn.rollback()
+                    DB_WRITE_ERRORS.inc()
+                    logger.error(f"DB write failed ({len(events)} events, attempt {attempt}/{retries}): {e}")
+                except Exception:
+                    # Error ที่ลองใหม่ไม่หาย: ยกเลิก Transaction แล้วให้ writer_loop ตัดสินใจ
+                    self.conn.rollback()
+                    raise
+            time.sleep(0.5 * attempt)
+        logger.error(f"Dropped {len(events)} events after {retries} failed writes")
+        for payload, to_pending in events: self.cache.discard(payload, to_pending)
+        return False
+
+    @timed(DB_SECONDS, op="get_batch")
     def get_batch(self, limit=10):
-        with self.lock:
-            self.cursor.execute('SELECT id, payload FROM pending_data ORDER BY id ASC LIMIT ?', (limit,))
-            return self.cursor.fetchall()
+        with self.reader() as conn:
+            return conn.execute('SELECT id, payload FROM pending_data ORDER BY id ASC LIMIT ?', (limit,)).fetchall()
 
+    @timed(DB_SECONDS, op="delete")
     def delete(self, row_id):
         with self.lock:
-            self.cursor.execute('DELETE FROM pending_data WHERE id = ?', (row_id,))
+            n = self.conn.execute('DELETE FROM pending_data WHERE id = ?', (row_id,)).rowcount
             self.conn.commit()
+            if n: self.cache.sent()
     
+    @timed(DB_SECONDS, op="count_pending")
     def count_pending(self):
-        with self.lock:
-            try: return self.cursor.execute('SELECT COUNT(*) FROM pending_data').fetchone()[0]
-            except: return 0
+        try:
+            with self.reader() as conn: return conn.execute('SELECT COUNT(*) FROM pending_data').fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error(f"Count pending error: {e}")
+            return 0
 
+    @timed(DB_SECONDS, op="cleanup_old_data")
     def cleanup_old_data(self, days):
+        """ลบข้อมูลดิบ (Log) เก่าทีละ retention_batch แถว แต่ละชุดเป็น Transaction สั้น ๆ แล้วปล่อย lock ให้ writer
+        ข้อมูลใน daily_stats / hourly_stats จะยังคงอยู่ คืนค่าจำนวนแถวที่ลบ"""
+        batch = int(system_settings.get('retention_batch', 5000))
+        pause = float(system_settings.get('retention_pause', 0.05))
+        deleted = 0
+        with self.lock: cutoff = self.conn.execute("SELECT date('now', ?)", (f"-{int(days)} days",)).fetchone()[0]
+        while True:
+            with self.lock:
+                try:
+                    # เลือก id จาก Index ของ timestamp (ไม่สแกนทั้งตาราง)
+                    n = self.conn.execute("DELETE FROM history_log WHERE id IN (SELECT id FROM history_log WHERE timestamp < ? LIMIT ?)", (cutoff, batch)).rowcount
+                    self.conn.commit()
+                except sqlite3.Error as e:
+                    self.conn.rollback()
+                    logger.error(f"Cleanup failed after {deleted} rows: {e}")
+                    break
+            deleted += n
+            if n < batch: break
+            time.sleep(pause)
+        if deleted: logger.info(f"Retention: deleted {deleted} history rows older than {cutoff}")
+        self.reclaim_space()
+        return deleted
+
+    def enable_incremental_vacuum(self):
+        """DB ที่สร้างก่อนเปิด auto_vacuum ต้อง VACUUM หนึ่งครั้งจึงจะใช้ incremental_vacuum ได้
+        VACUUM เขียนไฟล์ใหม่ทั้งไฟล์โดยถือ self.lock ตลอด จึงเรียกจาก init() ก่อน writer / กล้อง / MQTT เริ่มทำงาน"""
         with self.lock:
             try:
-                # ลบข้อมูลดิบ (Log) เก่า แต่ข้อมูลใน daily_stats จะยังคงอยู่
-                self.cursor.execute(f"DELETE FROM history_log WHERE timestamp < date('now', '-{days} days')")
-                self.conn.commit()
-            except: pass
+                if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2: return
+                if self.writer is not None:
+                    logger.warning("Converting database to incremental auto-vacuum (one-time VACUUM). New events queue and MQTT sync waits until it finishes...")
+                else:
+                    logger.info("Converting database to incremental auto-vacuum (one-time VACUUM). Startup continues when it finishes...")
+                t0 = time.perf_counter()
+                self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                self.conn.execute("VACUUM")
+                logger.info(f"VACUUM completed in {time.perf_counter() - t0:.1f}s")
+            except sqlite3.Error as e:
+                logger.error(f"VACUUM failed: {e}")
 
-    def export_csv(self):
-        with self.lock:
-            self.cursor.execute("SELECT * FROM history_log ORDER BY id DESC")
-            rows = self.cursor.fetchall()
-            output = io.StringIO()
-            writer = csv.writer(output)
-            writer.writerow(['ID', 'Camera', 'IN', 'OUT', 'CHECKOUT', 'Is Staff', 'Timestamp'])
-            writer.writerows(rows)
-            output.seek(0)
-            return output
+    def reclaim_space(self, pages=1000):
+        """คืนหน้าว่างให้ระบบไฟล์ทีละ pages หน้า (ไม่ lock นานแบบ VACUUM ทั้งไฟล์)"""
+        freed = 0
+        while True:
+            with self.lock:
+                try:
+                    free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    if free == 0 or self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2: break
+                    # executescript: pragma นี้คืนทีละหน้าต่อ step ส่วน execute() ของ sqlite3 step แค่ครั้งเดียว
+                    self.conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+                except sqlite3.Error as e:
+                    logger.error(f"Incremental vacuum failed: {e}")
+                    break
+            freed += min(free, pages)
+            time.sleep(float(system_settings.get('retention_pause', 0.05)))
+        if freed: logger.info(f"Reclaimed {freed} free pages")
+        return freed
+
+    # --- Export CSV ---
+    # (หัวตาราง, SQL, คอลัมน์เวลา) ตามชนิด export: ตารางสรุปเป็นยอดลูกค้าเท่านั้น เวลาเป็นท้องถิ่น / raw เป็นเวลา UTC ตามที่เก็บ
+    EXPORTS = {
+        "raw": (['ID', 'Camera', 'IN', 'OUT', 'CHECKOUT', 'Is Staff', 'Timestamp', 'Zone'],
+                "SELECT id, cam_id, in_count, out_count, checkout_count, is_staff, timestamp, zone_id FROM history_log{where} ORDER BY timestamp DESC", "timestamp"),
+        "hourly": (['Hour', 'Camera', 'Zone', 'IN', 'OUT', 'CHECKOUT'],
+                   "SELECT hour, cam_id, zone_id, in_count, out_count, checkout_count FROM hourly_stats{where} ORDER BY hour, cam_id, zone_id", "hour"),
+        "daily": (['Date', 'Camera', 'Zone', 'IN', 'OUT', 'CHECKOUT'],
+                  "SELECT date, cam_id, zone_id, in_count, out_count, checkout_count FROM daily_stats{where} ORDER BY date, cam_id, zone_id", "date"),
+    }
+
+    def export_csv(self, start=None, end=None, cam_id=None, include_staff=True, group="raw", compress=False, chunk=2000):
+        """Generator ของ CSV (bytes) ทีละช่วง อ่านจาก Connection อ่านอย่างเดียวของตัวเอง (ไม่ยืมจาก pool เพราะ Client อาจดาวน์โหลดช้า)
+        จึงไม่ถือ self.lock ไม่แย่ง Query ของ Dashboard/MQTT และไม่โหลดทั้งตารางเข้า RAM
+
+        start/end เป็น datetime เวลาท้องถิ่น (ช่วง [start, end)) / group = raw, hourly, daily / compress = gzip
+        """
+        header, sql, column = self.EXPORTS[group]
+        if group == "raw":
+            # history_log เก็บเวลา UTC
+            fmt = lambda t: t.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            fmt = lambda t: t.strftime('%Y-%m-%d %H' if group == "hourly" else '%Y-%m-%d')
+        where, params = [], []
+        if start: where.append(f"{column} >= ?"); params.append(fmt(start))
+        if end: where.append(f"{column} < ?"); params.append(fmt(end))
+        if cam_id: where.append("cam_id = ?"); params.append(cam_id)
+        if not include_staff and group == "raw": where.append("is_staff = 0")
+        sql = sql.format(where=" WHERE " + " AND ".join(where) if where else "")
+        gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+        def encode(rows):
+            out = io.StringIO()
+            csv.writer(out).writerows(rows)
+            data = out.getvalue().encode('utf-8')
+            return gz.compress(data) if gz else data
+
+        t0 = time.perf_counter()
+        conn = None
+        try:
+            conn = self.pool.connect()
+            cur = conn.execute(sql, params)
+            yield encode([header])
+            while True:
+                rows = cur.fetchmany(chunk)
+                if not rows: break
+                data = encode(rows)
+                if data: yield data
+            if gz: yield gz.flush()
+        except sqlite3.Error as e:
+            logger.error(f"CSV export failed: {e}")
+            raise
+        finally:
+            if conn is not None: conn.close()
+            DB_SECONDS.observe(time.perf_counter() - t0, op=f"export_{group}")
 
     # --- สถิติรายชั่วโมง (วันนี้) ---
-    # ยังใช้ history_log เพราะ daily_stats ไม่เก็บรายชั่วโมง
+    # [ปรับปรุง] ใช้ hourly_stats แทนการสแกน history_log / เงื่อนไขเป็นช่วงของ Primary Key (ใช้ Index ได้)
+    @timed(DB_SECONDS, op="get_hourly_stats")
     def get_hourly_stats(self):
-        with self.lock:
-            try:
-                query = """SELECT strftime('%H', timestamp, 'localtime') as hour, SUM(in_count), SUM(out_count), SUM(checkout_count) 
-                           FROM history_log 
-                           WHERE date(timestamp, 'localtime') = date('now', 'localtime') AND is_staff = 0 
-                           GROUP BY hour"""
-                self.cursor.execute(query)
-                rows = self.cursor.fetchall()
-                stats = {h: {'in': 0, 'out': 0, 'checkout': 0} for h in range(24)}
-                for r in rows:
-                    h = int(r[0])
-                    stats[h]['in'] = r[1]
-                    stats[h]['out'] = r[2]
-                    stats[h]['checkout'] = r[3]
-                return stats
-            except: return {}
+        try:
+            today = datetime.now().date()
+            query = """SELECT substr(hour, 12, 2) as h, SUM(in_count), SUM(out_count), SUM(checkout_count) 
+                       FROM hourly_stats 
+                       WHERE hour >= ? AND hour < ?
+                       GROUP BY h"""
+            with self.reader() as conn: rows = conn.execute(query, (today.isoformat(), (today + timedelta(days=1)).isoformat())).fetchall()
+            stats = {h: {'in': 0, 'out': 0, 'checkout': 0} for h in range(24)}
+            for r in rows:
+                h = int(r[0])
+                stats[h]['in'] = r[1]
+                stats[h]['out'] = r[2]
+                stats[h]['checkout'] = r[3]
+            return stats
+        except Exception as e:
+            logger.error(f"Get hourly stats error: {e}")
+            return {}
 
     # --- สถิติรายวัน (เดือนนี้) ---
     # [ปรับปรุง] ใช้ daily_stats แทน history_log เพื่อความเร็ว
+    @timed(DB_SECONDS, op="get_daily_stats")
     def get_daily_stats(self):
-        with self.lock:
-            try:
-                # ดึงข้อมูลจากตาราง daily_stats
-                query = """SELECT strftime('%d', date) as day, SUM(in_count), SUM(out_count), SUM(checkout_count) 
-                           FROM daily_stats 
-                           WHERE strftime('%Y-%m', date) = strftime('%Y-%m', 'now', 'localtime')
-                           GROUP BY day"""
-                self.cursor.execute(query)
-                rows = self.cursor.fetchall()
-                stats = {d: {'in': 0, 'out': 0, 'checkout': 0} for d in range(1, 32)}
-                for r in rows:
-                    d = int(r[0])
-                    if d in stats:
-                        stats[d]['in'] = r[1]
-                        stats[d]['out'] = r[2]
-                        stats[d]['checkout'] = r[3]
-                return stats
-            except Exception as e: 
-                logger.error(f"Get daily stats error: {e}")
-                return {}
+        try:
+            # ดึงข้อมูลจากตาราง daily_stats
+            first = datetime.now().date().replace(day=1)
+            query = """SELECT strftime('%d', date) as day, SUM(in_count), SUM(out_count), SUM(checkout_count) 
+                       FROM daily_stats 
+                       WHERE date >= ? AND date < ?
+                       GROUP BY day"""
+            with self.reader() as conn: rows = conn.execute(query, (first.isoformat(), (first + timedelta(days=32)).replace(day=1).isoformat())).fetchall()
+            stats = {d: {'in': 0, 'out': 0, 'checkout': 0} for d in range(1, 32)}
+            for r in rows:
+                d = int(r[0])
+                if d in stats:
+                    stats[d]['in'] = r[1]
+                    stats[d]['out'] = r[2]
+                    stats[d]['checkout'] = r[3]
+            return stats
+        except Exception as e: 
+            logger.error(f"Get daily stats error: {e}")
+            return {}
 
     # --- สถิติรายเดือน (ปีนี้) ---
     # [ปรับปรุง] ใช้ daily_stats รวมข้อมูลเป็นรายเดือน
+    @timed(DB_SECONDS, op="get_monthly_stats")
     def get_monthly_stats(self):
-        with self.lock:
-            try:
-                # ดึงข้อมูลจากตาราง daily_stats
-                query = """SELECT strftime('%m', date) as month, SUM(in_count), SUM(out_count), SUM(checkout_count) 
-                           FROM daily_stats 
-                           WHERE strftime('%Y', date) = strftime('%Y', 'now', 'localtime')
-                           GROUP BY month"""
-                self.cursor.execute(query)
-                rows = self.cursor.fetchall()
-                stats = {m: {'in': 0, 'out': 0, 'checkout': 0} for m in range(1, 13)}
-                for r in rows:
-                    m = int(r[0])
-                    if m in stats:
-                        stats[m]['in'] = r[1]
-                        stats[m]['out'] = r[2]
-                        stats[m]['checkout'] = r[3]
-                return stats
-            except: return {}
-
-db = LocalBuffer()
+        try:
+            # ดึงข้อมูลจากตาราง daily_stats
+            year = datetime.now().year
+            query = """SELECT strftime('%m', date) as month, SUM(in_count), SUM(out_count), SUM(checkout_count) 
+                       FROM daily_stats 
+                       WHERE date >= ? AND date < ?
+                       GROUP BY month"""
+            with self.reader() as conn: rows = conn.execute(query, (f"{year}-01-01", f"{year + 1}-01-01")).fetchall()
+            stats = {m: {'in': 0, 'out': 0, 'checkout': 0} for m in range(1, 13)}
+            for r in rows:
+                m = int(r[0])
+                if m in stats:
+                    stats[m]['in'] = r[1]
+                    stats[m]['out'] = r[2]
+                    stats[m]['checkout'] = r[3]
+            return stats
+        except Exception as e:
+            logger.error(f"Get monthly stats error: {e}")
+            return {}
+
+# DB ของระบบ: import แล้วยังไม่เปิดไฟล์ / ไม่เริ่ม Thread ใด ๆ จนกว่า Process หลักของแอปจะเรียก init()
+# (Worker Process และเครื่องมือ CLI เช่น replay.py / db_benchmark.py จึงไม่แตะ DB จริง)
+db = LocalBuffer(connect=False)
+DB_PENDING.callback = lambda: [({}, db.cache.pending)]
+DB_WRITE_QUEUE.callback = lambda: [({}, db.queue.qsize())]
+DB_READ_POOL.callback = lambda: [({"state": "in_use"}, db.pool.in_use()), ({"state": "open"}, db.pool.created)]
 
 def cleanup_loop():
     while True:
@@ -225,4 +611,15 @@ def cleanup_loop():
         db.cleanup_old_data(days)
         time.sleep(86400)
 
-threading.Thread(target=cleanup_loop, daemon=True).start()
\ No newline at end of file
+_started = False
+
+def init():
+    """เปิด DB จริงและเริ่มงานเบื้องหลัง (ลบข้อมูลเก่า / flush ตอนปิดโปรแกรม) เรียกครั้งเดียวจาก main.py"""
+    global _started
+    db.open()
+    if _started: return
+    _started = True
+    # DB เก่า: VACUUM ครั้งเดียวตอนนี้ (ยังไม่มีใครรอ lock) ไม่ใช่ระหว่างที่ writer / MQTT sync ทำงานอยู่
+    db.enable_incremental_vacuum()
+    threading.Thread(target=cleanup_loop, name="db-cleanup", daemon=True).start()
+    atexit.register(db.flush)
\ No newline at end of file
@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+from database import LocalBuffer
+
+# ==========================================
+# 8.1 DATABASE BENCHMARK (Query กราฟบน DB ขนาด 1 ปี)
+# ==========================================
+# python db_benchmark.py --days 365 --events-per-day 3000 --cams 4
+# สร้าง DB จำลองในไฟล์ชั่วคราว (ไม่แตะ DB จริง) แล้ววัดเวลา backfill และ Query ของ /api/stats แบบเดิมเทียบกับแบบใหม่
+# และเวลา commit ของ writer ระหว่างที่มีคนโหลดกราฟ/export พร้อมกัน (--contention วินาที)
+
+# Query เดิมก่อนมี hourly_stats / range predicate (สแกนทั้งตาราง)
+LEGACY_QUERIES = {
+    "hourly": """SELECT strftime('%H', timestamp, 'localtime') as hour, SUM(in_count), SUM(out_count), SUM(checkout_count)
+                 FROM history_log WHERE date(timestamp, 'localtime') = date('now', 'localtime') AND is_staff = 0 GROUP BY hour""",
+    "daily": """SELECT strftime('%d', date) as day, SUM(in_count), SUM(out_count), SUM(checkout_count)
+                FROM daily_stats WHERE strftime('%Y-%m', date) = strftime('%Y-%m', 'now', 'localtime') GROUP BY day""",
+    "monthly": """SELECT strftime('%m', date) as month, SUM(in_count), SUM(out_count), SUM(checkout_count)
+                  FROM daily_stats WHERE strftime('%Y', date) = strftime('%Y', 'now', 'localtime') GROUP BY month""",
+}
+
+
+def populate(db, days, per_day, cams, seed=0):
+    """เติม history_log แบบสุ่ม (ช่วงเปิดร้าน 08-22 น.) ย้อนหลัง days วันจนถึงตอนนี้"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    start = now - timedelta(days=days)
+    rows = []
+    for d in range(days + 1):
+        day = (start + timedelta(days=d)).replace(hour=8, minute=0, second=0, microsecond=0)
+        for _ in range(per_day):
+            ts = day + timedelta(seconds=rng.randrange(14 * 3600))
+            if ts > now: continue
+            kind = rng.random()
+            rows.append((f"cam{rng.randrange(cams)}", int(kind < 0.45), int(0.45 <= kind < 0.9), int(kind >= 0.9), int(rng.random() < 0.05),
+                         time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts.timestamp())), ''))
+        if len(rows) > 200000:
+            db.conn.executemany('INSERT INTO history_log (cam_id, in_count, out_count, checkout_count, is_staff, timestamp, zone_id) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            rows = []
+    db.conn.executemany('INSERT INTO history_log (cam_id, in_count, out_count, checkout_count, is_staff, timestamp, zone_id) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    db.conn.commit()
+    return db.conn.execute("SELECT COUNT(*) FROM history_log").fetchone()[0]
+
+
+def timeit(fn, runs):
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {"median_ms": round(statistics.median(samples), 3), "max_ms": round(max(samples), 3)}
+
+
+def contention(db, seconds, readers=4, rate=50):
+    """Export + กราฟวนซ้ำใน readers Thread ขณะที่ส่ง Event rate ครั้ง/วินาที แล้วสรุปเวลา write_batch และเวลารอ lock"""
+    stop = threading.Event()
+    reads = []
+
+    def reader():
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            for _ in db.export_csv(group="raw"): pass
+            db.get_hourly_stats(); db.get_daily_stats(); db.get_monthly_stats()
+            reads.append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=reader, daemon=True) for _ in range(readers)]
+    for t in threads: t.start()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        db.save({"cam_id": "cam0", "ts": time.time(), "in": 1, "is_staff": 0})
+        time.sleep(1.0 / rate)
+    db.flush()
+    stop.set()
+    for t in threads: t.join()
+    snap = metrics.snapshot()
+    return {"readers": readers, "events": int(seconds * rate), "full_read_passes": len(reads),
+            "write_batch": snap["smartcounter_db_seconds"].get('op="write_batch"'),
+            "lock_wait": snap["smartcounter_lock_wait_seconds"]}
+
+
+def run(days, per_day, cams, runs, contention_s=0):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = LocalBuffer(os.path.join(tmp, "bench.db"))
+        t0 = time.perf_counter()
+        rows = populate(db, days, per_day, cams)
+        result = {"days": days, "events_per_day": per_day, "cams": cams, "history_rows": rows,
+                  "populate_s": round(time.perf_counter() - t0, 2)}
+
+        t0 = time.perf_counter()
+        db.migrate_old_data()
+        db.migrate_hourly_stats()
+        result["backfill_s"] = round(time.perf_counter() - t0, 2)
+        result["db_mb"] = round(os.path.getsize(os.path.join(tmp, "bench.db")) / 1e6, 1)
+
+        current = {"hourly": db.get_hourly_stats, "daily": db.get_daily_stats, "monthly": db.get_monthly_stats}
+        result["queries"] = {}
+        for name, sql in LEGACY_QUERIES.items():
+            result["queries"][name] = {"legacy": timeit(lambda: db.conn.execute(sql).fetchall(), runs), "current": timeit(current[name], runs)}
+        result["legacy_hourly_plan"] = [r[-1] for r in db.conn.execute("EXPLAIN QUERY PLAN " + LEGACY_QUERIES["hourly"])]
+        if contention_s: result["contention"] = contention(db, contention_s)
+        db.pool.close()
+        db.conn.close()
+        return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark dashboard chart queries on a synthetic database")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--events-per-day", type=int, default=3000)
+    parser.add_argument("--cams", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--contention", type=float, default=0, help="seconds of concurrent reads while writing")
+    args = parser.parse_args()
+    print(json.dumps(run(args.days, args.events_per_day, args.cams, args.runs, args.contention), indent=4))
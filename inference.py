@@ -0,0 +1,114 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from metrics import INFER_BATCH_SECONDS, INFER_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 3. INFERENCE SCHEDULER (Batch ข้ามกล้อง)
+# ==========================================
+class InferenceScheduler:
+    """รวมเฟรมล่าสุดของทุกกล้องแล้วส่งเข้าโมเดลเป็น batch เดียว
+
+    detect_fn(frames, conf, imgsz) ต้องคืนค่า list ของ array [x1, y1, x2, y2, conf, cls] ตามลำดับเฟรม
+    เฟรมที่ขอ imgsz ต่างกันจะถูกแยกเป็นคนละ batch
+    detect_fn ใส่ทีหลังได้ด้วย set_detector() (ระหว่างโหลดโมเดล ready ยังไม่ถูก set)
+    กล้องที่ไม่รัน Detector ในเฟรมนี้ (detect_interval / motion gate) ต้องเรียก skip() ไม่งั้นกล้องอื่นต้องรอครบ max_wait
+    """
+    def __init__(self, detect_fn=None, max_batch=4, max_wait=0.015):
+        self.detect_fn = detect_fn
+        self.ready = threading.Event()
+        if detect_fn: self.ready.set()
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait))
+        self.pending = OrderedDict()
+        self.clients = set()
+        # กล้องที่แจ้งว่าเฟรมล่าสุดไม่ส่งเข้า Detector (ไม่ต้องรอ) จนกว่าจะ submit ครั้งถัดไป
+        self.idle = set()
+        self.cond = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, name="inference", daemon=True)
+        self.thread.start()
+
+    def set_detector(self, detect_fn):
+        with self.cond:
+            self.detect_fn = detect_fn
+            self.ready.set()
+            self.cond.notify_all()
+
+    def register(self, cam_id):
+        with self.cond:
+            self.clients.add(cam_id)
+
+    def unregister(self, cam_id):
+        with self.cond:
+            self.clients.discard(cam_id)
+            self.idle.discard(cam_id)
+            item = self.pending.pop(cam_id, None)
+            if item: item[-1].cancel()
+            self.cond.notify()
+
+    def submit(self, cam_id, frame, conf=0.25, imgsz=640, callback=None):
+        """ส่งเฟรมเข้าคิว คืนค่า Future ที่จะได้ detection ของเฟรมนี้ (กรอง conf แล้ว)"""
+        fut = Future()
+        if callback: fut.add_done_callback(callback)
+        with self.cond:
+            # เก็บแค่เฟรมล่าสุดของแต่ละกล้อง เฟรมเก่าที่ยังไม่ถูกประมวลผลให้ยกเลิก
+            old = self.pending.pop(cam_id, None)
+            if old: old[-1].cancel()
+            self.pending[cam_id] = (frame, conf, imgsz, fut)
+            self.idle.discard(cam_id)
+            self.cond.notify()
+        return fut
+
+    def skip(self, cam_id):
+        """แจ้งว่ากล้องนี้ข้าม Detector ในเฟรมนี้: batch ที่รออยู่ไม่ต้องรอเฟรมของกล้องนี้"""
+        with self.cond:
+            if cam_id in self.idle or cam_id not in self.clients: return
+            self.idle.add(cam_id)
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def _batch_ready(self):
+        if len(self.pending) >= self.max_batch: return True
+        # ทุกกล้องที่ active (ไม่นับกล้องที่แจ้ง skip) ส่งเฟรมมาครบแล้ว ไม่ต้องรอต่อ
+        return bool(self.clients) and (self.clients - self.idle).issubset(self.pending.keys())
+
+    def loop(self):
+        while True:
+            with self.cond:
+                while self.running and (not self.pending or not self.ready.is_set()): self.cond.wait(0.5)
+                if not self.running: break
+                deadline = time.monotonic() + self.max_wait
+                while not self._batch_ready():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0: break
+                    self.cond.wait(remaining)
+                n = min(self.max_batch, len(self.pending))
+                batch = [self.pending.popitem(last=False) for _ in range(n)]
+
+            groups = {}
+            for _, job in batch:
+                if job[3].set_running_or_notify_cancel(): groups.setdefault(job[2], []).append(job)
+            for imgsz, jobs in groups.items(): self.run_batch(jobs, imgsz)
+
+    def run_batch(self, jobs, imgsz):
+        try:
+            # ใช้ conf ต่ำสุดของ batch แล้วค่อยกรองตามค่าของแต่ละกล้อง
+            INFER_BATCH_SIZE.observe(len(jobs))
+            with INFER_BATCH_SECONDS.time(imgsz=imgsz):
+                results = self.detect_fn([j[0] for j in jobs], min(j[1] for j in jobs), imgsz)
+            for (frame, conf, _, fut), dets in zip(jobs, results):
+                fut.set_result(dets[dets[:, 4] >= conf])
+        except Exception as e:
+            logger.exception(f"Batch inference failed: {e}")
+            for job in jobs:
+                if not job[3].done(): job[3].set_exception(e)
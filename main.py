@@ -1,6 +1,36 @@
-from camera import init_cameras
+import time
+import logging
+from logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# วัดเวลาเริ่มระบบแต่ละช่วง (import / เปิดกล้อง) โมเดลโหลดเบื้องหลังแยกต่างหาก ดูได้ที่ /api/stats -> model
+t0 = time.perf_counter()
+from config import system_settings
+import database
+import mqtt
+import utils
+from camera import init_cameras, start_model_warmup
 from app import app
+logger.info(f"Startup: imports {time.perf_counter() - t0:.2f}s")
 
 if __name__ == '__main__':
+    database.init()
+    mqtt.start()
+    utils.start()
+    # โหมด process: Worker แต่ละตัวโหลดโมเดลเอง ไม่ต้องโหลดใน Process หลัก
+    if system_settings.get('camera_process_mode', 'thread') != 'process': start_model_warmup()
+    t0 = time.perf_counter()
     init_cameras()
-    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
+    logger.info(f"Startup: cameras {time.perf_counter() - t0:.2f}s")
+    # server_mode = "asgi": ภาพสดเป็น Coroutine บน uvicorn (ต้องติดตั้ง uvicorn / starlette) ไม่งั้นใช้ Flask server เดิม
+    if system_settings.get('server_mode', 'flask') == 'asgi':
+        try:
+            import asgi_server
+            asgi_server.run(host='0.0.0.0', port=5000)
+        except ImportError as e:
+            logger.error(f"ASGI server unavailable ({e}). Falling back to Flask server.")
+            app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
+    else:
+        app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
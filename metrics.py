@@ -0,0 +1,182 @@
+import bisect
+import functools
+import threading
+import time
+
+# ==========================================
+# 2.1 METRICS (Histogram / Counter / Gauge แบบ Prometheus)
+# ==========================================
+# ทุก metric เก็บในหน่วยความจำของ Process หลัก บันทึกค่าด้วย lock สั้น ๆ ต่อ metric
+# แสดงผลที่ /metrics (Prometheus text format) และสรุปใน /api/stats -> "metrics"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_registry = []
+
+
+def _label_str(labels):
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text):
+        self.name, self.help = name, help_text
+        self.lock = threading.Lock()
+        self.values = {}
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock: items = list(self.values.items())
+        for labels, value in items: lines += self._render_one(labels, value)
+        return lines
+
+    def _render_one(self, labels, value):
+        ls = _label_str(labels)
+        return [f"{self.name}{{{ls}}} {value}" if ls else f"{self.name} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock: self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock: return {_label_str(k): v for k, v in self.values.items()}
+
+
+class Gauge(_Metric):
+    """ค่า ณ ปัจจุบัน: set() เอง หรือส่ง callback ให้คำนวณตอนถูกอ่าน (เช่นความยาวคิว)"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, callback=None):
+        super().__init__(name, help_text)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self.lock: self.values[tuple(sorted(labels.items()))] = value
+
+    def remove(self, **labels):
+        with self.lock: self.values.pop(tuple(sorted(labels.items())), None)
+
+    def _collect(self):
+        if self.callback:
+            try:
+                for labels, value in self.callback(): self.set(value, **labels)
+            except Exception: pass
+
+    def render(self):
+        self._collect()
+        return super().render()
+
+    def snapshot(self):
+        self._collect()
+        with self.lock: return {_label_str(k): v for k, v in self.values.items()}
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            h = self.values.get(key)
+            if h is None: h = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _render_one(self, labels, value):
+        counts, total, n = value
+        lines, cum = [], 0
+        for bound, c in zip(self.buckets + (float('inf'),), counts):
+            cum += c
+            le = "+Inf" if bound == float('inf') else repr(bound)
+            lines.append(f'{self.name}_bucket{{{_label_str(labels + (("le", le),))}}} {cum}')
+        ls = f"{{{_label_str(labels)}}}" if labels else ""
+        lines.append(f"{self.name}_sum{ls} {total}")
+        lines.append(f"{self.name}_count{ls} {n}")
+        return lines
+
+    def quantile(self, counts, n, q):
+        """ประมาณค่า quantile จาก bucket (ขอบบนของ bucket ที่ครอบ)"""
+        target, cum = q * n, 0
+        for bound, c in zip(self.buckets, counts):
+            cum += c
+            if cum >= target: return bound
+        return self.buckets[-1]
+
+    def snapshot(self):
+        with self.lock: items = [(k, (list(v[0]), v[1], v[2])) for k, v in self.values.items()]
+        return {_label_str(k): {"count": n, "avg_ms": round(total / n * 1000, 3) if n else 0.0,
+                                "p50_ms": self.quantile(counts, n, 0.5) * 1000, "p90_ms": self.quantile(counts, n, 0.9) * 1000}
+                for k, (counts, total, n) in items}
+
+
+def timed(hist, **labels):
+    """Decorator: บันทึกเวลาที่ฟังก์ชันใช้ลง hist"""
+    def wrap(f):
+        @functools.wraps(f)
+        def inner(*args, **kwargs):
+            with _Timer(hist, labels): return f(*args, **kwargs)
+        return inner
+    return wrap
+
+
+class _Timer:
+    def __init__(self, hist, labels): self.hist, self.labels = hist, labels
+    def __enter__(self): self.t0 = time.perf_counter(); return self
+    def __exit__(self, *exc): self.hist.observe(time.perf_counter() - self.t0, **self.labels)
+
+
+class TimedLock:
+    """threading.Lock ที่บันทึกเวลารอ lock ลง lock_wait_seconds{lock=name}"""
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        if self.lock.acquire(blocking=False): return self
+        t0 = time.perf_counter()
+        self.lock.acquire()
+        LOCK_WAIT.observe(time.perf_counter() - t0, lock=self.name)
+        return self
+
+    def __exit__(self, *exc): self.lock.release()
+
+
+def render_prometheus():
+    return "\n".join(line for m in _registry for line in m.render()) + "\n"
+
+
+def snapshot():
+    return {m.name: m.snapshot() for m in _registry}
+
+
+# --- metric ที่ใช้ทั้งระบบ ---
+STAGE_SECONDS = Histogram("smartcounter_stage_seconds", "Per-frame processing time by camera and stage")
+CAPTURE_DECODE_SECONDS = Histogram("smartcounter_capture_decode_seconds", "Frame retrieve/decode time per camera")
+CAPTURE_FRAMES = Counter("smartcounter_capture_frames_total", "Frames grabbed per camera by result (decoded, skipped, dropped, stale, processed)")
+CAMERA_FPS = Gauge("smartcounter_camera_fps", "Effective processed frames per second per camera")
+INFER_BATCH_SECONDS = Histogram("smartcounter_inference_batch_seconds", "Detector call time per batch")
+INFER_BATCH_SIZE = Histogram("smartcounter_inference_batch_size", "Frames per inference batch", buckets=(1, 2, 3, 4, 6, 8, 12, 16))
+INFER_QUEUE = Gauge("smartcounter_inference_queue_depth", "Frames waiting in the inference scheduler")
+LOCK_WAIT = Histogram("smartcounter_lock_wait_seconds", "Time spent waiting for contended locks")
+DB_SECONDS = Histogram("smartcounter_db_seconds", "SQLite operation time by operation")
+DB_PENDING = Gauge("smartcounter_db_pending_rows", "Rows waiting in pending_data for MQTT sync")
+DB_WRITE_QUEUE = Gauge("smartcounter_db_write_queue_depth", "Count events waiting for the DB writer")
+DB_WRITE_BATCH = Histogram("smartcounter_db_write_batch_size", "Events committed per DB transaction", buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+DB_WRITE_ERRORS = Counter("smartcounter_db_write_errors_total", "Failed DB write transactions")
+DB_READ_POOL = Gauge("smartcounter_db_read_connections", "Read-only SQLite connections by state (open, in_use)")
+MQTT_PUBLISH_SECONDS = Histogram("smartcounter_mqtt_publish_seconds", "MQTT publish call time")
+MQTT_MESSAGES = Counter("smartcounter_mqtt_messages_total", "MQTT messages by source (live, sync) and result")
@@ -0,0 +1,232 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+import cv2
+import numpy as np
+
+from config import DATA_DIR, MODELS_DIR, MODEL_SELECTION_FILE, system_settings, cameras_config
+from ov_engine import OpenVINODetector, letterbox_into
+from tracker import iou_matrix
+
+# ==========================================
+# 7. MODEL PREPARATION (FP32 / FP16 / INT8)
+# ==========================================
+# python model_prep.py collect   -> เก็บภาพ Calibration จากกล้องของสาขา
+# python model_prep.py build     -> สร้าง IR ทั้ง 3 แบบใน data/models/<variant>/
+# python model_prep.py benchmark -> วัด latency/throughput/recall แล้วบันทึกตัวที่เลือกใน data/models/selected.json
+MODEL_NAME = "yolov8n"
+OPENVINO_DIR = f"{MODEL_NAME}_openvino_model"
+CALIB_DIR = f"{DATA_DIR}/calibration"
+CLIPS_DIR = f"{DATA_DIR}/clips"
+VARIANTS = ["fp32", "fp16", "int8"]
+IMGSZ = 640
+
+
+def variant_xml(variant): return os.path.join(MODELS_DIR, variant, f"{MODEL_NAME}.xml")
+
+
+def collect_calibration(frames_per_cam=100, interval=2.0):
+    """สุ่มภาพจากกล้องทุกตัว (ใช้ Sub-stream ถ้ามี) เก็บเป็น JPEG ใน data/calibration"""
+    os.makedirs(CALIB_DIR, exist_ok=True)
+    for cam_id, data in cameras_config.items():
+        src = (data.get('config') or {}).get('sub_url') or data['url']
+        cap = cv2.VideoCapture(src, cv2.CAP_FFMPEG)
+        saved, last = 0, 0.0
+        while saved < frames_per_cam:
+            ok, frame = cap.read()
+            if not ok: break
+            if time.time() - last < interval: continue
+            last = time.time()
+            cv2.imwrite(os.path.join(CALIB_DIR, f"{cam_id}_{int(last * 1000)}.jpg"), frame)
+            saved += 1
+        cap.release()
+        print(f"📸 [{cam_id}] saved {saved} calibration frames")
+
+
+def calibration_tensors(limit=300):
+    canvas = np.empty((IMGSZ, IMGSZ, 3), dtype=np.uint8)
+    for path in sorted(glob.glob(os.path.join(CALIB_DIR, "*.jpg")))[:limit]:
+        img = cv2.imread(path)
+        if img is None: continue
+        tensor = np.empty((1, 3, IMGSZ, IMGSZ), dtype=np.float32)
+        letterbox_into(img, canvas, tensor)
+        yield tensor
+
+
+def source_is_half():
+    """IR ใน OPENVINO_DIR ถูก Export แบบ half (FP16) หรือไม่ (อ่านจาก metadata.yaml ของ ultralytics)"""
+    import yaml
+    try:
+        with open(os.path.join(OPENVINO_DIR, "metadata.yaml"), encoding='utf-8') as f:
+            return bool((yaml.safe_load(f).get('args') or {}).get('half', False))
+    except (OSError, yaml.YAMLError):
+        return True  # ไม่รู้ที่มา ถือว่าไม่ใช่ FP32 แท้
+
+
+def build_variants(subset_size=300):
+    """สร้าง FP32 จาก ONNX (หรือ IR เดิมถ้าไม่มีไฟล์ .pt), FP16 จาก FP32 และ INT8 ด้วย NNCF Post-Training Quantization
+
+    ถ้าไม่มี .pt และ IR เดิมเป็น FP16 จะไม่สร้าง fp32 (weight ถูกปัดเป็น FP16 ไปแล้ว) ค่าอ้างอิง recall จึงเป็น FP16
+    """
+    import openvino as ov
+    variants = list(VARIANTS)
+    if os.path.exists(f"{MODEL_NAME}.pt"):
+        from ultralytics import YOLO
+        # dynamic: รับ input หลายขนาดได้ (roi_inference รันที่ roi_imgsz ได้จริง ไม่ถูกบังคับเป็น 640)
+        onnx_path = YOLO(f"{MODEL_NAME}.pt").export(format="onnx", imgsz=IMGSZ, dynamic=True)
+        source = ov.convert_model(onnx_path)
+    else:
+        source = ov.Core().read_model(os.path.join(OPENVINO_DIR, f"{MODEL_NAME}.xml"))
+        if not source.input(0).get_partial_shape().is_dynamic:
+            print(f"⚠️ {OPENVINO_DIR} has a static {IMGSZ}x{IMGSZ} input. roi_inference will still run at {IMGSZ}; put {MODEL_NAME}.pt here to build dynamic-shape variants.")
+        if source_is_half():
+            variants.remove("fp32")
+            print(f"⚠️ {MODEL_NAME}.pt not found and {OPENVINO_DIR} is an FP16 export. No FP32 variant is built; "
+                  f"FP16 is the recall reference for INT8. Put {MODEL_NAME}.pt here to build a true FP32 reference.")
+            # fp32 จาก build ครั้งก่อนอาจเป็นคนละโมเดลกับที่สร้างรอบนี้
+            if os.path.exists(os.path.dirname(variant_xml("fp32"))): shutil.rmtree(os.path.dirname(variant_xml("fp32")))
+        else:
+            print(f"⚠️ {MODEL_NAME}.pt not found. Using the FP32 IR in {OPENVINO_DIR} as the source.")
+
+    for variant in variants: os.makedirs(os.path.dirname(variant_xml(variant)), exist_ok=True)
+    if "fp32" in variants: ov.save_model(source, variant_xml("fp32"), compress_to_fp16=False)
+    ov.save_model(source, variant_xml("fp16"), compress_to_fp16=True)
+    print(f"✅ {' / '.join(v.upper() for v in variants if v != 'int8')} IR saved")
+
+    calib = list(calibration_tensors(subset_size))
+    if not calib:
+        print(f"⚠️ No calibration frames in {CALIB_DIR}. Run 'collect' first. INT8 skipped.")
+    else:
+        try:
+            import nncf
+        except ImportError:
+            print("❌ nncf is not installed (pip install nncf). INT8 skipped.")
+        else:
+            int8 = nncf.quantize(source, nncf.Dataset(calib), preset=nncf.QuantizationPreset.MIXED, subset_size=len(calib))
+            ov.save_model(int8, variant_xml("int8"), compress_to_fp16=False)
+            print(f"✅ INT8 IR saved (calibrated on {len(calib)} frames)")
+
+    # ultralytics YOLO(dir) ต้องมี metadata.yaml อยู่ในโฟลเดอร์เดียวกับ IR (args ตรงกับ variant: dynamic / half / int8)
+    import yaml
+    meta_path = os.path.join(OPENVINO_DIR, "metadata.yaml")
+    if not os.path.exists(meta_path): return
+    with open(meta_path, encoding='utf-8') as f: meta = yaml.safe_load(f)
+    dynamic = source.input(0).get_partial_shape().is_dynamic
+    for variant in VARIANTS:
+        if not os.path.exists(variant_xml(variant)): continue
+        meta.setdefault('args', {}).update({"dynamic": dynamic, "half": variant == "fp16", "int8": variant == "int8"})
+        with open(os.path.join(MODELS_DIR, variant, "metadata.yaml"), 'w', encoding='utf-8') as f: yaml.safe_dump(meta, f, sort_keys=False)
+
+
+def bench_speed(xml_path, seconds=10.0):
+    """latency: 1 request แบบ LATENCY hint / throughput: AsyncInferQueue แบบ THROUGHPUT hint"""
+    import openvino as ov
+    core = ov.Core()
+    dummy = np.random.rand(1, 3, IMGSZ, IMGSZ).astype(np.float32)
+    # variant แบบ dynamic shape: วัดที่ IMGSZ แบบ static ให้เทียบกับ IR เดิมได้
+    model = core.read_model(xml_path)
+    if model.input(0).get_partial_shape().is_dynamic: model.reshape([1, 3, IMGSZ, IMGSZ])
+
+    compiled = core.compile_model(model, "CPU", {"PERFORMANCE_HINT": "LATENCY"})
+    req = compiled.create_infer_request()
+    for _ in range(5): req.infer({0: dummy})
+    times = []
+    end = time.monotonic() + seconds / 2
+    while time.monotonic() < end:
+        t0 = time.perf_counter()
+        req.infer({0: dummy})
+        times.append((time.perf_counter() - t0) * 1000)
+
+    compiled = core.compile_model(model, "CPU", {"PERFORMANCE_HINT": "THROUGHPUT"})
+    queue = ov.AsyncInferQueue(compiled)
+    done = 0
+    t0 = time.perf_counter()
+    end = time.monotonic() + seconds / 2
+    while time.monotonic() < end:
+        queue.start_async({0: dummy})
+        done += 1
+    queue.wait_all()
+    fps = done / (time.perf_counter() - t0)
+    return {"latency_ms_p50": float(np.percentile(times, 50)), "latency_ms_p90": float(np.percentile(times, 90)),
+            "throughput_fps": fps, "requests": len(queue)}
+
+
+def eval_frames(step=10, limit=300):
+    """ภาพสำหรับวัด recall: ทุก ๆ step เฟรมจากคลิปใน data/clips (ถ้าไม่มีคลิปใช้ภาพ Calibration)"""
+    frames = []
+    for path in sorted(glob.glob(os.path.join(CLIPS_DIR, "*"))):
+        cap = cv2.VideoCapture(path)
+        i = 0
+        while len(frames) < limit:
+            ok, frame = cap.read()
+            if not ok: break
+            if i % step == 0: frames.append(frame)
+            i += 1
+        cap.release()
+    if not frames:
+        frames = [cv2.imread(p) for p in sorted(glob.glob(os.path.join(CALIB_DIR, "*.jpg")))[:limit]]
+    return [f for f in frames if f is not None]
+
+
+def person_recall(reference, candidate, iou_thresh=0.5):
+    """สัดส่วนคนที่ FP32 เจอ แล้ว variant นี้เจอด้วย (จับคู่ IoU >= iou_thresh)"""
+    total = matched = 0
+    for ref, cand in zip(reference, candidate):
+        total += len(ref)
+        if len(ref) and len(cand):
+            iou = iou_matrix(ref[:, :4], cand[:, :4])
+            matched += int((iou.max(axis=1) >= iou_thresh).sum())
+    return matched / total if total else 1.0
+
+
+def benchmark(seconds=10.0, conf=0.3, max_drop=None):
+    max_drop = system_settings.get('model_max_recall_drop', 0.02) if max_drop is None else max_drop
+    frames = eval_frames()
+    results, reference, reference_variant = {}, None, None
+    # ค่าอ้างอิง recall = variant แรกที่มี (fp32 ถ้าสร้างได้ ไม่งั้น fp16)
+    for variant in VARIANTS:
+        xml = variant_xml(variant)
+        if not os.path.exists(xml): continue
+        print(f"⏱️ Benchmarking {variant}...")
+        res = bench_speed(xml, seconds)
+        if frames:
+            dets = OpenVINODetector(xml).detect(frames, conf)
+            if reference is None: reference, reference_variant = dets, variant
+            res["person_recall"] = person_recall(reference, dets)
+            res["detections"] = int(sum(len(d) for d in dets))
+        results[variant] = res
+        print(f"   {variant}: {json.dumps(res)}")
+    if not results:
+        print("❌ No model variants found. Run 'build' first.")
+        return None
+
+    # เลือกตัวที่ throughput สูงสุด โดย recall ลดลงจากค่าอ้างอิงไม่เกิน max_drop
+    ok = {v: r for v, r in results.items() if 1.0 - r.get("person_recall", 1.0) <= max_drop}
+    chosen = max(ok, key=lambda v: ok[v]["throughput_fps"]) if ok else next(iter(results))
+    if reference_variant not in (None, "fp32"): print(f"⚠️ person_recall is relative to {reference_variant}, not FP32")
+    selection = {"variant": chosen, "path": os.path.dirname(variant_xml(chosen)), "benchmarked_at": int(time.time()),
+                 "eval_frames": len(frames), "max_recall_drop": max_drop, "recall_reference": reference_variant,
+                 "results": results}
+    with open(MODEL_SELECTION_FILE, 'w', encoding='utf-8') as f: json.dump(selection, f, indent=4)
+    print(f"✅ Selected {chosen} -> {MODEL_SELECTION_FILE}")
+    return selection
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prepare and benchmark detector variants")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("collect"); p.add_argument("--frames", type=int, default=100); p.add_argument("--interval", type=float, default=2.0)
+    p = sub.add_parser("build"); p.add_argument("--subset", type=int, default=300)
+    p = sub.add_parser("benchmark"); p.add_argument("--seconds", type=float, default=10.0); p.add_argument("--max-drop", type=float, default=None)
+    p = sub.add_parser("all"); p.add_argument("--subset", type=int, default=300); p.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.cmd == "collect": collect_calibration(args.frames, args.interval)
+    elif args.cmd == "build": build_variants(args.subset)
+    elif args.cmd == "benchmark": benchmark(args.seconds, max_drop=args.max_drop)
+    else:
+        build_variants(args.subset)
+        benchmark(args.seconds)
@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+
+# ==========================================
+# 3.2 MOTION GATE (ข้าม YOLO เมื่อฉากว่าง)
+# ==========================================
+class MotionGate:
+    """ตรวจการเคลื่อนไหวแบบเบา ๆ บนภาพขาวดำย่อขนาด เฉพาะบริเวณรอบเส้นนับ/กรอบแคชเชียร์
+
+    check() คืนค่า True ถ้ามีการเคลื่อนไหว หรือยังอยู่ในช่วง hold-off หลังการเคลื่อนไหวล่าสุด
+    stats: frames = จำนวนเฟรมที่ตรวจ, gated = จำนวนครั้งที่ข้าม Detector (ผู้เรียกเป็นคนนับ)
+    """
+    def __init__(self, width=160, threshold=25, min_ratio=0.002, learn_rate=0.05):
+        self.width = width
+        self.threshold = threshold
+        self.min_ratio = min_ratio
+        self.learn_rate = learn_rate
+        self.stats = {"frames": 0, "gated": 0}
+        self.reset()
+
+    def reset(self):
+        self.bg = None
+        self.rect = None
+        self.last_motion = None
+
+    def check(self, frame, rect, ts, hold_off=2.0):
+        self.stats["frames"] += 1
+        x1, y1, x2, y2 = rect
+        roi = frame[y1:y2, x1:x2]
+        if roi.size == 0: return True
+        sw = min(self.width, roi.shape[1])
+        sh = max(1, int(roi.shape[0] * sw / roi.shape[1]))
+        gray = cv2.cvtColor(cv2.resize(roi, (sw, sh), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+        # ตำแหน่งเส้น/กรอบเปลี่ยน -> เริ่มเก็บพื้นหลังใหม่
+        if self.bg is None or rect != self.rect or self.bg.shape != gray.shape:
+            self.bg = gray.astype(np.float32)
+            self.rect = rect
+            self.last_motion = ts
+            return True
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.bg))
+        cv2.accumulateWeighted(gray, self.bg, self.learn_rate)
+        moving = cv2.countNonZero(cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)[1])
+        if moving >= self.min_ratio * diff.size: self.last_motion = ts
+
+        return ts - self.last_motion <= hold_off
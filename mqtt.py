@@ -2,35 +2,50 @@ import paho.mqtt.client as mqtt
 import threading
 import json
 import time
+import sqlite3
+import logging
 from config import system_settings, network_status
 from database import db
+from metrics import MQTT_PUBLISH_SECONDS, MQTT_MESSAGES
+
+logger = logging.getLogger(__name__)
 
 # ==========================================
 # 4. MQTT SYSTEM
 # ==========================================
 mqtt_client = mqtt.Client()
 
+def event_topic(payload):
+    """shop/{branch}/{cam}/people_count หรือ shop/{branch}/{cam}/{zone}/people_count สำหรับเส้น/โซนที่ตั้งชื่อไว้"""
+    zone = payload.get('zone_id')
+    cam_id = payload.get('cam_id', 'unknown')
+    return f"shop/{system_settings['branch_name']}/{cam_id}/{zone}/people_count" if zone else f"shop/{system_settings['branch_name']}/{cam_id}/people_count"
+
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         network_status['mqtt'] = True
-        threading.Thread(target=sync_offline_data).start()
+        threading.Thread(target=sync_offline_data, name="mqtt-sync").start()
 
 def on_disconnect(client, userdata, rc): network_status['mqtt'] = False
 
 def sync_offline_data():
     while network_status['mqtt']:
-        rows = db.get_batch(5)
+        try: rows = db.get_batch(5)
+        except sqlite3.Error as e:
+            # เช่น read pool เต็ม: ลองใหม่แทนที่จะปล่อยให้ Thread sync ตาย
+            logger.warning(f"MQTT sync read failed: {e}")
+            time.sleep(1)
+            continue
         if not rows: break
         for row_id, payload_str in rows:
             try:
-                payload = json.loads(payload_str)
-                branch = system_settings['branch_name']
-                cam_id = payload.get('cam_id', 'unknown')
-                topic = f"shop/{branch}/{cam_id}/people_count"
-                mqtt_client.publish(topic, payload_str)
+                with MQTT_PUBLISH_SECONDS.time(): mqtt_client.publish(event_topic(json.loads(payload_str)), payload_str)
+                MQTT_MESSAGES.inc(source="sync", result="sent")
                 db.delete(row_id)
                 time.sleep(0.05)
-            except: return
+            except:
+                MQTT_MESSAGES.inc(source="sync", result="error")
+                return
 
 mqtt_client.on_connect = on_connect
 mqtt_client.on_disconnect = on_disconnect
@@ -46,4 +61,12 @@ def start_mqtt_thread():
             else: time.sleep(10)
         except: time.sleep(5)
 
-threading.Thread(target=start_mqtt_thread, daemon=True).start()
+_started = False
+
+def start():
+    """เชื่อมต่อ MQTT (และ sync ข้อมูลค้างส่งเมื่อเชื่อมต่อได้) เรียกจาก main.py เท่านั้น
+    Worker Process ส่ง Event กลับมาทาง Queue ส่วน replay.py / เครื่องมือ CLI ไม่เชื่อมต่อเลย"""
+    global _started
+    if _started: return
+    _started = True
+    threading.Thread(target=start_mqtt_thread, name="mqtt-connect", daemon=True).start()
@@ -0,0 +1,93 @@
+import os
+import sys
+import threading
+import time
+import logging
+from collections import Counter
+
+from config import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 2.2 SAMPLING PROFILER (ดู CPU ของทุก Thread จากหน้าเว็บ)
+# ==========================================
+# สุ่มอ่าน Stack ของทุก Thread ด้วย sys._current_frames() ทุก interval แล้วเขียนเป็น collapsed stack
+# (บรรทัดละ "thread;func (file:line);... count") เปิดด้วย flamegraph.pl / speedscope ได้
+PROFILES_DIR = f"{DATA_DIR}/profiles"
+os.makedirs(PROFILES_DIR, exist_ok=True)
+
+_lock = threading.Lock()
+_running = None  # ชื่อไฟล์ที่กำลังเก็บอยู่
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample(seconds, interval):
+    """เก็บตัวอย่าง Stack ของทุก Thread (ยกเว้นตัวเอง) คืนค่า Counter ของ collapsed stack"""
+    me = threading.get_ident()
+    stacks = Counter()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me: continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(ident, f"thread-{ident}").replace(';', '_'))
+            stacks[";".join(reversed(labels))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def _run(path, seconds, interval):
+    global _running
+    try:
+        stacks = sample(seconds, interval)
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common(): f.write(f"{stack} {count}\n")
+        os.replace(tmp, path)
+        logger.info(f"Profile saved: {path} ({sum(stacks.values())} samples)")
+    except Exception as e:
+        logger.exception(f"Profiler error: {e}")
+    finally:
+        with _lock: _running = None
+
+
+def start(seconds=30, interval_ms=10):
+    """เริ่มเก็บ Profile ใน Thread เบื้องหลัง คืนค่าชื่อไฟล์ หรือ None ถ้ามีการเก็บอยู่แล้ว"""
+    global _running
+    seconds = min(max(float(seconds), 1.0), 300.0)
+    interval = min(max(float(interval_ms), 1.0), 1000.0) / 1000.0
+    with _lock:
+        if _running: return None
+        _running = f"profile_{time.strftime('%Y%m%d_%H%M%S')}_{int(seconds)}s.folded"
+        name = _running
+    threading.Thread(target=_run, args=(os.path.join(PROFILES_DIR, name), seconds, interval), name="profiler", daemon=True).start()
+    return name
+
+
+def status():
+    return _running
+
+
+def list_profiles():
+    items = []
+    for name in sorted(os.listdir(PROFILES_DIR), reverse=True):
+        if not name.endswith(".folded"): continue
+        st = os.stat(os.path.join(PROFILES_DIR, name))
+        items.append({"name": name, "size": st.st_size, "created": int(st.st_mtime)})
+    return items
+
+
+def profile_path(name):
+    """path ของไฟล์ Profile (กันการอ่านไฟล์นอก PROFILES_DIR) / None ถ้าไม่มี"""
+    if os.path.basename(name) != name or not name.endswith(".folded"): return None
+    path = os.path.join(PROFILES_DIR, name)
+    return path if os.path.exists(path) else None
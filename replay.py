@@ -0,0 +1,130 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import time
+import numpy as np
+
+from config import DATA_DIR, system_settings
+
+# ==========================================
+# 8. REPLAY / BENCHMARK (คลิปวิดีโอแทนกล้องจริง)
+# ==========================================
+# python replay.py run data/clips/door.mp4                  -> เล่นคลิปผ่าน SmartCamera แล้วแสดงยอดนับ
+# python replay.py benchmark data/clips --out result.json   -> ทุกคลิป: FPS, latency แต่ละขั้นตอน, ความคลาดเคลื่อนของยอดนับ
+#
+# ไฟล์ประกอบคลิป (sidecar) ชื่อเดียวกับคลิปแต่นามสกุล .json:
+#   {"config": {...ค่าเหมือน cameras.json...}, "expected": {"in": 12, "out": 10, "checkout": 0}}
+# Event ส่งเข้า event_sink ของ replay เท่านั้น: ไม่เปิด DB / ไม่เชื่อมต่อ MQTT (database.init() / mqtt.start() เรียกจาก main.py)
+CLIPS_DIR = f"{DATA_DIR}/clips"
+VIDEO_EXTS = (".mp4", ".avi", ".mkv", ".mov", ".ts")
+COUNT_KEYS = ("in", "out", "staff_in", "staff_out", "checkout")
+
+
+def load_sidecar(clip):
+    path = os.path.splitext(clip)[0] + ".json"
+    if not os.path.exists(path): return {}
+    with open(path, 'r', encoding='utf-8') as f: return json.load(f)
+
+
+def find_clips(paths):
+    clips = []
+    for p in paths:
+        if os.path.isdir(p): clips += sorted(f for f in glob.glob(os.path.join(p, "*")) if f.lower().endswith(VIDEO_EXTS))
+        else: clips.append(p)
+    return clips
+
+
+def percentiles(values):
+    if not values: return {}
+    a = np.asarray(values) * 1000
+    return {"count": len(a), "mean_ms": round(float(a.mean()), 3), "p50_ms": round(float(np.percentile(a, 50)), 3),
+            "p90_ms": round(float(np.percentile(a, 90)), 3), "p99_ms": round(float(np.percentile(a, 99)), 3)}
+
+
+def replay_clip(clip, mode="fast", verbose=False):
+    """เล่นคลิปผ่าน SmartCamera (capture -> inference -> tracking -> counting เส้นทางเดียวกับกล้องจริง)"""
+    from camera import SmartCamera
+
+    sidecar = load_sidecar(clip)
+    config = {"name": os.path.basename(clip), **sidecar.get('config', {})}
+    cam_id = "replay_" + os.path.splitext(os.path.basename(clip))[0]
+    events, stages = [], {}
+
+    cam = SmartCamera(cam_id, clip, config)
+    cam.replay = mode
+    cam.event_sink = events.append
+    cam.stage_sink = lambda name, dt: stages.setdefault(name, []).append(dt)
+    if verbose: cam.event_sink = lambda payload: (events.append(payload), print(f"   {json.dumps(payload)}"))
+
+    t0 = time.perf_counter()
+    cam.start()
+    cam.join()
+    elapsed = time.perf_counter() - t0
+
+    frames = len(stages.get("frame", []))
+    counts = {k: cam.stats[k] for k in COUNT_KEYS}
+    result = {"clip": clip, "mode": mode, "frames": frames, "seconds": round(elapsed, 3),
+              "fps": round(frames / elapsed, 2) if elapsed else 0.0,
+              "stages": {name: percentiles(v) for name, v in stages.items()},
+              "counts": counts, "zones": cam.stats.get("zones", {}), "events": len(events),
+              "gated_frames": cam.motion_gate.stats['gated']}
+    expected = sidecar.get('expected')
+    if expected:
+        result["expected"] = expected
+        result["error"] = {k: counts.get(k, 0) - v for k, v in expected.items() if k in counts}
+        result["abs_error"] = sum(abs(e) for e in result["error"].values())
+    return result
+
+
+def git_commit():
+    try: return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception: return None
+
+
+def benchmark(clips, mode="fast"):
+    results = []
+    for clip in clips:
+        print(f"🎬 Replaying {clip} ({mode})...")
+        res = replay_clip(clip, mode)
+        print(f"   {res['frames']} frames, {res['fps']} fps, counts={res['counts']}" + (f", error={res['error']}" if 'error' in res else ""))
+        results.append(res)
+    frames = sum(r['frames'] for r in results)
+    seconds = sum(r['seconds'] for r in results)
+    return {"commit": git_commit(), "host": platform.node(), "machine": platform.machine(), "processor": platform.processor(),
+            "created_at": int(time.time()), "mode": mode,
+            "settings": {k: system_settings.get(k) for k in ("inference_backend", "infer_max_batch", "capture_fps", "motion_gate")},
+            "total": {"clips": len(results), "frames": frames, "seconds": round(seconds, 3), "fps": round(frames / seconds, 2) if seconds else 0.0,
+                      "abs_error": sum(r.get('abs_error', 0) for r in results)},
+            "clips": results}
+
+
+def prepare():
+    """นับตลอดเวลา (ไม่สนเวลาเปิดร้าน) และรอโมเดลโหลดเสร็จก่อนเริ่มเล่นคลิป"""
+    from camera import scheduler, start_model_warmup, model_status
+    system_settings['open_hour'], system_settings['close_hour'] = 0, 24
+    start_model_warmup()
+    while not scheduler.ready.wait(0.5):
+        if model_status['state'] == "error": raise SystemExit(f"❌ Model load failed: {model_status['error']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay recorded clips through the counting pipeline")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("run"); p.add_argument("clip"); p.add_argument("--realtime", action="store_true")
+    p = sub.add_parser("benchmark"); p.add_argument("paths", nargs="*", default=[CLIPS_DIR]); p.add_argument("--realtime", action="store_true"); p.add_argument("--out")
+    args = parser.parse_args()
+
+    prepare()
+    mode = "realtime" if args.realtime else "fast"
+    if args.cmd == "run":
+        print(json.dumps(replay_clip(args.clip, mode, verbose=True), indent=4))
+    else:
+        report = benchmark(find_clips(args.paths), mode)
+        text = json.dumps(report, indent=4)
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as f: f.write(text)
+            print(f"✅ Saved {args.out}")
+        else: print(text)
@@ -0,0 +1,122 @@
+import threading
+import time
+import logging
+import cv2
+
+from config import system_settings
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 6.1 MJPEG STREAMER (Encode ครั้งเดียวต่อกล้อง แจกทุกคนดู)
+# ==========================================
+class _Variant:
+    """JPEG ล่าสุดของขนาด/คุณภาพหนึ่ง ๆ (id เพิ่มทุกครั้งที่ encode ใหม่)"""
+    def __init__(self, width, quality):
+        self.width, self.quality = width, quality
+        self.subscribers = 0
+        self.id, self.jpeg, self.ts = 0, None, 0.0
+        self.version = None  # เวอร์ชันภาพของกล้องที่ encode ไปแล้ว
+
+
+class CameraStreamer:
+    """Thread เดียวต่อกล้อง: ทุก 1/fps วินาที ถ้ากล้องมีภาพใหม่ค่อย encode แล้วแจกไบต์เดิมให้ทุกคนที่ขอขนาด/คุณภาพเดียวกัน
+
+    ทำงานเฉพาะตอนที่มีคนดู และแจ้งกล้อง (add_viewer/remove_viewer) ให้วาด Overlay เฉพาะช่วงนั้น
+    """
+    def __init__(self, cam):
+        self.cam = cam
+        self.variants = {}
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def subscribe(self, width=None, quality=None):
+        # width = 0 คือขนาดภาพแสดงผลเดิม (กว้าง 640)
+        key = (min(max(int(width), 160), 1920) if width else 0, min(max(int(quality or system_settings.get('stream_quality', 70)), 10), 95))
+        with self.cond:
+            # เก็บ JPEG ของขนาด/คุณภาพที่ไม่มีคนดูไว้ให้ snapshot ใช้ต่อ แต่ไม่เกิน 8 แบบ
+            if key not in self.variants and len(self.variants) >= 8:
+                for k in [k for k, v in self.variants.items() if not v.subscribers]: del self.variants[k]
+            variant = self.variants.setdefault(key, _Variant(*key))
+            variant.subscribers += 1
+            if sum(v.subscribers for v in self.variants.values()) == 1: self.cam.add_viewer()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.loop, name=f"mjpeg-{self.cam.cam_id}", daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+        return variant
+
+    def unsubscribe(self, variant):
+        with self.cond:
+            variant.subscribers -= 1
+            if not any(v.subscribers for v in self.variants.values()): self.cam.remove_viewer()
+
+    def wait(self, variant, last_id, timeout=5.0):
+        """รอ JPEG ที่ใหม่กว่า last_id คืนค่า (id, jpeg) หรือ (last_id, None) ถ้าหมดเวลา"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: variant.id > last_id, timeout): return last_id, None
+            return variant.id, variant.jpeg
+
+    def encode(self, frame, variant):
+        if variant.width and variant.width < frame.shape[1]:
+            frame = cv2.resize(frame, (variant.width, int(frame.shape[0] * variant.width / frame.shape[1])), interpolation=cv2.INTER_AREA)
+        flag, enc = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, variant.quality])
+        return enc.tobytes() if flag else None
+
+    def loop(self):
+        while True:
+            interval = 1.0 / max(1, float(system_settings.get('stream_fps', 10)))
+            started = time.monotonic()
+            with self.cond:
+                variants = [v for v in self.variants.values() if v.subscribers > 0]
+                if not variants:
+                    self.thread = None
+                    return
+            try:
+                version = self.cam.frame_version()
+                pending = [v for v in variants if v.version != version]
+                frame = self.cam.get_frame() if pending and version is not None else None
+                if frame is not None:
+                    for v in pending:
+                        jpeg = self.encode(frame, v)
+                        if jpeg is None: continue
+                        with self.cond:
+                            v.jpeg, v.ts, v.version = jpeg, time.time(), version
+                            v.id += 1
+                            self.cond.notify_all()
+            except Exception as e:
+                logger.error(f"[{self.cam.cam_id}] MJPEG encode error: {e}")
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    def mjpeg(self, width=None, quality=None):
+        """Generator สำหรับ multipart/x-mixed-replace (ยกเลิกการติดตามเมื่อ Client ตัดการเชื่อมต่อหรือกล้องถูกหยุด)"""
+        variant = self.subscribe(width, quality)
+        try:
+            last_id = 0
+            while self.cam.running:
+                last_id, jpeg = self.wait(variant, last_id)
+                if jpeg is not None: yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+        finally:
+            self.unsubscribe(variant)
+
+    def snapshot(self, width=None, quality=None, max_age=1.0, timeout=3.0):
+        """JPEG เฟรมเดียว: ใช้ของที่ encode ไว้ถ้ายังใหม่ ไม่งั้นเปิดการดูชั่วคราวจนได้ภาพใหม่"""
+        variant = self.subscribe(width, quality)
+        try:
+            with self.cond:
+                if variant.jpeg is not None and time.time() - variant.ts <= max_age: return variant.jpeg
+            return self.wait(variant, variant.id, timeout)[1] or variant.jpeg
+        finally:
+            self.unsubscribe(variant)
+
+
+_streamers = {}
+_lock = threading.Lock()
+
+def streamer_for(cam):
+    """CameraStreamer ของกล้องนี้ (สร้างใหม่ถ้ากล้องถูกเริ่มใหม่เป็น object ใหม่)"""
+    with _lock:
+        streamer = _streamers.get(cam.cam_id)
+        if streamer is None or streamer.cam is not cam:
+            streamer = _streamers[cam.cam_id] = CameraStreamer(cam)
+        return streamer
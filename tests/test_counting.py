@@ -0,0 +1,124 @@
+import numpy as np
+
+from counting import CountingEngine
+
+# เฟรม 1280x720: เส้น y=0.5 -> y=360 px, แถบ offset 0.05 -> ±36 px (UP < 324, DOWN > 396)
+W, H = 1280, 720
+ABOVE, BAND, BELOW = 250, 360, 450
+ZONE = {"id": "cashier", "points": [[0.1, 0.1], [0.4, 0.1], [0.4, 0.4], [0.1, 0.4]], "dwell": 3}
+INSIDE, OUTSIDE = (300, 150), (900, 150)
+
+
+def engine(config):
+    e = CountingEngine(config)
+    e.geometry(W, H)
+    return e
+
+
+def walk(e, track_id, ys, x=640, t0=0.0):
+    """เดิน Track เดียวตามค่า y ทีละเฟรม คืนค่า (kind, zone) ของทุก Event"""
+    events = []
+    for i, y in enumerate(ys):
+        events += [(ev.kind, ev.zone) for ev in e.update([track_id], [(x, y)], t0 + i / 15)]
+    return events
+
+
+def test_line_counts_both_directions():
+    e = engine({"lines": [{"id": "door", "y": 0.5}]})
+    assert walk(e, 1, [ABOVE, BAND, BELOW]) == [("in", "door")]
+    assert walk(e, 2, [BELOW, BAND, ABOVE]) == [("out", "door")]
+
+
+def test_invert_swaps_direction():
+    e = engine({"lines": [{"id": "door", "y": 0.5, "invert": True}]})
+    assert walk(e, 1, [ABOVE, BELOW]) == [("out", "door")]
+    assert walk(e, 2, [BELOW, ABOVE]) == [("in", "door")]
+
+
+def test_jitter_inside_band_is_not_counted():
+    e = engine({"lines": [{"id": "door", "y": 0.5}]})
+    jitter = [ABOVE] + [BAND + d for d in (-30, 30, -20, 35, -35, 10)] + [ABOVE]
+    assert walk(e, 1, jitter) == []
+    # ข้ามจริงหลังจาก jitter ยังนับครั้งเดียว
+    assert walk(e, 1, [BAND - 30, BAND + 30, BELOW, BAND + 30, BELOW]) == [("in", "door")]
+
+
+def test_crossing_outside_line_span_is_ignored():
+    e = engine({"lines": [{"id": "door", "y": 0.5, "x": 0.5, "length": 0.5}]})
+    assert walk(e, 1, [ABOVE, BELOW], x=50) == []
+    assert walk(e, 2, [ABOVE, BELOW], x=640) == [("in", "door")]
+
+
+def test_multiple_lines_report_their_ids():
+    e = engine({"lines": [{"id": "a", "y": 0.3}, {"id": "b", "y": 0.7}]})
+    assert walk(e, 1, [100, 360, 600]) == [("in", "a"), ("in", "b")]
+    assert walk(e, 2, [600, 360, 100]) == [("out", "b"), ("out", "a")]
+
+
+def test_reused_id_after_forget_starts_fresh():
+    e = engine({"lines": [{"id": "door", "y": 0.5}]})
+    assert walk(e, 7, [ABOVE, BELOW]) == [("in", "door")]
+    # Tracker ทิ้ง ID 7 แล้วนำกลับมาใช้กับคนใหม่ที่อยู่อีกฝั่งของเส้น
+    e.forget(np.array([], dtype=np.int64))
+    assert walk(e, 7, [ABOVE]) == []
+    assert walk(e, 7, [BELOW]) == [("in", "door")]
+
+
+def test_id_kept_by_tracker_is_not_forgotten():
+    e = engine({"lines": [{"id": "door", "y": 0.5}]})
+    walk(e, 7, [ABOVE, BELOW])
+    e.forget(np.array([7]))
+    assert walk(e, 7, [ABOVE]) == [("out", "door")]
+
+
+def checkout_walk(e, track_id, points, dt=0.5, t0=0.0, mask=None):
+    events = []
+    for i, p in enumerate(points):
+        events += [(ev.kind, ev.zone) for ev in e.update([track_id], [p], t0 + i * dt, mask)]
+    return events
+
+
+def test_checkout_after_dwell_once():
+    e = engine({"zones": [ZONE]})
+    # อยู่ในโซน 0.0 ... 3.5 วินาที -> checkout ครั้งเดียวที่ 3.0
+    assert checkout_walk(e, 1, [INSIDE] * 8) == [("checkout", "cashier")]
+    # ออกแล้วกลับเข้ามาใหม่ด้วย ID เดิมไม่นับซ้ำ
+    assert checkout_walk(e, 1, [OUTSIDE] + [INSIDE] * 8, t0=10) == []
+
+
+def test_leaving_zone_resets_dwell():
+    e = engine({"zones": [ZONE]})
+    assert checkout_walk(e, 1, [INSIDE] * 5 + [OUTSIDE] + [INSIDE] * 5) == []
+
+
+def test_track_missing_from_frame_resets_dwell():
+    e = engine({"zones": [ZONE]})
+    assert checkout_walk(e, 1, [INSIDE] * 5) == []
+    e.update([2], [OUTSIDE], 2.5)
+    assert checkout_walk(e, 1, [INSIDE] * 5, t0=3.0) == []
+
+
+def test_dwell_mask_excludes_track():
+    e = engine({"zones": [ZONE]})
+    assert checkout_walk(e, 1, [INSIDE] * 10, mask=[False]) == []
+
+
+def test_checkout_again_after_forget():
+    e = engine({"zones": [ZONE]})
+    assert checkout_walk(e, 1, [INSIDE] * 8) == [("checkout", "cashier")]
+    e.forget(np.array([], dtype=np.int64))
+    assert checkout_walk(e, 1, [INSIDE] * 8, t0=20) == [("checkout", "cashier")]
+
+
+def test_many_tracks_in_one_frame():
+    e = engine({"lines": [{"id": "door", "y": 0.5}]})
+    ids = np.arange(6)
+    x = np.linspace(100, 1100, 6)
+    e.update(ids, np.column_stack((x, [ABOVE, ABOVE, ABOVE, BELOW, BELOW, BELOW])), 0.0)
+    events = e.update(ids, np.column_stack((x, [BELOW, BAND, ABOVE, ABOVE, BAND, BELOW])), 0.1)
+    assert sorted((ev.track_id, ev.kind, ev.index) for ev in events) == [(0, "in", 0), (3, "out", 3)]
+
+
+def test_legacy_single_line_config():
+    e = engine({"line_ratio": 0.5, "offset_ratio": 0.05})
+    assert walk(e, 1, [ABOVE, BELOW]) == [("in", "")]
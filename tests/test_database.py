@@ -0,0 +1,222 @@
+import csv
+import gzip
+import io
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import metrics
+from config import system_settings
+from database import LocalBuffer, StatsCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def db(tmp_path):
+    buf = LocalBuffer(str(tmp_path / "test.db"))
+    yield buf
+    buf.flush()
+    buf.pool.close()
+
+
+def event(**kw):
+    return {"cam_id": "cam1", "ts": time.time(), "in": 1, "is_staff": 0, **kw}
+
+
+def rows(db, table):
+    with db.lock: return db.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def write_errors():
+    return metrics.DB_WRITE_ERRORS.values.get((), 0)
+
+
+class FlakyConn:
+    """ห่อ sqlite3.Connection ให้ executemany ล้มเหลว fail ครั้งแรก"""
+    def __init__(self, conn, fail):
+        self.conn, self.fail = conn, fail
+
+    def executemany(self, *args):
+        if self.fail:
+            self.fail -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return self.conn.executemany(*args)
+
+    def __getattr__(self, name): return getattr(self.conn, name)
+
+
+def test_events_are_group_committed(db):
+    batches = []
+    write_batch = db.write_batch
+    db.write_batch = lambda events, **kw: batches.append(len(events)) or write_batch(events, **kw)
+    for _ in range(20): db.save(event())
+    assert db.flush()
+    assert sum(batches) == 20 and len(batches) < 20
+    assert rows(db, "history_log") == 20 and rows(db, "pending_data") == 20
+    with db.lock: assert db.conn.execute("SELECT SUM(in_count) FROM daily_stats").fetchone()[0] == 20
+
+
+def test_staff_and_history_only_skip_pending(db):
+    db.save(event(is_staff=1))
+    db.save_history_only(event())
+    assert db.flush()
+    assert rows(db, "history_log") == 2 and rows(db, "pending_data") == 0
+    with db.lock: assert db.conn.execute("SELECT SUM(in_count) FROM daily_stats").fetchone()[0] == 1
+
+
+def test_flush_without_writer_returns_immediately(db):
+    assert db.writer is None
+    assert db.flush(timeout=0.01)
+
+
+def test_write_is_retried_after_sqlite_error(db):
+    before = write_errors()
+    db.conn = FlakyConn(db.conn, fail=1)
+    assert db.write_batch([(event(), True)])
+    assert write_errors() == before + 1
+    assert rows(db, "history_log") == 1
+
+
+def test_batch_dropped_after_retries(db):
+    db.save(event())
+    assert db.flush()
+    assert db.cache.pending == 1
+    db.conn = FlakyConn(db.conn, fail=2)
+    assert not db.write_batch([(event(), True)], retries=2)
+    assert rows(db, "history_log") == 1
+
+
+def test_bad_event_only_drops_itself(db):
+    before = write_errors()
+    system_settings['db_flush_interval'], interval = 2.0, system_settings['db_flush_interval']
+    try:
+        db.save(event())
+        db.save(event(bad=object()))  # json.dumps ไม่ได้
+        db.save(event())
+        assert db.flush()
+    finally:
+        system_settings['db_flush_interval'] = interval
+    assert rows(db, "history_log") == 2 and rows(db, "pending_data") == 2
+    assert write_errors() == before + 1
+    assert db.writer.is_alive()
+    # writer ยังทำงานต่อได้หลังจากทิ้ง Event เสีย
+    db.save(event())
+    assert db.flush() and rows(db, "history_log") == 3
+
+
+def test_queued_events_are_flushed_on_exit(tmp_path):
+    script = ("import time, database\n"
+              "database.init()\n"
+              "for _ in range(5): database.db.save({'cam_id': 'cam1', 'ts': time.time(), 'in': 1, 'is_staff': 0})\n")
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=env, check=True, timeout=30)
+    conn = sqlite3.connect(tmp_path / "data" / "offline_data.db")
+    try: assert conn.execute("SELECT COUNT(*) FROM history_log").fetchone()[0] == 5
+    finally: conn.close()
+
+
+def test_stats_cache_add_and_discard():
+    cache = StatsCache()
+    cache.seed(SimpleNamespace(get_hourly_stats=dict, get_daily_stats=dict, get_monthly_stats=dict, count_pending=lambda: 0))
+    now = time.time()
+    hour, day, month = time.localtime(now).tm_hour, time.localtime(now).tm_mday, time.localtime(now).tm_mon
+    customer, staff = event(ts=now), event(ts=now, is_staff=1, out=1)
+    cache.add(customer, True)
+    cache.add(staff, False)
+    assert cache.pending == 1
+    assert cache.get('hourly')[hour]['in'] == 1 and cache.get('daily')[day]['in'] == 1 and cache.get('monthly')[month]['in'] == 1
+    assert cache.get('hourly')[hour]['out'] == 0  # พนักงานไม่นับในกราฟ
+    cache.discard(customer, True)
+    assert cache.pending == 0 and cache.get('hourly')[hour]['in'] == 0 and cache.get('monthly')[month]['in'] == 0
+    # Event จากช่วงเวลาเก่า (เมื่อปีที่แล้ว) ไม่กระทบกราฟปัจจุบัน
+    cache.add(event(ts=now - 400 * 86400), False)
+    assert sum(v['in'] for v in cache.get('monthly').values()) == 0
+
+
+def test_dropped_batch_is_removed_from_stats_cache(db):
+    hour = time.localtime().tm_hour
+    db.save(event())
+    assert db.flush()
+    assert db.cache.get('hourly')[hour]['in'] == 1
+    db.conn = FlakyConn(db.conn, fail=10)
+    db.cache.add(event(), True)
+    assert not db.write_batch([(event(), True)], retries=1)
+    db.conn = db.conn.conn
+    assert db.cache.get('hourly')[hour]['in'] == 1 and db.cache.pending == 1
+    assert db.cache.get('hourly') == db.get_hourly_stats()
+
+
+def test_bad_event_is_removed_from_stats_cache(db):
+    hour = time.localtime().tm_hour
+    db.save(event())
+    db.save(event(bad=object()))
+    assert db.flush()
+    assert db.cache.get('hourly')[hour]['in'] == 1 and db.cache.pending == 1
+
+
+def local_ts(text):
+    return datetime.strptime(text, "%Y-%m-%d %H:%M").timestamp()
+
+
+@pytest.fixture
+def export_db(db):
+    db.write_batch([
+        (event(cam_id="cam1", ts=local_ts("2026-01-10 09:30")), False),
+        (event(cam_id="cam2", ts=local_ts("2026-01-10 09:45"), out=1, **{"in": 0}), False),
+        (event(cam_id="cam1", ts=local_ts("2026-01-10 15:00"), is_staff=1), False),
+        (event(cam_id="cam1", ts=local_ts("2026-01-11 10:00"), zone_id="door"), False),
+    ])
+    return db
+
+
+def export(db, **kw):
+    rows = list(csv.reader(io.StringIO(b"".join(db.export_csv(**kw)).decode('utf-8'))))
+    return rows[0], rows[1:]
+
+
+def test_export_raw_all_rows(export_db):
+    header, rows = export(export_db)
+    assert header[:2] == ['ID', 'Camera'] and len(rows) == 4
+    # เรียงจากใหม่ไปเก่า เวลาเป็น UTC ตามที่เก็บ
+    assert rows[0][-1] == "door"
+    assert rows[0][6] == time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(local_ts("2026-01-11 10:00")))
+
+
+def test_export_raw_filters(export_db):
+    day = dict(start=datetime(2026, 1, 10), end=datetime(2026, 1, 11))
+    assert len(export(export_db, **day)[1]) == 3
+    assert len(export(export_db, start=datetime(2026, 1, 10, 10))[1]) == 2
+    assert len(export(export_db, end=datetime(2026, 1, 10, 9, 45))[1]) == 1
+    assert [r[1] for r in export(export_db, cam_id="cam2")[1]] == ["cam2"]
+    assert len(export(export_db, include_staff=False, **day)[1]) == 2
+
+
+def test_export_hourly_and_daily(export_db):
+    header, rows = export(export_db, group="hourly", start=datetime(2026, 1, 10), end=datetime(2026, 1, 11))
+    assert header == ['Hour', 'Camera', 'Zone', 'IN', 'OUT', 'CHECKOUT']
+    # ยอดลูกค้าเท่านั้น (พนักงาน 15:00 ไม่มี)
+    assert rows == [["2026-01-10 09", "cam1", "", "1", "0", "0"], ["2026-01-10 09", "cam2", "", "0", "1", "0"]]
+    _, rows = export(export_db, group="daily", cam_id="cam1")
+    assert rows == [["2026-01-10", "cam1", "", "1", "0", "0"], ["2026-01-11", "cam1", "door", "1", "0", "0"]]
+    _, rows = export(export_db, group="daily", start=datetime(2026, 1, 11))
+    assert [r[0] for r in rows] == ["2026-01-11"]
+
+
+def test_export_gzip_matches_plain(export_db):
+    plain = b"".join(export_db.export_csv(group="raw", chunk=1))
+    packed = b"".join(export_db.export_csv(group="raw", chunk=1, compress=True))
+    assert packed[:2] == b"\x1f\x8b" and gzip.decompress(packed) == plain
+
+
+def test_export_does_not_use_read_pool(export_db):
+    gen = export_db.export_csv(chunk=1)
+    next(gen)
+    assert export_db.pool.in_use() == 0
+    gen.close()
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from inference import InferenceScheduler
+
+FRAME = np.zeros((4, 4, 3), dtype=np.uint8)
+
+
+class FakeDetector:
+    """คืนค่ากล่องเดียวต่อเฟรม (conf = 0.9) และจดขนาด batch ที่ได้รับ"""
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, frames, conf, imgsz):
+        self.batches.append(len(frames))
+        return [np.array([[0, 0, 1, 1, 0.9, 0]], dtype=float) for _ in frames]
+
+
+@pytest.fixture
+def scheduler():
+    s = InferenceScheduler(FakeDetector(), max_batch=4, max_wait=0.5)
+    yield s
+    s.stop()
+
+
+def timed_result(fut):
+    t0 = time.monotonic()
+    dets = fut.result(timeout=2)
+    return dets, time.monotonic() - t0
+
+
+def test_single_client_runs_immediately(scheduler):
+    scheduler.register("a")
+    dets, elapsed = timed_result(scheduler.submit("a", FRAME, 0.5))
+    assert len(dets) == 1 and elapsed < 0.25
+
+
+def test_waits_for_other_client_that_owes_a_frame(scheduler):
+    scheduler.register("a"); scheduler.register("b")
+    fut = scheduler.submit("a", FRAME, 0.5)
+    threading.Timer(0.1, lambda: scheduler.submit("b", FRAME, 0.5)).start()
+    _, elapsed = timed_result(fut)
+    # รอเฟรมของ b แล้วรันรวมเป็น batch เดียว (ไม่ต้องรอครบ max_wait)
+    assert 0.05 < elapsed < 0.4
+    assert scheduler.detect_fn.batches == [2]
+
+
+def test_skipping_client_does_not_delay_batch(scheduler):
+    scheduler.register("a"); scheduler.register("b")
+    scheduler.skip("b")
+    _, elapsed = timed_result(scheduler.submit("a", FRAME, 0.5))
+    assert elapsed < 0.25
+
+
+def test_skip_after_submit_releases_waiting_batch(scheduler):
+    scheduler.register("a"); scheduler.register("b")
+    fut = scheduler.submit("a", FRAME, 0.5)
+    threading.Timer(0.05, lambda: scheduler.skip("b")).start()
+    _, elapsed = timed_result(fut)
+    assert elapsed < 0.3
+
+
+def test_submit_clears_skip(scheduler):
+    scheduler.register("a"); scheduler.register("b")
+    scheduler.skip("b")
+    timed_result(scheduler.submit("b", FRAME, 0.5))
+    # b ส่งเฟรมแล้วจึงกลับมาเป็นกล้องที่ต้องรออีกครั้ง
+    fut = scheduler.submit("a", FRAME, 0.5)
+    threading.Timer(0.1, lambda: scheduler.submit("b", FRAME, 0.5)).start()
+    _, elapsed = timed_result(fut)
+    assert elapsed > 0.05 and scheduler.detect_fn.batches[-1] == 2
+
+
+def test_unregistered_skip_is_ignored(scheduler):
+    scheduler.skip("ghost")
+    assert not scheduler.idle
+
+
+def test_per_client_conf_filter(scheduler):
+    scheduler.register("a")
+    assert len(scheduler.submit("a", FRAME, 0.95).result(timeout=2)) == 0
+
+
+def test_detector_error_reaches_caller():
+    def boom(frames, conf, imgsz): raise RuntimeError("device lost")
+    s = InferenceScheduler(boom, max_wait=0.01)
+    try:
+        s.register("a")
+        with pytest.raises(RuntimeError, match="device lost"):
+            s.submit("a", FRAME).result(timeout=2)
+    finally:
+        s.stop()
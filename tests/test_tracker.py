@@ -0,0 +1,75 @@
+import numpy as np
+
+from tracker import Tracker, iou_matrix
+
+
+def box(cx, cy, w=60, h=160, conf=0.9):
+    return [cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2, conf, 0]
+
+
+def ids_by_x(tracks):
+    """track_id ของแต่ละกล่องเรียงตามตำแหน่ง x"""
+    order = np.argsort((tracks[:, 0] + tracks[:, 2]) / 2)
+    return tracks[order, 4].astype(int).tolist()
+
+
+def test_iou_matrix():
+    a = np.array([[0, 0, 10, 10], [20, 20, 30, 30]], dtype=float)
+    b = np.array([[0, 0, 10, 10], [5, 0, 15, 10]], dtype=float)
+    iou = iou_matrix(a, b)
+    assert iou.shape == (2, 2)
+    assert np.isclose(iou[0, 0], 1.0) and np.isclose(iou[0, 1], 50 / 150) and iou[1].max() == 0
+    assert iou_matrix(a, np.empty((0, 4))).shape == (2, 0)
+
+
+def test_track_confirmed_after_min_hits():
+    t = Tracker(min_hits=2)
+    assert len(t.update([box(100, 200)])) == 0
+    out = t.update([box(105, 200)])
+    assert len(out) == 1 and out[0, 4] == 1
+
+
+def test_id_kept_across_skipped_detections():
+    t = Tracker(detect_interval=3)
+    seen = set()
+    for f in range(30):
+        x = 100 + 8 * f
+        out = t.update([box(x, 300)]) if f % 3 == 0 else t.predict()
+        if f < 3: continue  # ยังไม่ยืนยัน Track (min_hits)
+        assert len(out) == 1, f"frame {f}"
+        seen.add(int(out[0, 4]))
+        # เฟรมที่ข้าม Detector กล่องยังเลื่อนตามความเร็ว (ห่างจากตำแหน่งจริงไม่เกินครึ่งความกว้าง)
+        if f > 9: assert abs((out[0, 0] + out[0, 2]) / 2 - x) < 30, f"frame {f}"
+    assert seen == {1}
+
+
+def test_track_dropped_after_max_age():
+    t = Tracker(max_age=5)
+    t.update([box(100, 200)]); t.update([box(100, 200)])
+    for _ in range(5): t.update([])
+    assert len(t.ids) == 1
+    t.update([])
+    assert len(t.ids) == 0
+
+
+def test_ids_do_not_swap_when_paths_cross():
+    t = Tracker()
+    ids = None
+    for f in range(40):
+        # A เดินไปขวา B เดินไปซ้าย สวนกันกลางภาพ (y ต่างกันเล็กน้อย กล่องซ้อนกันหลายเฟรม)
+        a, b = box(100 + 10 * f, 300), box(500 - 10 * f, 320)
+        out = t.update([a, b] if f % 2 else [b, a])
+        if f < 2: continue
+        assert len(out) == 2, f"frame {f}"
+        id_a = int(out[np.argmin(np.abs(out[:, 0] - a[0]) + np.abs(out[:, 1] - a[1])), 4])
+        id_b = int(out[np.argmin(np.abs(out[:, 0] - b[0]) + np.abs(out[:, 1] - b[1])), 4])
+        if ids is None: ids = (id_a, id_b)
+        assert (id_a, id_b) == ids, f"frame {f}"
+    assert ids[0] != ids[1]
+
+
+def test_ids_stay_separate_for_parallel_walkers():
+    t = Tracker()
+    for f in range(20):
+        out = t.update([box(100 + 5 * f, 300), box(400 + 5 * f, 300)])
+    assert ids_by_x(out) == [1, 2]
@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+import pytest
+
+from config import UNIFORM_COLORS
+from uniform import COLOR_BITS, COLOR_LUT, LUT_BITS, UniformClassifier
+
+RED, GRAY = (0, 0, 255), (128, 128, 128)
+BOX = (320, 240, 100, 300)  # cx, cy, w, h
+
+
+def in_range(img, name):
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    mask = np.zeros(img.shape[:2], dtype=bool)
+    for lower, upper in UNIFORM_COLORS[name]: mask |= cv2.inRange(hsv, np.array(lower), np.array(upper)) > 0
+    return mask
+
+
+def lut(img, name):
+    q = img >> (8 - LUT_BITS)
+    return (COLOR_LUT[q[..., 0], q[..., 1], q[..., 2]] & COLOR_BITS[name]) != 0
+
+
+def frame(shirt):
+    img = np.full((480, 640, 3), GRAY, dtype=np.uint8)
+    cx, cy, w, h = BOX
+    img[int(cy - h * 0.45):int(cy + h * 0.15), int(cx - w * 0.3):int(cx + w * 0.3)] = shirt
+    return img
+
+
+@pytest.mark.parametrize("name", list(COLOR_BITS))
+def test_lut_matches_in_range_at_cell_centres(name):
+    step = 256 >> LUT_BITS
+    axis = np.arange(1 << LUT_BITS, dtype=np.uint8) * step + step // 2
+    b, g, r = np.meshgrid(axis, axis, axis, indexing='ij')
+    img = np.stack((b, g, r), axis=-1).reshape(-1, 1 << LUT_BITS, 3)
+    assert (lut(img, name) == in_range(img, name)).all()
+
+
+@pytest.mark.parametrize("name", list(COLOR_BITS))
+def test_lut_agrees_with_in_range_on_random_pixels(name):
+    img = np.random.default_rng(0).integers(0, 256, (256, 256, 3), dtype=np.uint8)
+    # ต่างกันได้เฉพาะพิกเซลใกล้ขอบช่วงสี (LUT ปัดเหลือ 32 ระดับต่อช่อง)
+    assert (lut(img, name) == in_range(img, name)).mean() >= 0.98
+
+
+def test_roi_ratio_matches_in_range():
+    img = np.random.default_rng(1).integers(0, 256, (200, 200, 3), dtype=np.uint8)
+    img[50:150, 50:150] = RED
+    clf = UniformClassifier(sample=200)
+    rois = [(0, 0, 200, 200), (50, 50, 150, 150), (0, 0, 40, 40), (10, 10, 10, 10)]
+    ratios = clf.roi_ratios(img, rois, COLOR_BITS["Red"])
+    expected = [in_range(img[y1:y2, x1:x2], "Red").mean() if x2 > x1 else 0 for x1, y1, x2, y2 in rois]
+    assert np.allclose(ratios, expected, atol=0.02)
+
+
+def classify(clf, img, tid=1, vote=True, color="Red"):
+    return clf.classify(img, np.array([BOX], dtype=float), [tid], color, vote=vote)[tid]
+
+
+def test_staff_after_votes():
+    clf = UniformClassifier(votes=5)
+    for _ in range(5): assert classify(clf, frame(RED)) == "staff"
+    assert clf.info[1] == {"role": "staff", "confidence": 1.0, "votes": 5, "staff": 5}
+    # โหวตครบแล้วไม่เปลี่ยนอีก
+    assert classify(clf, frame(GRAY)) == "staff" and clf.info[1]["votes"] == 5
+
+
+def test_majority_vote():
+    clf = UniformClassifier(votes=5)
+    for shirt in (RED, GRAY, RED, GRAY, RED): classify(clf, frame(shirt))
+    assert clf.info[1]["role"] == "staff" and clf.info[1]["confidence"] == 0.6
+    clf = UniformClassifier(votes=5)
+    for shirt in (GRAY, RED, GRAY, RED, GRAY): classify(clf, frame(shirt))
+    assert clf.info[1]["role"] == "customer" and clf.info[1]["confidence"] == 0.6
+
+
+def test_tie_is_customer():
+    clf = UniformClassifier(votes=4)
+    for shirt in (RED, GRAY, RED, GRAY): classify(clf, frame(shirt))
+    assert clf.info[1]["role"] == "customer" and clf.info[1]["confidence"] == 0.5
+
+
+def test_no_vote_on_predicted_frames():
+    clf = UniformClassifier(votes=5)
+    assert classify(clf, frame(RED), vote=False) == "customer"
+    assert 1 not in clf.info
+    classify(clf, frame(RED))
+    classify(clf, frame(GRAY), vote=False)
+    assert clf.info[1]["votes"] == 1
+
+
+def test_forget_and_colour_change():
+    clf = UniformClassifier(votes=2)
+    classify(clf, frame(RED), tid=1)
+    classify(clf, frame(GRAY), tid=2)
+    clf.forget({2})
+    assert set(clf.info) == {2}
+    # เปลี่ยนสีชุดพนักงาน -> เริ่มโหวตใหม่ทั้งหมด
+    classify(clf, frame(RED), tid=2, color="Blue")
+    assert clf.info[2]["votes"] == 1 and clf.info[2]["role"] == "customer"
+    assert classify(clf, frame(RED), tid=3, color="None") == "customer"
@@ -0,0 +1,141 @@
+import numpy as np
+
+# ==========================================
+# 3.1 TRACKER (NumPy Kalman + IoU ต่อกล้อง)
+# ==========================================
+# State ของแต่ละ Track: [cx, cy, w, h, vx, vy, vw, vh] (ความเร็วคิดเป็นพิกเซลต่อเฟรม)
+_F = np.eye(8)
+_F[:4, 4:] = np.eye(4)
+_H = np.eye(4, 8)
+STD_POS = 1.0 / 20
+STD_VEL = 1.0 / 160
+
+
+def iou_matrix(a, b):
+    """IoU ระหว่างกล่อง xyxy ทุกคู่ (a: Nx4, b: Mx4) -> NxM"""
+    if len(a) == 0 or len(b) == 0: return np.zeros((len(a), len(b)))
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:4] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:4] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def xyxy_to_cxcywh(b):
+    return np.column_stack(((b[:, 0] + b[:, 2]) / 2, (b[:, 1] + b[:, 3]) / 2, b[:, 2] - b[:, 0], b[:, 3] - b[:, 1]))
+
+
+def cxcywh_to_xyxy(b):
+    return np.column_stack((b[:, 0] - b[:, 2] / 2, b[:, 1] - b[:, 3] / 2, b[:, 0] + b[:, 2] / 2, b[:, 1] + b[:, 3] / 2))
+
+
+def _greedy_match(score, thresh, used_t, used_d):
+    """จับคู่แบบ Greedy เรียงจาก score มากไปน้อย (แก้ไข used_t/used_d ในตัว)"""
+    cand = np.argwhere((score >= thresh) & ~used_t[:, None] & ~used_d[None, :])
+    cand = cand[np.argsort(-score[cand[:, 0], cand[:, 1]], kind='stable')]
+    pairs = []
+    for t, d in cand:
+        if used_t[t] or used_d[d]: continue
+        used_t[t] = used_d[d] = True
+        pairs.append((t, d))
+    return pairs
+
+
+class Tracker:
+    """Tracker ของกล้องตัวเดียว รับแค่ detection ดิบ [x1, y1, x2, y2, conf, ...]
+
+    - update(dets): ใช้ในเฟรมที่รัน detector (predict + จับคู่ + correct)
+    - predict(): ใช้ในเฟรมที่ข้าม detector เพื่อเลื่อนกล่องตามความเร็วที่ประมาณไว้
+    ผลลัพธ์ทั้งสองแบบเป็น array [x1, y1, x2, y2, track_id, score]
+    """
+    def __init__(self, iou_thresh=0.3, dist_thresh=0.5, max_age=30, min_hits=2, detect_interval=1):
+        self.iou_thresh = iou_thresh
+        self.dist_thresh = dist_thresh
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.detect_interval = max(1, int(detect_interval))
+        self.next_id = 1
+        self.ids = np.empty(0, dtype=int)
+        self.x = np.empty((0, 8))
+        self.P = np.empty((0, 8, 8))
+        self.hits = np.empty(0, dtype=int)
+        self.misses = np.empty(0, dtype=int)
+        self.scores = np.empty(0)
+
+    def _predict(self):
+        if not len(self.ids): return
+        h = self.x[:, 3]
+        q = np.column_stack([np.tile((STD_POS * h)[:, None], 4), np.tile((STD_VEL * h)[:, None], 4)]) ** 2
+        self.x = self.x @ _F.T
+        self.P = _F @ self.P @ _F.T
+        self.P[:, np.arange(8), np.arange(8)] += q
+        self.x[:, 2:4] = np.maximum(self.x[:, 2:4], 1.0)
+        self.misses += 1
+
+    def _correct(self, idx, z):
+        r = (STD_POS * self.x[idx, 3]) ** 2
+        P = self.P[idx]
+        S = _H @ P @ _H.T
+        S[:, np.arange(4), np.arange(4)] += r[:, None]
+        K = P @ _H.T @ np.linalg.inv(S)
+        y = z - self.x[idx, :4]
+        self.x[idx] += np.einsum('nij,nj->ni', K, y)
+        self.P[idx] = (np.eye(8) - K @ _H) @ P
+
+    def _spawn(self, z, scores):
+        n = len(z)
+        h = z[:, 3]
+        std = np.column_stack([np.tile((2 * STD_POS * h)[:, None], 4), np.tile((10 * STD_VEL * h)[:, None], 4)])
+        P = np.zeros((n, 8, 8))
+        P[:, np.arange(8), np.arange(8)] = std ** 2
+        self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + n)])
+        self.next_id += n
+        self.x = np.concatenate([self.x, np.column_stack([z, np.zeros((n, 4))])])
+        self.P = np.concatenate([self.P, P])
+        self.hits = np.concatenate([self.hits, np.ones(n, dtype=int)])
+        self.misses = np.concatenate([self.misses, np.zeros(n, dtype=int)])
+        self.scores = np.concatenate([self.scores, scores])
+
+    def _prune(self):
+        keep = self.misses <= self.max_age
+        # Track ที่ยังไม่ยืนยัน (hits < min_hits) และหลุดการจับคู่ ให้ลบทิ้งทันที
+        keep &= (self.hits >= self.min_hits) | (self.misses < self.detect_interval)
+        if keep.all(): return
+        self.ids, self.x, self.P = self.ids[keep], self.x[keep], self.P[keep]
+        self.hits, self.misses, self.scores = self.hits[keep], self.misses[keep], self.scores[keep]
+
+    def _output(self):
+        live = (self.hits >= self.min_hits) & (self.misses < self.detect_interval)
+        if not live.any(): return np.empty((0, 6))
+        return np.column_stack([cxcywh_to_xyxy(self.x[live, :4]), self.ids[live], self.scores[live]])
+
+    def predict(self):
+        self._predict()
+        self._prune()
+        return self._output()
+
+    def update(self, dets):
+        self._predict()
+        dets = np.asarray(dets, dtype=float)
+        if dets.ndim != 2: dets = dets.reshape(-1, 6)
+        matched_det = np.zeros(len(dets), dtype=bool)
+        if len(self.ids) and len(dets):
+            used_t = np.zeros(len(self.ids), dtype=bool)
+            # รอบแรกจับคู่ด้วย IoU รอบสองใช้ระยะห่างจุดกึ่งกลาง (เทียบกับความสูงกล่อง) สำหรับคนที่เดินเร็ว/ข้ามหลายเฟรม
+            iou = iou_matrix(cxcywh_to_xyxy(self.x[:, :4]), dets[:, :4])
+            pairs = _greedy_match(iou, self.iou_thresh, used_t, matched_det)
+            centers = xyxy_to_cxcywh(dets[:, :4])[:, :2]
+            dist = np.linalg.norm(self.x[:, None, :2] - centers[None, :, :], axis=2) / self.x[:, 3:4]
+            pairs += _greedy_match(-dist, -self.dist_thresh, used_t, matched_det)
+            if pairs:
+                t_idx, d_idx = np.array(pairs).T
+                self._correct(t_idx, xyxy_to_cxcywh(dets[d_idx, :4]))
+                self.hits[t_idx] += 1
+                self.misses[t_idx] = 0
+                self.scores[t_idx] = dets[d_idx, 4]
+        if (~matched_det).any():
+            new = dets[~matched_det]
+            self._spawn(xyxy_to_cxcywh(new[:, :4]), new[:, 4])
+        self._prune()
+        return self._output()
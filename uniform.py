@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+
+from config import UNIFORM_COLORS
+
+# ==========================================
+# 3.4 UNIFORM CLASSIFIER (แยกพนักงาน/ลูกค้าจากสีชุด)
+# ==========================================
+LUT_BITS = 5  # ลดสีเหลือ 32 ระดับต่อช่อง -> ตาราง 32x32x32
+COLOR_BITS = {name: 1 << i for i, name in enumerate(n for n, r in UNIFORM_COLORS.items() if r)}
+
+
+def build_color_lut(colors=UNIFORM_COLORS, bits=LUT_BITS):
+    """ตาราง BGR -> bitmask ของสีใน UNIFORM_COLORS (ช่วง HSV เดียวกับที่ใช้ inRange) คำนวณครั้งเดียวตอน import"""
+    levels = 1 << bits
+    step = 256 // levels
+    axis = np.arange(levels, dtype=np.uint8) * step + step // 2
+    b, g, r = np.meshgrid(axis, axis, axis, indexing='ij')
+    bgr = np.stack((b, g, r), axis=-1).reshape(1, -1, 3)
+    hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV).reshape(-1, 3)
+    lut = np.zeros(len(hsv), dtype=np.uint8)
+    for name, bit in COLOR_BITS.items():
+        for lower, upper in colors[name]:
+            inside = np.all((hsv >= lower) & (hsv <= upper), axis=1)
+            lut[inside] |= bit
+    return lut.reshape(levels, levels, levels)
+
+
+COLOR_LUT = build_color_lut()
+
+
+class UniformClassifier:
+    """จัดกลุ่ม staff/customer ให้ Track ใหม่ทุกตัวในเฟรมพร้อมกัน แล้วโหวตจาก votes เฟรมแรกของแต่ละ Track
+
+    info[track_id] = {"role", "confidence", "votes"} โดย confidence = สัดส่วนโหวตที่ตรงกับ role ปัจจุบัน
+    """
+    def __init__(self, votes=5, sample=24):
+        self.votes = max(1, int(votes))
+        self.sample = sample  # สุ่มพิกเซลไม่เกิน sample x sample ต่อ ROI
+        self.info = {}
+        self.color = None
+
+    def reset(self):
+        self.info = {}
+
+    def roi_ratios(self, frame, rois, bit):
+        """สัดส่วนพิกเซลที่เป็นสี bit ในแต่ละ ROI: รวมพิกเซลทุก ROI แล้วเปิด LUT ครั้งเดียว"""
+        chunks, seg = [], []
+        for i, (x1, y1, x2, y2) in enumerate(rois):
+            if x2 <= x1 or y2 <= y1: continue
+            sy, sx = max(1, (y2 - y1) // self.sample), max(1, (x2 - x1) // self.sample)
+            px = frame[y1:y2:sy, x1:x2:sx].reshape(-1, 3)
+            chunks.append(px)
+            seg.append(np.full(len(px), i))
+        if not chunks: return np.zeros(len(rois))
+        px = np.concatenate(chunks) >> (8 - LUT_BITS)
+        seg = np.concatenate(seg)
+        hit = (COLOR_LUT[px[:, 0], px[:, 1], px[:, 2]] & bit) != 0
+        total = np.bincount(seg, minlength=len(rois))
+        return np.bincount(seg, weights=hit, minlength=len(rois)) / np.maximum(total, 1)
+
+    def classify(self, frame, boxes, ids, color_name, vote=True):
+        """boxes เป็น [cx, cy, w, h] ตามลำดับ ids คืนค่า dict track_id -> 'staff'/'customer'"""
+        if color_name != self.color: self.reset(); self.color = color_name
+        bit = COLOR_BITS.get(color_name)
+        if not bit: return {tid: 'customer' for tid in ids}
+
+        # เลือกเฉพาะ Track ที่ยังโหวตไม่ครบ
+        pending = [i for i, tid in enumerate(ids) if tid not in self.info or self.info[tid]['votes'] < self.votes]
+        if vote and pending:
+            fh, fw = frame.shape[:2]
+            b = np.asarray(boxes, dtype=np.float32)[pending]
+            cx, cy, w, h = b.T
+            x1, x2 = np.clip(cx - w * 0.25, 0, fw).astype(int), np.clip(cx + w * 0.25, 0, fw).astype(int)
+            torso = np.column_stack((x1, np.clip(cy - h * 0.4, 0, fh).astype(int), x2, np.clip(cy + h * 0.1, 0, fh).astype(int)))
+            if color_name == "Black":
+                legs = np.column_stack((x1, np.clip(cy + h * 0.1, 0, fh).astype(int), x2, np.clip(cy + h * 0.45, 0, fh).astype(int)))
+                ratios = self.roi_ratios(frame, np.vstack((torso, legs)), bit).reshape(2, -1)
+                staff = (ratios[0] > 0.4) & (ratios[1] > 0.4)
+            else:
+                staff = self.roi_ratios(frame, torso, bit) > 0.3
+
+            for i, is_staff in zip(pending, staff):
+                rec = self.info.setdefault(ids[i], {"role": "customer", "confidence": 0.0, "votes": 0, "staff": 0})
+                rec['votes'] += 1
+                rec['staff'] += int(is_staff)
+                # เสมอกันให้เป็นลูกค้า (ไม่ตัดคนออกจากยอดนับ)
+                rec['role'] = 'staff' if rec['staff'] * 2 > rec['votes'] else 'customer'
+                agree = rec['staff'] if rec['role'] == 'staff' else rec['votes'] - rec['staff']
+                rec['confidence'] = round(agree / rec['votes'], 2)
+        return {tid: self.info[tid]['role'] if tid in self.info else 'customer' for tid in ids}
+
+    def forget(self, active_ids):
+        for tid in list(self.info):
+            if tid not in active_ids: del self.info[tid]
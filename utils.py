@@ -10,7 +10,16 @@ logger = logging.getLogger(__name__)
 # ==========================================
 # 2. SYSTEM MONITOR
 # ==========================================
-def get_hw_stats():
+_hw_cache = {"ts": 0.0, "value": None}
+
+def get_hw_stats(max_age=2.0):
+    # อ่านเซนเซอร์ไม่เกินทุก max_age วินาที (ทุก Dashboard ที่เปิดอยู่ใช้ค่าเดียวกัน)
+    now = time.monotonic()
+    if _hw_cache["value"] is None or now - _hw_cache["ts"] > max_age:
+        _hw_cache["value"], _hw_cache["ts"] = read_hw_stats(), now
+    return _hw_cache["value"]
+
+def read_hw_stats():
     cpu = psutil.cpu_percent(interval=None)
     ram = psutil.virtual_memory().percent
     disk = psutil.disk_usage('.').percent
@@ -38,4 +47,11 @@ def monitor_loop():
         network_status['vpn'] = check_ping(system_settings.get('vpn_server_ip', '10.200.0.1'))
         time.sleep(10)
 
-threading.Thread(target=monitor_loop, daemon=True).start()
+_started = False
+
+def start():
+    """เริ่มตรวจ Internet / VPN เบื้องหลัง เรียกจาก main.py เท่านั้น (import ใน Worker Process หรือเครื่องมือ CLI ไม่เริ่ม Thread)"""
+    global _started
+    if _started: return
+    _started = True
+    threading.Thread(target=monitor_loop, name="net-monitor", daemon=True).start()
@@ -0,0 +1,259 @@
+import multiprocessing as mp
+import threading
+import time
+import logging
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+import numpy as np
+
+from config import cameras_config, save_cameras_config
+from camera import SmartCamera, VideoCaptureThread, record_event
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 5. CAMERA WORKER PROCESSES
+# ==========================================
+# ใช้ spawn ทุกแพลตฟอร์ม: fork จาก Process ที่มีหลาย Thread (MQTT, Scheduler, Flask) เสี่ยง Lock ค้างใน Child
+ctx = mp.get_context("spawn")
+DISPLAY_MAX = (1280, 640)  # ภาพแสดงผลกว้าง 640 สูงได้สูงสุด 1280
+
+
+class SharedFrame:
+    """ภาพแสดงผลล่าสุดของกล้องหนึ่งตัวใน shared_memory ป้องกันการอ่านขณะเขียนด้วย sequence (seqlock)
+
+    header = [seq, h, w] โดย seq เป็นเลขคี่ระหว่างที่กำลังเขียน
+    """
+    HEADER = 32
+
+    def __init__(self, name=None):
+        size = self.HEADER + DISPLAY_MAX[0] * DISPLAY_MAX[1] * 3
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.shm.name
+        self.header = np.ndarray((3,), dtype=np.int64, buffer=self.shm.buf)
+        self.data = np.ndarray((size - self.HEADER,), dtype=np.uint8, buffer=self.shm.buf, offset=self.HEADER)
+        self.last_seq, self.last_frame = -1, None
+
+    def write(self, frame):
+        h, w = frame.shape[:2]
+        if h > DISPLAY_MAX[0] or w > DISPLAY_MAX[1]: return
+        self.header[0] += 1
+        self.data[:frame.size] = frame.reshape(-1)
+        self.header[1:3] = (h, w)
+        self.header[0] += 1
+
+    def read(self):
+        for _ in range(10):
+            seq = int(self.header[0])
+            if seq == 0: return None
+            if seq % 2: time.sleep(0.001); continue
+            if seq == self.last_seq: return self.last_frame
+            h, w = int(self.header[1]), int(self.header[2])
+            frame = self.data[:h * w * 3].copy().reshape(h, w, 3)
+            if int(self.header[0]) == seq:
+                self.last_seq, self.last_frame = seq, frame
+                return frame
+        return self.last_frame
+
+    def close(self, unlink=False):
+        try:
+            self.shm.close()
+            if unlink: self.shm.unlink()
+        except Exception: pass
+
+
+def worker_main(cams, cmd_q, event_q):
+    """Entry point ของ Worker Process: รันกล้องตามรายการ ส่งเฉพาะ Event และ stats กลับทาง Queue
+    stats = ยอดล่าสุดที่ Process หลักรู้ (Worker ที่ถูกเริ่มใหม่นับต่อจากเดิม)"""
+    running, slots = {}, {}
+    for cam_id, url, config, shm_name, stats in cams:
+        slots[cam_id] = SharedFrame(shm_name)
+        cam = SmartCamera(cam_id, url, config)
+        cam.stats.update(stats)
+        cam.event_sink = lambda payload, cid=cam_id: event_q.put(("event", cid, payload))
+        cam.frame_sink = slots[cam_id].write
+        running[cam_id] = cam
+        cam.start()
+
+    def report_stats():
+        while running:
+            for cam_id, cam in list(running.items()):
+                event_q.put(("stats", cam_id, dict(cam.stats), dict(cam.motion_gate.stats)))
+            time.sleep(1)
+    threading.Thread(target=report_stats, name="worker-stats", daemon=True).start()
+
+    while running:
+        cmd, cam_id, arg = cmd_q.get()
+        cam = running.get(cam_id)
+        if cam is None: continue
+        if cmd == "config": cam.apply_config(arg)
+        elif cmd == "viewers": cam.viewers = arg
+        elif cmd == "stop":
+            cam.stop(); cam.join()
+            del running[cam_id]
+            slots.pop(cam_id).close()
+            event_q.put(("stopped", cam_id, None))
+
+
+class RemoteCamera:
+    """ตัวแทนของ SmartCamera ที่รันใน Worker Process ให้ฝั่งเว็บใช้งานได้เหมือนเดิม (stats, config, get_frame)"""
+    def __init__(self, worker, cam_id, url, config):
+        self.worker = worker
+        self.cam_id = cam_id
+        self.rtsp_url = url
+        self.config = config
+        self.stats = {"in": 0, "out": 0, "staff_in": 0, "staff_out": 0, "checkout": 0, "zones": {}}
+        self.motion_gate = SimpleNamespace(stats={"frames": 0, "gated": 0})
+        self.slot = SharedFrame()
+        self.running = True
+        self.stopped = threading.Event()
+        self.viewers = 0
+        # lock ครอบทั้งจำนวนคนดูและการอ่าน/ปิด self.slot (ห้ามแตะ numpy view หลัง unmap)
+        self.lock = threading.Lock()
+
+    def start(self): pass
+    def stop(self):
+        self.running = False
+        self.worker.cmd_q.put(("stop", self.cam_id, None))
+    def join(self, timeout=10): self.stopped.wait(timeout)
+
+    def update_config(self, new_config):
+        self.config.update(new_config)
+        cameras_config[self.cam_id]['config'] = self.config
+        save_cameras_config()
+        self.worker.cmd_q.put(("config", self.cam_id, dict(new_config)))
+
+    def add_viewer(self): self._set_viewers(1)
+    def remove_viewer(self): self._set_viewers(-1)
+    def _set_viewers(self, delta):
+        # Worker วาดภาพลง shared memory เฉพาะตอนที่มีคนดูอยู่
+        with self.lock:
+            self.viewers = max(0, self.viewers + delta)
+            if self.running: self.worker.cmd_q.put(("viewers", self.cam_id, self.viewers))
+        self.release_slot()
+
+    def release_slot(self):
+        """unmap shared memory เมื่อ Worker หยุดกล้องแล้ว และ Streamer เลิกติดตามครบทุกคน"""
+        with self.lock:
+            if self.slot is None or not self.stopped.is_set() or self.viewers > 0: return
+            self.slot.close(unlink=True)
+            self.slot = None
+
+    def frame_version(self):
+        with self.lock:
+            if not self.running or self.slot is None: return None
+            seq = int(self.slot.header[0])
+            return seq if seq else None
+
+    def get_frame(self):
+        with self.lock:
+            if not self.running or self.slot is None: return None
+            frame = self.slot.read()
+        return frame.copy() if frame is not None else None
+
+    def get_snapshot(self):
+        # เปิด Main stream ชั่วคราวจากฝั่ง Process หลัก
+        main = VideoCaptureThread(self.rtsp_url, ring_size=2)
+        try:
+            item = main.read()
+            return item.image.copy() if item else None
+        finally:
+            main.release()
+
+
+class CameraWorker:
+    def __init__(self, cams):
+        self.proxies = [RemoteCamera(self, cam_id, url, config if config else {"name": f"Camera {cam_id}"}) for cam_id, url, config in cams]
+        self.proc, self.started = None, 0.0
+        self.spawn()
+
+    def live(self):
+        return [p for p in self.proxies if p.running]
+
+    def spawn(self):
+        """เริ่ม Process สำหรับกล้องที่ยังไม่ถูกสั่งหยุด (ใช้ทั้งตอนเริ่มและตอน Worker ตาย) ด้วย Queue ใหม่
+        เผื่อ Process เดิมตายระหว่างถือ lock ของ Queue"""
+        live = self.live()
+        self.cmd_q = ctx.Queue()
+        args = [(p.cam_id, p.rtsp_url, p.config, p.slot.name, dict(p.stats)) for p in live]
+        self.proc = ctx.Process(target=worker_main, args=(args, self.cmd_q, event_queue()), daemon=True, name=f"worker-{'-'.join(p.cam_id for p in live)}")
+        self.proc.start()
+        self.started = time.monotonic()
+        for p in live:
+            with p.lock:
+                if p.viewers: self.cmd_q.put(("viewers", p.cam_id, p.viewers))
+
+
+_event_q = None
+_proxies = {}
+_workers = []
+_monitor = None
+_lock = threading.Lock()
+RESTART_MIN_INTERVAL = 10.0  # Worker ที่ตายซ้ำ ๆ เริ่มใหม่ได้ไม่เกินครั้งละ 10 วินาที
+
+def event_queue():
+    """Queue กลางที่ทุก Worker ส่ง Event/stats กลับมา พร้อม Thread ฝั่ง Process หลักที่คอยบันทึก"""
+    global _event_q
+    with _lock:
+        if _event_q is None:
+            _event_q = ctx.Queue()
+            threading.Thread(target=_event_loop, args=(_event_q,), name="worker-events", daemon=True).start()
+        return _event_q
+
+def _event_loop(q):
+    while True:
+        try:
+            kind, cam_id, data, *rest = q.get()
+            proxy = _proxies.get(cam_id)
+            if kind == "event": record_event(data)
+            elif proxy is None: continue
+            elif kind == "stats":
+                proxy.stats.update(data)
+                proxy.motion_gate.stats.update(rest[0])
+            elif kind == "stopped": _mark_stopped(proxy)
+        except Exception as e:
+            logger.exception(f"Worker event error: {e}")
+
+def _mark_stopped(proxy):
+    _proxies.pop(proxy.cam_id, None)
+    proxy.running = False
+    proxy.stopped.set()
+    proxy.release_slot()
+
+def _exit_reason(code):
+    return f"signal {-code}" if code is not None and code < 0 else f"exit code {code}"
+
+def _monitor_loop():
+    """ตรวจ Worker ทุก 2 วินาที: ตัวที่ตายทั้งที่ยังมีกล้องทำงานอยู่ให้เริ่มใหม่ (ไม่งั้นหน้าเว็บค้างภาพเดิมและ stats เก่า)"""
+    while True:
+        time.sleep(2)
+        with _lock: workers = list(_workers)
+        for worker in workers:
+            try:
+                if worker.proc.is_alive(): continue
+                # กล้องที่สั่งหยุดไปแล้วแต่ Worker ตายก่อนตอบ "stopped"
+                for p in worker.proxies:
+                    if not p.running and not p.stopped.is_set(): _mark_stopped(p)
+                live = worker.live()
+                if not live:
+                    with _lock: _workers.remove(worker)
+                    continue
+                if time.monotonic() - worker.started < RESTART_MIN_INTERVAL: continue
+                logger.error(f"Camera worker pid={worker.proc.pid} for {[p.cam_id for p in live]} died ({_exit_reason(worker.proc.exitcode)}). Restarting...")
+                worker.spawn()
+                logger.info(f"Restarted camera worker pid={worker.proc.pid} for {[p.cam_id for p in live]}")
+            except Exception as e:
+                logger.exception(f"Worker monitor error: {e}")
+
+def start_worker(cams):
+    """เริ่ม Worker Process หนึ่งตัวสำหรับกล้องกลุ่มนี้ คืนค่า RemoteCamera ตามลำดับ"""
+    global _monitor
+    worker = CameraWorker(cams)
+    for proxy in worker.proxies: _proxies[proxy.cam_id] = proxy
+    with _lock:
+        _workers.append(worker)
+        if _monitor is None:
+            _monitor = threading.Thread(target=_monitor_loop, name="worker-monitor", daemon=True)
+            _monitor.start()
+    logger.info(f"Started camera worker pid={worker.proc.pid} for {[p.cam_id for p in worker.proxies]}")
+    return worker.proxies